@@ -1,43 +1,147 @@
+import argparse
+import asyncio
+import collections
+import functools
+import itertools
+import os
+import queue
 import socket
+import stat
 import threading
 import struct
+import sys
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import time
 import traceback
 from typing import Dict, Any, List, Tuple, Optional
 
+from mcp_broker_compress import COMPRESSED_FLAG, COMPRESSION_HELLO, CompressionError, decode_frame
+from mcp_broker_metrics import BrokerMetrics, MetricsServer
+from mcp_broker_jsonrpc import (encode_message, parse_message, peek_message, initialize_key, MESSAGE_REQUEST,
+                                MESSAGE_RESPONSE)
+from mcp_log_rotation import parse_size
 
-# 配置日志系统
-def setup_logging():
-    # 创建主日志器
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
 
-    # 创建控制台处理器
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
+LOG_LEVELS = {
+    'DEBUG': logging.DEBUG,
+    'INFO': logging.INFO,
+    'WARNING': logging.WARNING,
+    'OFF': logging.CRITICAL + 1,
+}
 
-    # 创建文件处理器，支持日志轮转
-    file_handler = RotatingFileHandler(
-        'logs/fastmcp_proxy.log',
-        maxBytes=10 * 1024 * 1024,  # 10MB
-        backupCount=5
-    )
-    file_handler.setLevel(logging.DEBUG)
+# 抓包记录的方向, 与 mcp_broker_capture 中的定义一致
+CAPTURE_CLIENT_TO_SERVER = 0
+CAPTURE_SERVER_TO_CLIENT = 1
 
-    # 创建格式化器
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+# 异步日志的后台写线程, 由 shutdown_logging 停止
+_log_listener: Optional[QueueListener] = None
+
+
+class HexDump:
+    """延迟生成十六进制转储, 只有日志真正被格式化时才计算 data.hex()"""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __str__(self) -> str:
+        return self.data.hex()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """非阻塞日志入队处理器
+
+    转发线程只把日志记录放入有界队列, 消息格式化推迟到后台写线程 (调用方需以 %-参数 传入不可变值);
+    队列满时丢弃记录并计数, 不阻塞转发。
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._drop_counter = itertools.count(1)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
 
-    # 为处理器设置格式化器
-    console_handler.setFormatter(formatter)
-    file_handler.setFormatter(formatter)
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped = next(self._drop_counter)
+
+
+class DropReportingListener(QueueListener):
+    """后台日志写线程, 发现有日志被丢弃时补写一条告警"""
+
+    def __init__(self, log_queue: queue.Queue, queue_handler: DroppingQueueHandler, *handlers):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self.reported = 0
+
+    def handle(self, record: logging.LogRecord) -> None:
+        dropped = self.queue_handler.dropped
+        if dropped != self.reported:
+            self.reported = dropped
+            super().handle(logging.makeLogRecord({
+                'name': 'main', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': "日志队列已满, 累计丢弃 %d 条日志", 'args': (dropped,),
+            }))
+        super().handle(record)
+
+
+# 配置日志系统
+def setup_logging(level: str = 'DEBUG', queue_size: int = 0, log_file: str = 'logs/fastmcp_proxy.log'):
+    """
+    配置日志系统
+
+    Args:
+        level: 文件日志级别 (DEBUG/INFO/WARNING/OFF), 控制台不低于 INFO
+        queue_size: 大于0时启用异步日志: 转发线程只入队, 由后台线程格式化并写入, 队列满时丢弃
+        log_file: 日志文件路径, 多进程模式下每个工作进程使用各自的文件
+    """
+    global _log_listener
 
-    # 为日志器添加处理器
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    file_level = LOG_LEVELS[level]
+    console_level = max(logging.INFO, file_level)
+
+    # 创建主日志器, 级别取处理器中的最低级别, 使不需要的日志在调用处就被过滤
+    logger = logging.getLogger()
+    logger.setLevel(min(file_level, console_level))
+
+    if file_level <= logging.CRITICAL:
+        # 创建控制台处理器
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(console_level)
+
+        # 创建文件处理器，支持日志轮转
+        file_handler = RotatingFileHandler(
+            log_file,
+            maxBytes=10 * 1024 * 1024,  # 10MB
+            backupCount=5
+        )
+        file_handler.setLevel(file_level)
+
+        # 创建格式化器
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
+
+        # 为处理器设置格式化器
+        console_handler.setFormatter(formatter)
+        file_handler.setFormatter(formatter)
+
+        # 为日志器添加处理器
+        if queue_size > 0:
+            log_queue = queue.Queue(maxsize=queue_size)
+            queue_handler = DroppingQueueHandler(log_queue)
+            _log_listener = DropReportingListener(log_queue, queue_handler, console_handler, file_handler)
+            _log_listener.start()
+            logger.addHandler(queue_handler)
+        else:
+            logger.addHandler(console_handler)
+            logger.addHandler(file_handler)
 
     # 创建各组件的日志器
     return {
@@ -49,25 +153,169 @@ def setup_logging():
     }
 
 
+def shutdown_logging() -> None:
+    """停止异步日志写线程, 写完队列中剩余的日志"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
+UNIX_SCHEME = 'unix://'
+
+
+def unix_path(host: str) -> Optional[str]:
+    """地址为 unix:///path 形式时返回Unix域套接字路径, 否则返回 None"""
+    return host[len(UNIX_SCHEME):] if host.startswith(UNIX_SCHEME) else None
+
+
+def format_endpoint(host: str, port: int) -> str:
+    """日志中显示的端点: host:port 或 unix:///path"""
+    return host if unix_path(host) is not None else f"{host}:{port}"
+
+
+def connect_endpoint(host: str, port: int, timeout: Optional[float] = None) -> socket.socket:
+    """连接 TCP 端点或 unix:///path 端点, 连接建立后恢复为阻塞模式
+
+    与上游同机部署时使用Unix域套接字, 省去回环TCP协议栈 (校验和、拥塞控制、ACK) 的开销。
+    """
+    path = unix_path(host)
+    if path is None:
+        sock = socket.create_connection((host, port), timeout=timeout)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            raise
+    sock.settimeout(None)
+    return sock
+
+
+def set_nodelay(sock: socket.socket) -> None:
+    """TCP 连接关闭 Nagle 算法, Unix域套接字没有该选项"""
+    if sock.family != socket.AF_UNIX:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def remove_stale_unix_socket(path: str) -> None:
+    """删除上次运行遗留的套接字文件, 路径上是普通文件时保留并由 bind 报错"""
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def listen_endpoint(host: str, port: int, backlog: int, reuse_port: bool = False) -> socket.socket:
+    """在 TCP 端点或 unix:///path 端点上监听"""
+    path = unix_path(host)
+    if path is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+    else:
+        remove_stale_unix_socket(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+    sock.listen(backlog)
+    return sock
+
+
+class FrameTooLargeError(ValueError):
+    """数据包长度超过允许的上限"""
+
+
+class MemoryBudget:
+    """帧缓冲的内存预算
+
+    - max_frame_size: 单帧上限, 超过即关闭连接, 防止按头部中的32位长度分配最多4GB内存
+    - connection_limit: 每个连接每个方向最多缓冲的字节数, 更大的帧分块流式转发 (需要整帧的模式下拒绝)
+    - total: 所有连接超出默认接收缓冲区的部分之和; 用尽时读取方等待其他连接释放内存,
+      即暂停从生产者读取 (背压), 等待超过 wait_timeout 秒后关闭连接
+    """
+
+    def __init__(self, total: int = 512 * 1024 * 1024, max_frame_size: int = 64 * 1024 * 1024,
+                 connection_limit: int = 4 * 1024 * 1024, wait_timeout: float = 30.0):
+        self.total = total
+        self.max_frame_size = max_frame_size
+        self.connection_limit = connection_limit
+        self.wait_timeout = wait_timeout
+        self.used = 0
+        self.waits = 0  # 因预算用尽而等待的次数
+        self._condition = threading.Condition()
+
+    def check_frame(self, length: int) -> None:
+        if length > self.max_frame_size:
+            raise FrameTooLargeError(f"数据包长度 {length} 超过上限 {self.max_frame_size}")
+
+    def try_reserve(self, size: int) -> bool:
+        with self._condition:
+            if self.used + size > self.total:
+                return False
+            self.used += size
+            return True
+
+    def reserve(self, size: int) -> None:
+        """预留内存, 预算不足时阻塞等待"""
+        with self._condition:
+            if self.used + size > self.total:
+                self.waits += 1
+                if not self._condition.wait_for(lambda: self.used + size <= self.total, self.wait_timeout):
+                    raise TimeoutError(f"等待内存预算超时: 需要={size}, 已用={self.used}, 总预算={self.total}")
+            self.used += size
+
+    async def reserve_async(self, size: int) -> None:
+        """asyncio版本的 reserve, 轮询等待不阻塞事件循环"""
+        if self.try_reserve(size):
+            return
+        self.waits += 1
+        deadline = time.monotonic() + self.wait_timeout
+        while not self.try_reserve(size):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"等待内存预算超时: 需要={size}, 已用={self.used}, 总预算={self.total}")
+            await asyncio.sleep(0.01)
+
+    def release(self, size: int) -> None:
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+    def snapshot(self) -> dict:
+        return {'total': self.total, 'used': self.used, 'waits': self.waits}
+
+
 class FastMCPPacket:
     """FastMCP数据包处理类"""
 
-    def __init__(self, loggers):
+    # 头部格式: 协议版本(2字节) + 数据包类型(2字节) + 数据长度(4字节), 大端序
+    HEADER = struct.Struct('>HHI')
+    HEADER_SIZE = HEADER.size
+    DEFAULT_MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, loggers, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE):
         self.logger = loggers['protocol']
+        self.max_frame_size = max_frame_size
 
     def read_header(self, sock: socket.socket) -> Tuple[int, int, int]:
         """读取数据包头部 (协议版本, 数据包类型, 数据长度)"""
         try:
             start_time = time.time()
-            header = sock.recv(8)
+            header = sock.recv(self.HEADER_SIZE)
             read_time = (time.time() - start_time) * 1000  # 毫秒
 
-            if len(header) < 8:
+            if len(header) < self.HEADER_SIZE:
                 raise EOFError("连接已关闭")
 
-            version, packet_type, length = struct.unpack('>HHI', header)
-            self.logger.debug(
-                f"读取头部: 版本={version}, 类型=0x{packet_type:04X}, 长度={length}, 耗时={read_time:.2f}ms")
+            version, packet_type, length = self.HEADER.unpack(header)
+            self.logger.debug("读取头部: 版本=%d, 类型=0x%04X, 长度=%d, 耗时=%.2fms",
+                              version, packet_type, length, read_time)
+            if length > self.max_frame_size:
+                raise FrameTooLargeError(f"数据包长度 {length} 超过上限 {self.max_frame_size}")
             return version, packet_type, length
         except Exception as e:
             self.logger.error(f"读取头部失败: {e}")
@@ -76,8 +324,8 @@ class FastMCPPacket:
     def write_header(self, version: int, packet_type: int, length: int) -> bytes:
         """写入数据包头部"""
         try:
-            header = struct.pack('>HHI', version, packet_type, length)
-            self.logger.debug(f"写入头部: 版本={version}, 类型=0x{packet_type:04X}, 长度={length}")
+            header = self.HEADER.pack(version, packet_type, length)
+            self.logger.debug("写入头部: 版本=%d, 类型=0x%04X, 长度=%d", version, packet_type, length)
             return header
         except Exception as e:
             self.logger.error(f"写入头部失败: {e}")
@@ -95,7 +343,7 @@ class FastMCPPacket:
                 data.extend(chunk)
             read_time = (time.time() - start_time) * 1000  # 毫秒
 
-            self.logger.debug(f"读取数据: 长度={length}, 耗时={read_time:.2f}ms")
+            self.logger.debug("读取数据: 长度=%d, 耗时=%.2fms", length, read_time)
             return bytes(data)
         except Exception as e:
             self.logger.error(f"读取数据失败: 长度={length}, 错误={e}")
@@ -106,7 +354,7 @@ class FastMCPPacket:
         try:
             version, packet_type, length = self.read_header(sock)
             data = self.read_data(sock, length)
-            self.logger.info(f"读取完整数据包: 类型=0x{packet_type:04X}, 长度={length}")
+            self.logger.info("读取完整数据包: 类型=0x%04X, 长度=%d", packet_type, length)
             return version, packet_type, data
         except Exception as e:
             self.logger.error(f"读取数据包失败: {e}")
@@ -117,14 +365,249 @@ class FastMCPPacket:
         try:
             start_time = time.time()
             header = self.write_header(version, packet_type, len(data))
-            sock.sendall(header + data)
+            self.send_buffers(sock, (header, data))
             write_time = (time.time() - start_time) * 1000  # 毫秒
 
-            self.logger.info(f"写入数据包: 类型=0x{packet_type:04X}, 长度={len(data)}, 耗时={write_time:.2f}ms")
+            self.logger.info("写入数据包: 类型=0x%04X, 长度=%d, 耗时=%.2fms", packet_type, len(data), write_time)
         except Exception as e:
             self.logger.error(f"写入数据包失败: 类型=0x{packet_type:04X}, 错误={e}")
             raise
 
+    def write_frame(self, sock: socket.socket, packet_type: int, frame: memoryview) -> None:
+        """原样转发已读取的完整帧(头部+数据), 不重新编码头部也不拷贝数据"""
+        try:
+            start_time = time.time()
+            sock.sendall(frame)
+            write_time = (time.time() - start_time) * 1000  # 毫秒
+
+            self.logger.info("转发数据包: 类型=0x%04X, 长度=%d, 耗时=%.2fms",
+                             packet_type, len(frame) - self.HEADER_SIZE, write_time)
+        except Exception as e:
+            self.logger.error(f"转发数据包失败: 类型=0x{packet_type:04X}, 错误={e}")
+            raise
+
+    @staticmethod
+    def send_buffers(sock: socket.socket, buffers) -> None:
+        """使用 sendmsg 分散/聚集写入多个缓冲区, 避免 header + data 的拼接拷贝"""
+        if not hasattr(sock, 'sendmsg'):  # Windows 不支持 sendmsg
+            for buffer in buffers:
+                sock.sendall(buffer)
+            return
+
+        views = [memoryview(buffer).cast('B') for buffer in buffers if len(buffer)]
+        while views:
+            sent = sock.sendmsg(views)
+            # 丢弃已完整发送的缓冲区, 截断部分发送的缓冲区
+            while views and sent >= len(views[0]):
+                sent -= len(views.pop(0))
+            if sent:
+                views[0] = views[0][sent:]
+
+    async def read_header_async(self, reader: asyncio.StreamReader) -> Tuple[int, int, int]:
+        """从asyncio流中读取数据包头部 (协议版本, 数据包类型, 数据长度)"""
+        try:
+            header = await reader.readexactly(self.HEADER_SIZE)
+        except asyncio.IncompleteReadError as e:
+            raise EOFError("连接已关闭") from e
+        version, packet_type, length = self.HEADER.unpack(header)
+        if length > self.max_frame_size:
+            raise FrameTooLargeError(f"数据包长度 {length} 超过上限 {self.max_frame_size}")
+        return version, packet_type, length
+
+    async def read_data_async(self, reader: asyncio.StreamReader, length: int) -> bytes:
+        """从asyncio流中读取数据包数据部分"""
+        try:
+            return await reader.readexactly(length) if length else b''
+        except asyncio.IncompleteReadError as e:
+            raise EOFError("连接已关闭") from e
+
+    async def read_packet_async(self, reader: asyncio.StreamReader) -> Tuple[int, int, bytes]:
+        """从asyncio流中读取完整数据包"""
+        version, packet_type, length = await self.read_header_async(reader)
+        data = await self.read_data_async(reader, length)
+        self.logger.debug("读取完整数据包: 类型=0x%04X, 长度=%d", packet_type, length)
+        return version, packet_type, data
+
+    async def relay_stream_async(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                                 version: int, packet_type: int, length: int,
+                                 chunk_size: int = 64 * 1024, first: bytes = b'') -> None:
+        """头部已读取的大包: 分块从 reader 转发到 writer, 每块等待 drain, 对端接收慢时暂停读取
+
+        first 为调用方已经从 reader 读出的开头部分。
+        """
+        writer.write(self.write_header(version, packet_type, length))
+        if first:
+            writer.write(first)
+        remaining = length - len(first)
+        while remaining:
+            chunk = await reader.read(min(remaining, chunk_size))
+            if not chunk:
+                raise EOFError("连接已关闭: 数据包不完整")
+            writer.write(chunk)
+            await writer.drain()
+            remaining -= len(chunk)
+
+    async def write_packet_async(self, writer: asyncio.StreamWriter, version: int, packet_type: int,
+                                 data: bytes) -> None:
+        """向asyncio流写入完整数据包, 头部与数据分开写入以避免拼接拷贝"""
+        header = self.write_header(version, packet_type, len(data))
+        writer.writelines((header, data))
+        await writer.drain()
+
+
+class FastMCPFrameReader:
+    """带复用接收缓冲区的FastMCP帧读取器
+
+    每次 recv_into 尽可能多地读取套接字中已有的数据, 然后从缓冲区中解析出所有完整帧,
+    以 (版本, 数据包类型, 数据) 的形式逐个返回, 数据是指向内部缓冲区的 memoryview 切片。
+    对于大量小包的场景, 平均每个包的系统调用次数远小于1, 且数据不再经过 bytearray -> bytes 拷贝。
+
+    注意: 返回的 memoryview 只在取下一帧之前有效, 需要保留时请自行 bytes() 拷贝。
+
+    指定 budget 时: 超过 max_frame_size 的帧抛出 FrameTooLargeError; 缓冲区扩容部分从全局预算中预留;
+    超过 connection_limit 的帧在 stream_large 为 True 时以数据 None 返回, 由调用方通过 relay_current
+    分块转发, 否则抛出 FrameTooLargeError。
+    """
+
+    DEFAULT_BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, sock: socket.socket, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 budget: Optional[MemoryBudget] = None, stream_large: bool = False):
+        self.sock = sock
+        self.buffer_size = buffer_size
+        self.budget = budget
+        self.stream_large = stream_large
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # 未解析数据起点
+        self._end = 0  # 已接收数据终点
+        self._frame_start = 0  # 最近一帧(含头部)的起点
+        self._reserved = 0  # 扩容时从全局预算中预留的字节数
+        self._stream_remaining = 0  # 正在流式转发的大帧尚未读取的数据字节数
+        self.current_length = 0  # 最近一帧的数据长度
+
+        # 统计信息
+        self.recv_calls = 0
+        self.frame_count = 0
+
+    def _fill(self, needed: int) -> bool:
+        """保证缓冲区能容纳 needed 字节的未解析数据, 然后执行一次 recv_into, 连接关闭时返回False"""
+        pending = self._end - self._start
+        if self._start and len(self._buffer) - self._start < needed:
+            # 把未解析的数据移动到缓冲区开头
+            self._view[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+
+        if len(self._buffer) < needed or (len(self._buffer) > self.buffer_size >= max(needed, pending)):
+            # 单帧超过缓冲区大小时按帧长一次性扩容, 大帧处理完后恢复默认大小
+            size = max(needed, self.buffer_size)
+            if self.budget:
+                self._release_reserved()
+                if size > self.buffer_size:
+                    self.budget.reserve(size - self.buffer_size)
+                    self._reserved = size - self.buffer_size
+            buffer = bytearray(size)
+            buffer[:pending] = self._view[self._start:self._end]
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+            self._start, self._end = 0, pending
+
+        received = self.sock.recv_into(self._view[self._end:])
+        self.recv_calls += 1
+        if not received:
+            return False
+        self._end += received
+        return True
+
+    def _release_reserved(self) -> None:
+        if self._reserved:
+            self.budget.release(self._reserved)
+            self._reserved = 0
+
+    @property
+    def current_frame(self) -> memoryview:
+        """最近返回的一帧的原始字节(头部+数据), 可直接用于原样转发"""
+        return self._view[self._frame_start:self._start]
+
+    @property
+    def current_prefix(self) -> memoryview:
+        """正在流式读取的大帧 (数据为 None 的帧) 已在缓冲区中的开头部分, 在 relay_current 之前有效"""
+        start = self._start + FastMCPPacket.HEADER_SIZE
+        return self._view[start:min(self._end, start + self.current_length)]
+
+    def _stream_chunks(self):
+        """逐块返回正在流式读取的大帧: 先是缓冲区中已有的头部与部分数据, 再按缓冲区大小读取剩余部分"""
+        header_size = FastMCPPacket.HEADER_SIZE
+        available = min(self._end - self._start, header_size + self._stream_remaining)
+        self._stream_remaining -= available - header_size
+        chunk, self._start = self._view[self._start:self._start + available], self._start + available
+        yield chunk
+        if not self._stream_remaining:
+            return  # 整帧已在缓冲区中 (单连接上限小于缓冲区时), 之后的字节属于下一帧, 留给 __iter__ 解析
+
+        # 缓冲区中的数据都属于本帧且已交出, 剩余部分从缓冲区开头接收
+        self._start = self._end = 0
+        while self._stream_remaining:
+            # 只读取本帧剩余部分, 不越过帧边界
+            received = self.sock.recv_into(self._view[:min(self._stream_remaining, len(self._buffer))])
+            self.recv_calls += 1
+            if not received:
+                raise EOFError("连接已关闭: 数据包不完整")
+            self._stream_remaining -= received
+            yield self._view[:received]
+
+    def relay_current(self, destination: socket.socket) -> None:
+        """把正在流式读取的大帧 (数据为 None 的帧) 连同头部分块转发到 destination, 内存占用不超过接收缓冲区
+
+        sendall 在对端接收慢时阻塞, 期间不会再从来源读取, 背压由此传递给生产者。
+        """
+        for chunk in self._stream_chunks():
+            destination.sendall(chunk)
+
+    def __iter__(self):
+        header_size = FastMCPPacket.HEADER_SIZE
+        unpack_from = FastMCPPacket.HEADER.unpack_from
+        budget = self.budget
+
+        try:
+            while True:
+                if self._end - self._start >= header_size:
+                    version, packet_type, length = unpack_from(self._buffer, self._start)
+                    frame_end = self._start + header_size + length
+                    if frame_end <= self._end:
+                        payload = self._view[self._start + header_size:frame_end]
+                        self._frame_start = self._start
+                        self._start = frame_end
+                        self.current_length = length
+                        self.frame_count += 1
+                        yield version, packet_type, payload
+                        continue
+                    if budget:
+                        budget.check_frame(length)
+                        if header_size + length > budget.connection_limit:
+                            if not self.stream_large:
+                                raise FrameTooLargeError(
+                                    f"数据包长度 {length} 超过单连接缓冲上限 {budget.connection_limit}")
+                            self._stream_remaining = length
+                            self.current_length = length
+                            self.frame_count += 1
+                            yield version, packet_type, None
+                            if self._stream_remaining:
+                                for _ in self._stream_chunks():
+                                    pass  # 调用方没有转发, 读取并丢弃
+                            continue
+                    needed = header_size + length
+                else:
+                    needed = header_size
+
+                if not self._fill(needed):
+                    if self._end > self._start:
+                        raise EOFError("连接已关闭: 数据包不完整")
+                    return
+        finally:
+            if budget:
+                self._release_reserved()
+
 
 class MCPFastClient:
     """MCP客户端连接到FastMCP服务"""
@@ -141,12 +624,11 @@ class MCPFastClient:
     def connect(self) -> None:
         """连接到FastMCP服务"""
         try:
-            self.logger.info(f"尝试连接到FastMCP服务: {self.host}:{self.port}")
+            self.logger.info(f"尝试连接到FastMCP服务: {format_endpoint(self.host, self.port)}")
             start_time = time.time()
 
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.settimeout(5)  # 设置连接超时时间
-            self.socket.connect((self.host, self.port))
+            self.socket = connect_endpoint(self.host, self.port, timeout=5)
+            self.socket.settimeout(5)  # 设置请求超时时间
 
             connect_time = (time.time() - start_time) * 1000  # 毫秒
             self.connected = True
@@ -177,23 +659,25 @@ class MCPFastClient:
             self.request_id += 1
 
             # 记录请求开始
-            self.logger.info(f"发送请求 #{self.request_id}: 类型=0x{packet_type:04X}, 长度={len(data)}")
-            self.logger.debug(f"请求 #{self.request_id} 数据: {data.hex()}")
+            self.logger.info("发送请求 #%d: 类型=0x%04X, 长度=%d", self.request_id, packet_type, len(data))
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("请求 #%d 数据: %s", self.request_id, HexDump(data))
 
             # 发送请求
             start_time = time.time()
             self.packet_processor.write_packet(self.socket, 1, packet_type, data)
             send_time = (time.time() - start_time) * 1000  # 毫秒
-            self.logger.debug(f"请求 #{self.request_id} 发送完成, 耗时={send_time:.2f}ms")
+            self.logger.debug("请求 #%d 发送完成, 耗时=%.2fms", self.request_id, send_time)
 
             # 接收响应
             start_time = time.time()
             version, response_type, response_data = self.packet_processor.read_packet(self.socket)
             receive_time = (time.time() - start_time) * 1000  # 毫秒
 
-            self.logger.info(
-                f"收到响应 #{self.request_id}: 类型=0x{response_type:04X}, 长度={len(response_data)}, 耗时={receive_time:.2f}ms")
-            self.logger.debug(f"响应 #{self.request_id} 数据: {response_data.hex()}")
+            self.logger.info("收到响应 #%d: 类型=0x%04X, 长度=%d, 耗时=%.2fms",
+                             self.request_id, response_type, len(response_data), receive_time)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("响应 #%d 数据: %s", self.request_id, HexDump(response_data))
 
             return response_type, response_data
         except Exception as e:
@@ -206,29 +690,105 @@ class FastMCPProxy:
     """FastMCP代理服务器"""
 
     def __init__(self, host: str = '0.0.0.0', port: int = 25577,
-                 target_host: str = 'localhost', target_port: int = 25578):
-        self.loggers = setup_logging()
+                 target_host: str = 'localhost', target_port: int = 25578,
+                 passthrough: bool = False, upstream_pool_size: int = 0, upstream_pool_max: int = 0,
+                 log_level: str = 'DEBUG', log_queue_size: int = 0,
+                 log_file: str = 'logs/fastmcp_proxy.log',
+                 capture_dir: Optional[str] = None,
+                 metrics_port: int = 0, metrics_json: Optional[str] = None,
+                 metrics_json_interval: float = 0, reuse_port: bool = False,
+                 backends: Optional[List[str]] = None, backends_file: Optional[str] = None,
+                 max_frame_size: int = FastMCPPacket.DEFAULT_MAX_FRAME_SIZE,
+                 connection_memory: int = 4 * 1024 * 1024, memory_budget: int = 512 * 1024 * 1024,
+                 cache=None, coalescer=None, compression=None, sampler=None, hedger=None,
+                 backend_options: Optional[dict] = None):
+        self.loggers = setup_logging(log_level, log_queue_size, log_file)
         self.host = host
         self.port = port
         self.target_host = target_host
         self.target_port = target_port
+        # 响应缓存 (ResponseCache): 白名单中的幂等请求命中时直接由代理返回
+        self.cache = cache
+        # 请求合并 (SingleFlight): 参数相同的在途请求只转发一次
+        self.coalescer = coalescer
+        # 帧压缩 (FrameCompression): 与上游或下游代理协商的逐连接流式压缩
+        self.compression = compression
+        # 尾部采样 (TailSampler): 只在慢调用、出错或随机采样时写出连接最近的数据包
+        self.sampler = sampler
+        # 对冲请求 (HedgedRequests): 白名单中的幂等请求超过延迟阈值未返回时发给另一个后端, 先返回者胜出
+        self.hedger = hedger
+        # 内存预算: 单帧上限、每个连接的缓冲上限 (更大的帧分块流式转发) 与全局缓冲预算
+        self.budget = MemoryBudget(memory_budget, max_frame_size, connection_memory)
+        # 多个上游副本: 每个新会话按未完成请求数选择后端, 未配置时所有会话连接 target_host:target_port
+        self.backends = None
+        if backends or backends_file:
+            from mcp_broker_backends import BackendSet
+            self.backends = BackendSet(backends or [], self.loggers, config_path=backends_file,
+                                       **(backend_options or {}))
+        # 纯透传模式: 不解析数据包, 直接在套接字之间搬运字节 (Linux 下使用 splice 零拷贝)
+        self.passthrough = passthrough
         self.server_socket = None
+        self._unix_clients = itertools.count(1)
+        # 运行指标始终开启, metrics_port 大于0时通过HTTP暴露, metrics_json 指定停止时写出的JSON快照
+        self.metrics = BrokerMetrics()
+        self.metrics_server = MetricsServer(self.metrics, port=metrics_port) if metrics_port else None
+        self.metrics_json = metrics_json
+        self.metrics_json_interval = metrics_json_interval
+        self.metrics.backends = self.backends
+        self.metrics.memory = self.budget
+        self.metrics.cache = self.cache
+        self.metrics.coalescer = self.coalescer
+        self.metrics.compression = self.compression.stats if self.compression else None
+        self.metrics.sampler = self.sampler
+        self.metrics.hedger = self.hedger
+        # 多进程模式下多个工作进程通过 SO_REUSEPORT 绑定同一端口, 由内核分配连接
+        self.reuse_port = reuse_port
+        # 上游连接池: 预热 upstream_pool_size 条上游连接, 会话仍然独占一条, 结束后留给 initialize 参数相同的
+        # 新会话复用; 连接总数不超过 upstream_pool_max。0 表示不使用, 每个会话自己建立上游连接
+        self.upstream_pool = None
+        if upstream_pool_size > 0:
+            from mcp_broker_pool import UpstreamPool
+            self.upstream_pool = UpstreamPool(target_host, target_port, self.loggers, size=upstream_pool_size,
+                                              metrics=self.metrics, budget=self.budget, compression=compression,
+                                              max_connections=upstream_pool_max)
+        self.metrics.upstream_pool = self.upstream_pool
+        # 二进制抓包: 原始帧追加写入分段文件, 可用 mcp_broker_capture.py 查询
+        self.capture = None
+        if capture_dir:
+            from mcp_broker_capture import CaptureWriter
+            self.capture = CaptureWriter(capture_dir)
         self.running = False
         self.client_handlers = {}  # 存储客户端处理器
 
+        # 连接池需要整帧改写 id, 抓包需要完整数据, 这两种模式下超过单连接缓冲上限的帧直接拒绝
+        self.stream_large_frames = not self.upstream_pool and not self.capture
+
         self.logger = self.loggers['main']
-        self.packet_processor = FastMCPPacket(self.loggers)
+        self.packet_processor = FastMCPPacket(self.loggers, max_frame_size)
 
     def start(self) -> None:
         """启动代理服务器"""
         try:
-            self.logger.info(
-                f"FastMCP代理服务器启动中: {self.host}:{self.port} -> {self.target_host}:{self.target_port}")
-
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            target = (', '.join(self.backends.backends) if self.backends
+                      else format_endpoint(self.target_host, self.target_port))
+            self.logger.info(f"FastMCP代理服务器启动中: {format_endpoint(self.host, self.port)} -> {target}")
+
+            self.server_socket = listen_endpoint(self.host, self.port, 5, reuse_port=self.reuse_port)
+
+            if self.upstream_pool:
+                self.upstream_pool.start()
+            if self.backends:
+                self.backends.start()
+
+            if self.metrics_server:
+                self.metrics_server.start()
+                self.logger.info(f"指标端点: http://{self.metrics_server.host}:{self.metrics_server.port}/metrics")
+            if self.metrics_json and self.metrics_json_interval > 0:
+                self.metrics.start_json_dumper(self.metrics_json, self.metrics_json_interval)
+            if self.sampler:
+                self.sampler.start()
+            if self.hedger:
+                self.hedger.start(self.backends, self.loggers, budget=self.budget, compression=self.compression)
 
             self.running = True
             self.logger.info(f"FastMCP代理服务器已启动，等待连接...")
@@ -236,7 +796,10 @@ class FastMCPProxy:
             while self.running:
                 try:
                     client_socket, client_address = self.server_socket.accept()
-                    client_id = f"{client_address[0]}_{client_address[1]}"
+                    if client_address:
+                        client_id = f"{client_address[0]}_{client_address[1]}"
+                    else:
+                        client_id = f"unix_{next(self._unix_clients)}"  # Unix域套接字的客户端没有地址
 
                     self.logger.info(f"新连接来自: {client_address}, 客户端ID={client_id}")
 
@@ -275,8 +838,31 @@ class FastMCPProxy:
                 self.logger.info("服务器套接字已关闭")
             except Exception as e:
                 self.logger.error(f"关闭服务器套接字时出错: {e}")
+            if unix_path(self.host) is not None:
+                remove_stale_unix_socket(unix_path(self.host))
+
+        if self.upstream_pool:
+            self.upstream_pool.close()
+        if self.backends:
+            self.backends.close()
+        if self.hedger:
+            self.hedger.close()
+
+        if self.capture:
+            self.capture.close()
+        if self.sampler:
+            self.sampler.close()
+
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.metrics_json:
+            try:
+                self.metrics.dump_json(self.metrics_json)
+            except OSError as e:
+                self.logger.error(f"写入指标快照失败: {e}")
 
         self.logger.info("FastMCP代理服务器已停止")
+        shutdown_logging()
 
 
 class ClientHandler:
@@ -287,34 +873,71 @@ class ClientHandler:
         self.client_socket = client_socket
         self.proxy = proxy
         self.server_socket = None
+        self.upstream = None  # 使用连接池时本会话独占的上游连接, 第一个消息到达时分配
+        self.initialize = None  # 客户端的 initialize 请求, 对冲请求的连接用它代为握手
+        self.backend = None  # 配置多个后端时本会话分配到的后端
+        self._backend_lock = threading.Lock()  # 两个转发线程都可能调用 stop, 保证后端只归还一次
         self.running = False
         self.logger = proxy.loggers['handler']
         self.packet_processor = proxy.packet_processor
-
-        # 性能监控
+        self._client_send_lock = threading.Lock()  # 共享上游连接的读取线程、缓存命中或合并响应会并发写客户端
+        self._server_send_lock = threading.Lock()  # 对冲请求先返回时, 对冲调度线程会向上游写取消通知
+        self._hedges: Dict[Any, Any] = {}  # 可对冲的在途请求: 请求id -> Hedge
+        self._hedged_out: Dict[Any, Any] = collections.OrderedDict()  # 对冲请求先返回的请求id, 丢弃主请求迟到的响应
+        self._cache_pending: Dict[Any, bytes] = {}  # 未命中缓存的请求: 请求id -> 缓存键
+        self._flight_pending: Dict[Any, bytes] = {}  # 本会话作为 leader 转发的可合并请求: 请求id -> 请求键
+        self._replies: Optional[queue.Queue] = None  # 合并请求的响应, 由本会话的写回线程写给客户端
+        self._replies_lock = threading.Lock()
+        self.upstream_codec = None  # 与上游协商压缩后的压缩上下文
+        self.client_codec = None  # 下游代理协商压缩后的压缩上下文, 写客户端时在 _client_send_lock 内编码
+
+        # 性能监控: 按 JSON-RPC id 把响应与请求配对, 计算请求到响应的延迟; 通知与服务器推送不参与配对
         self.request_count = 0
-        self.total_request_time = 0
+        self.metrics = proxy.metrics
+        self.latency = self.metrics.connection_opened(client_id)
+        self._inflight: Dict[Any, Tuple[int, int, int]] = {}  # 请求id -> (请求开始时间ns, 数据包类型, 熔断试探令牌)
+        self.sampler = proxy.sampler.open(client_id) if proxy.sampler else None
 
     def start(self) -> None:
         """启动客户端处理器"""
         try:
             self.logger.info(f"启动客户端处理器: 客户端ID={self.client_id}")
 
-            # 连接到目标服务器
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.connect((self.proxy.target_host, self.proxy.target_port))
+            if self.proxy.upstream_pool:
+                # 使用连接池中的上游连接 (第一个消息到达时分配), 响应由连接池的读取线程通过 deliver 写回,
+                # 只需要一个转发线程
+                self.running = True
+                self.forward_client_to_server()
+                return
 
+            # 连接到目标服务器
+            self.server_socket = self._connect_upstream()
+            compression = self.proxy.compression
+            if compression and compression.offers_to(self.backend):
+                self.upstream_codec = compression.offer(self.packet_processor, self.server_socket, self.logger)
             self.running = True
 
             # 创建两个线程分别处理客户端到服务器和服务器到客户端的数据传输
-            client_to_server = threading.Thread(
-                target=self.forward_client_to_server,
-                daemon=True
-            )
-            server_to_client = threading.Thread(
-                target=self.forward_server_to_client,
-                daemon=True
-            )
+            if self.proxy.passthrough:
+                client_to_server = threading.Thread(
+                    target=self.relay_raw,
+                    args=(self.client_socket, self.server_socket, "客户端到服务器"),
+                    daemon=True
+                )
+                server_to_client = threading.Thread(
+                    target=self.relay_raw,
+                    args=(self.server_socket, self.client_socket, "服务器到客户端"),
+                    daemon=True
+                )
+            else:
+                client_to_server = threading.Thread(
+                    target=self.forward_client_to_server,
+                    daemon=True
+                )
+                server_to_client = threading.Thread(
+                    target=self.forward_server_to_client,
+                    daemon=True
+                )
 
             client_to_server.start()
             server_to_client.start()
@@ -347,44 +970,144 @@ class ClientHandler:
             except Exception as e:
                 self.logger.error(f"关闭服务器套接字时出错 (客户端ID={self.client_id}): {e}")
 
+        if self.upstream:
+            self.proxy.upstream_pool.release(self, self.upstream)
+            self.upstream = None
+
+        with self._backend_lock:
+            backend, self.backend = self.backend, None
+        if backend:
+            self.proxy.backends.release(backend, len(self._inflight))
+
+        if self._flight_pending:
+            self.proxy.coalescer.abandon(self._flight_pending)
+        with self._replies_lock:
+            if self._replies is not None:
+                self._replies.put(None)
+        if self._hedges:
+            self.proxy.hedger.abandon(self)
+
         # 从代理中移除
         if self.client_id in self.proxy.client_handlers:
             del self.proxy.client_handlers[self.client_id]
 
         # 记录性能统计
+        self.metrics.connection_closed(self.client_id)
         if self.request_count > 0:
-            avg_time = self.total_request_time / self.request_count
+            stats = self.latency.snapshot()
+            avg_time = stats['sum_us'] / stats['count'] / 1000 if stats['count'] else 0.0
             self.logger.info(
-                f"客户端连接统计 (客户端ID={self.client_id}): 请求总数={self.request_count}, 平均请求时间={avg_time:.2f}ms")
+                f"客户端连接统计 (客户端ID={self.client_id}): 请求总数={self.request_count}, 平均请求时间={avg_time:.2f}ms, "
+                f"p99={stats['p99_us'] / 1000:.2f}ms")
+
+    def _connect_upstream(self) -> socket.socket:
+        """连接上游; 配置多个后端时选择负载最低的后端, 建连失败则换下一个"""
+        backends = self.proxy.backends
+        if backends is None:
+            start_time = time.perf_counter_ns()
+            server_socket = connect_endpoint(self.proxy.target_host, self.proxy.target_port)
+            self.metrics.record_upstream_connect((time.perf_counter_ns() - start_time) // 1000)
+            return server_socket
+
+        tried = []
+        while True:
+            backend = backends.acquire(tried)  # 所有后端都失败时抛出 ConnectionError
+            start_time = time.perf_counter_ns()
+            try:
+                server_socket = connect_endpoint(backend.host, backend.port, timeout=backends.connect_timeout)
+            except OSError as e:
+                self.logger.warning(f"连接后端 {backend.address} 失败 (客户端ID={self.client_id}): {e}")
+                backends.connect_failed(backend)
+                tried.append(backend)
+                continue
+            self.metrics.record_upstream_connect((time.perf_counter_ns() - start_time) // 1000)
+            self.backend = backend
+            self.logger.info(f"客户端ID={self.client_id} 分配到后端 {backend.address}")
+            return server_socket
 
     def forward_client_to_server(self) -> None:
         """转发客户端到服务器的数据"""
         self.logger.info(f"开始转发客户端到服务器的数据: 客户端ID={self.client_id}")
 
         try:
-            while self.running:
-                try:
-                    # 读取客户端数据包
-                    start_time = time.time()
-                    version, packet_type, data = self.packet_processor.read_packet(self.client_socket)
-                    read_time = (time.time() - start_time) * 1000  # 毫秒
-
-                    self.request_count += 1
-                    self.logger.info(
-                        f"客户端#{self.client_id} 请求 #{self.request_count}: 类型=0x{packet_type:04X}, 长度={len(data)}, 读取时间={read_time:.2f}ms")
-
-                    # 转发到服务器
-                    start_time = time.time()
-                    self.packet_processor.write_packet(self.server_socket, version, packet_type, data)
-                    write_time = (time.time() - start_time) * 1000  # 毫秒
-
-                    self.total_request_time += read_time + write_time
-                    self.logger.debug(f"转发请求 #{self.request_count} 到服务器, 写入时间={write_time:.2f}ms")
-
-                except EOFError:
-                    self.logger.info(f"客户端关闭连接: 客户端ID={self.client_id}")
+            # 读取客户端数据包, 一次recv可能解析出多个数据包
+            start_time = time.time()
+            frames = FastMCPFrameReader(self.client_socket, budget=self.proxy.budget,
+                                        stream_large=self.proxy.stream_large_frames)
+            for version, packet_type, data in frames:
+                read_time = (time.time() - start_time) * 1000  # 毫秒
+                length = frames.current_length
+                decoded = bool(version & COMPRESSED_FLAG)
+                if decoded:
+                    version, data = decode_frame(self.client_codec, version, data)
+                elif packet_type == COMPRESSION_HELLO and self.proxy.compression and data is not None:
+                    self._answer_compression(data)
+                    continue
+
+                self.request_count += 1
+                self.metrics.record_request(length)
+                if self.request_count == 1 and self.proxy.hedger and data is not None:
+                    message = parse_message(data)
+                    if initialize_key(message) is not None:
+                        self.initialize = message
+                cached = (self.proxy.cache.lookup(packet_type, data, self._cache_pending)
+                          if self.proxy.cache and data is not None else None)
+                coalesced = (cached is None and data is not None and self.proxy.coalescer is not None and
+                             self.proxy.coalescer.join(packet_type, data, functools.partial(
+                                 self._reply_coalesced, packet_type, time.perf_counter_ns()), self._flight_pending))
+                if coalesced and self.proxy.cache:
+                    self.proxy.cache.forget(data, self._cache_pending)
+                if cached is None and not coalesced:
+                    kind, request_id = peek_message(frames.current_prefix if data is None else data)
+                    if kind == MESSAGE_REQUEST:
+                        trial = self.proxy.backends.request_sent(self.backend) if self.backend else 0
+                        inflight = (time.perf_counter_ns(), packet_type, trial)
+                        self._inflight[request_id] = inflight
+                        if self.proxy.hedger and data is not None:
+                            # 在转发之前登记, 保证主请求的响应到达时一定能找到它
+                            self.proxy.hedger.track(self, version, packet_type, data, inflight)
+                if self.proxy.capture:
+                    self.proxy.capture.record(self.client_id, CAPTURE_CLIENT_TO_SERVER, version, packet_type, data)
+                if self.sampler:
+                    self.sampler.request(version, packet_type, data, length)
+                self.logger.info("客户端#%s 请求 #%d: 类型=0x%04X, 长度=%d, 读取时间=%.2fms",
+                                 self.client_id, self.request_count, packet_type, length, read_time)
+
+                # 转发到服务器
+                start_time = time.time()
+                if cached is not None:
+                    self._reply_locally(packet_type, time.perf_counter_ns(), *cached)
+                elif coalesced:
+                    pass  # 等待参数相同的在途请求的响应
+                elif self.proxy.upstream_pool:
+                    self.proxy.upstream_pool.submit(self, version, packet_type, data)
+                else:
+                    with self._server_send_lock:
+                        if data is None:
+                            # 超过单连接缓冲上限的大帧: 边读边转发, 不整帧缓冲
+                            frames.relay_current(self.server_socket)
+                        elif self.upstream_codec or decoded:
+                            self._send_packet(self.server_socket, self.upstream_codec, version, packet_type, data)
+                        else:
+                            self.packet_processor.write_frame(self.server_socket, packet_type, frames.current_frame)
+                write_time = (time.time() - start_time) * 1000  # 毫秒
+
+                self.logger.debug("转发请求 #%d 到服务器, 写入时间=%.2fms", self.request_count, write_time)
+
+                if not self.running:
                     break
+                start_time = time.time()
+            else:
+                self.logger.info(f"客户端关闭连接: 客户端ID={self.client_id}")
+        except EOFError:
+            self.logger.info(f"客户端关闭连接: 客户端ID={self.client_id}")
+        except FrameTooLargeError as e:
+            self.logger.warning(f"客户端发送的数据包过大, 关闭连接 (客户端ID={self.client_id}): {e}")
+        except CompressionError as e:
+            self.logger.warning(f"客户端发送的压缩帧无效, 关闭连接 (客户端ID={self.client_id}): {e}")
         except Exception as e:
+            if self.sampler:
+                self.sampler.failed(f"转发客户端到服务器数据时出错: {e}")
             self.logger.error(f"转发客户端到服务器数据时出错 (客户端ID={self.client_id}): {e}")
             self.logger.error(traceback.format_exc())  # 记录完整的异常堆栈
         finally:
@@ -395,41 +1118,442 @@ class ClientHandler:
         self.logger.info(f"开始转发服务器到客户端的数据: 客户端ID={self.client_id}")
 
         try:
-            while self.running:
-                try:
-                    # 读取服务器数据包
-                    start_time = time.time()
-                    version, packet_type, data = self.packet_processor.read_packet(self.server_socket)
-                    read_time = (time.time() - start_time) * 1000  # 毫秒
-
-                    self.logger.info(
-                        f"服务器响应客户端#{self.client_id} 请求 #{self.request_count}: 类型=0x{packet_type:04X}, 长度={len(data)}, 读取时间={read_time:.2f}ms")
-
-                    # 转发到客户端
+            # 读取服务器数据包, 一次recv可能解析出多个数据包
+            start_time = time.time()
+            frames = FastMCPFrameReader(self.server_socket, budget=self.proxy.budget,
+                                        stream_large=self.proxy.stream_large_frames)
+            for version, packet_type, data in frames:
+                read_time = (time.time() - start_time) * 1000  # 毫秒
+                length = frames.current_length
+                decoded = bool(version & COMPRESSED_FLAG)
+                if decoded:
+                    version, data = decode_frame(self.upstream_codec, version, data)
+                if ((self._hedges or self._hedged_out) and data is not None
+                        and not self.proxy.hedger.primary_response(self, data)):
+                    self.logger.debug("丢弃客户端#%s 已由对冲请求返回的响应: 长度=%d", self.client_id, length)
                     start_time = time.time()
-                    self.packet_processor.write_packet(self.client_socket, version, packet_type, data)
-                    write_time = (time.time() - start_time) * 1000  # 毫秒
-
-                    self.logger.debug(f"转发响应 #{self.request_count} 到客户端, 写入时间={write_time:.2f}ms")
-
-                except EOFError:
-                    self.logger.info(f"服务器关闭连接: 客户端ID={self.client_id}")
+                    continue
+
+                latency_us = self._complete_request(length, frames.current_prefix if data is None else data)
+                if self.sampler:
+                    self.sampler.response(version, packet_type, data, length, latency_us)
+                if self._cache_pending and data is not None:
+                    self.proxy.cache.response_received(version, packet_type, data, self._cache_pending)
+                if self._flight_pending and data is not None:
+                    self.proxy.coalescer.response_received(version, packet_type, data, self._flight_pending)
+                if self.proxy.capture:
+                    self.proxy.capture.record(self.client_id, CAPTURE_SERVER_TO_CLIENT, version, packet_type, data)
+                self.logger.info("服务器响应客户端#%s 请求 #%d: 类型=0x%04X, 长度=%d, 读取时间=%.2fms",
+                                 self.client_id, self.request_count, packet_type, length, read_time)
+
+                # 转发到客户端
+                start_time = time.time()
+                with self._client_send_lock:
+                    if data is None:
+                        frames.relay_current(self.client_socket)
+                    elif self.client_codec or decoded:
+                        self._send_packet(self.client_socket, self.client_codec, version, packet_type, data)
+                    else:
+                        self.packet_processor.write_frame(self.client_socket, packet_type, frames.current_frame)
+                write_time = (time.time() - start_time) * 1000  # 毫秒
+
+                self.logger.debug("转发响应 #%d 到客户端, 写入时间=%.2fms", self.request_count, write_time)
+
+                if not self.running:
                     break
+                start_time = time.time()
+            else:
+                self.logger.info(f"服务器关闭连接: 客户端ID={self.client_id}")
+        except EOFError:
+            self.logger.info(f"服务器关闭连接: 客户端ID={self.client_id}")
+        except FrameTooLargeError as e:
+            self.logger.warning(f"服务器发送的数据包过大, 关闭连接 (客户端ID={self.client_id}): {e}")
+        except CompressionError as e:
+            self.logger.warning(f"服务器发送的压缩帧无效, 关闭连接 (客户端ID={self.client_id}): {e}")
         except Exception as e:
+            if self.sampler:
+                self.sampler.failed(f"转发服务器到客户端数据时出错: {e}")
             self.logger.error(f"转发服务器到客户端数据时出错 (客户端ID={self.client_id}): {e}")
             self.logger.error(traceback.format_exc())  # 记录完整的异常堆栈
         finally:
             self.stop()
 
+    def _complete_request(self, length: int, data) -> Optional[int]:
+        """服务器 -> 客户端 的数据包: 统计流量, 响应按 id 与未完成的请求配对记录延迟, 返回延迟(微秒)"""
+        self.metrics.record_response(length)
+        kind, request_id = peek_message(data)
+        if kind != MESSAGE_RESPONSE:
+            return None  # 服务器推送的通知或请求, 没有对应的客户端请求
+        inflight = self._inflight.pop(request_id, None)
+        if inflight is None:
+            return None
+        started, packet_type, trial = inflight
+        latency_us = (time.perf_counter_ns() - started) // 1000
+        self.metrics.record_latency(self.latency, packet_type, latency_us)
+        backend = self.backend
+        if backend:
+            self.proxy.backends.response_received(backend, latency_us, trial)
+        return latency_us
+
+    def _reply_locally(self, request_type: int, started: int, version: int, response_type: int,
+                       payload: bytes) -> None:
+        """不经过本会话的上游, 直接把响应写回客户端: 缓存命中, 或由其他会话的 leader 请求得到的合并响应"""
+        if not self.running:
+            return
+        try:
+            with self._client_send_lock:
+                self._send_packet(self.client_socket, self.client_codec, version, response_type, payload)
+        except Exception as e:
+            self.logger.error(f"写回客户端失败 (客户端ID={self.client_id}): {e}")
+            self.stop()
+            return
+        latency_us = (time.perf_counter_ns() - started) // 1000
+        self.metrics.record_response(len(payload))
+        self.metrics.record_latency(self.latency, request_type, latency_us)
+        if self.sampler:
+            self.sampler.response(version, response_type, payload, len(payload), latency_us)
+        self.logger.info("直接响应客户端#%s (缓存、合并或对冲请求): 类型=0x%04X, 长度=%d",
+                         self.client_id, response_type, len(payload))
+
+    def _reply_coalesced(self, request_type: int, started: int, version: int, response_type: int,
+                         payload: bytes) -> None:
+        """合并请求的响应由 leader 会话的读取线程分发: 放入本会话的队列, 由本会话的写回线程阻塞写客户端,
+        慢客户端不会拖住 leader 与其他等待者"""
+        with self._replies_lock:
+            if self._replies is None:
+                self._replies = queue.Queue()
+                threading.Thread(target=self._reply_loop, daemon=True).start()
+        self._replies.put((request_type, started, version, response_type, payload))
+
+    def _reply_loop(self) -> None:
+        while True:
+            reply = self._replies.get()
+            if reply is None or not self.running:
+                return
+            self._reply_locally(*reply)
+
+    def hedge_won(self, hedge, version: int, packet_type: int, data: bytes) -> None:
+        """由对冲连接池的读取线程调用: 对冲请求先返回, 代替主请求的响应写回客户端并通知上游取消主请求"""
+        request_type, started = hedge.packet_type, hedge.inflight[0]
+        self._inflight.pop(hedge.request_id, None)
+        backend = self.backend
+        if backend:
+            self.proxy.backends.request_cancelled(backend)
+        if self._cache_pending:
+            self.proxy.cache.response_received(version, packet_type, data, self._cache_pending)
+        if self._flight_pending:
+            self.proxy.coalescer.response_received(version, packet_type, data, self._flight_pending)
+        if self.proxy.capture:
+            self.proxy.capture.record(self.client_id, CAPTURE_SERVER_TO_CLIENT, version, packet_type, data)
+        self._reply_locally(request_type, started, version, packet_type, data)
+
+        notification = encode_message({'jsonrpc': '2.0', 'method': 'notifications/cancelled',
+                                       'params': {'requestId': hedge.request_id, 'reason': "对冲请求已返回"}})
+        try:
+            with self._server_send_lock:
+                self._send_packet(self.server_socket, self.upstream_codec, hedge.version, request_type, notification)
+        except OSError as e:
+            self.logger.warning(f"向上游发送取消通知失败 (客户端ID={self.client_id}): {e}")
+
+    def _send_packet(self, sock: socket.socket, codec, version: int, packet_type: int, data) -> None:
+        """重新封装并写出一个数据包, 链路协商了压缩时先编码; 写客户端时在持有 _client_send_lock 时调用"""
+        if codec is not None:
+            version, data = codec.encode(version, data)
+        self.packet_processor.write_packet(sock, version, packet_type, data)
+
+    def _answer_compression(self, payload) -> None:
+        """下游代理发来压缩协商: 按配置接受或拒绝, 之后该客户端连接的两个方向按协商结果编码"""
+        with self._client_send_lock:
+            reply, codec = self.proxy.compression.answer(payload)
+            self.packet_processor.write_packet(self.client_socket, 1, COMPRESSION_HELLO, reply)
+            self.client_codec = codec
+        self.logger.info(f"客户端ID={self.client_id} 压缩协商: {'启用' if codec else '拒绝'}")
+
+    def deliver(self, version: int, packet_type: int, data: bytes) -> None:
+        """由共享上游连接的读取线程调用, 把响应写回客户端"""
+        if not self.running:
+            return
+        latency_us = self._complete_request(len(data), data)
+        if self.sampler:
+            self.sampler.response(version, packet_type, data, len(data), latency_us)
+        if self._cache_pending:
+            self.proxy.cache.response_received(version, packet_type, data, self._cache_pending)
+        if self._flight_pending:
+            self.proxy.coalescer.response_received(version, packet_type, data, self._flight_pending)
+        if self.proxy.capture:
+            self.proxy.capture.record(self.client_id, CAPTURE_SERVER_TO_CLIENT, version, packet_type, data)
+        try:
+            with self._client_send_lock:
+                self._send_packet(self.client_socket, self.client_codec, version, packet_type, data)
+        except Exception as e:
+            self.logger.error(f"写回客户端失败 (客户端ID={self.client_id}): {e}")
+            self.stop()
+
+    def relay_raw(self, source: socket.socket, destination: socket.socket, direction: str) -> None:
+        """纯透传一个方向的字节流, 不解析数据包"""
+        self.logger.info(f"开始透传{direction}的数据: 客户端ID={self.client_id}")
+
+        try:
+            if hasattr(os, 'splice'):
+                relayed = self._relay_splice(source, destination)
+            else:
+                relayed = self._relay_copy(source, destination)
+            self.logger.info(f"{direction}透传结束: 客户端ID={self.client_id}, 字节数={relayed}")
+        except Exception as e:
+            if self.running:
+                self.logger.error(f"透传{direction}数据时出错 (客户端ID={self.client_id}): {e}")
+        finally:
+            self.stop()
+
+    RELAY_CHUNK_SIZE = 1024 * 1024
 
-# 示例使用
-if __name__ == "__main__":
-    # 创建并启动代理服务器
-    proxy = FastMCPProxy(
-        host='0.0.0.0',
-        port=25577,
-        target_host='127.0.0.1',  # 替换为实际的FastMCP服务器地址
-        target_port=5051
+    def _relay_splice(self, source: socket.socket, destination: socket.socket) -> int:
+        """Linux: 通过管道 splice, 数据不经过用户态"""
+        read_fd, write_fd = os.pipe()
+        try:
+            try:
+                import fcntl
+                fcntl.fcntl(write_fd, fcntl.F_SETPIPE_SZ, self.RELAY_CHUNK_SIZE)
+            except (ImportError, AttributeError, OSError):
+                pass  # 保持默认管道大小
+
+            relayed = 0
+            source_fd, destination_fd = source.fileno(), destination.fileno()
+            while self.running:
+                pending = os.splice(source_fd, write_fd, self.RELAY_CHUNK_SIZE, flags=os.SPLICE_F_MOVE)
+                if not pending:
+                    break
+                relayed += pending
+                while pending:
+                    pending -= os.splice(read_fd, destination_fd, pending, flags=os.SPLICE_F_MOVE)
+            return relayed
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def _relay_copy(self, source: socket.socket, destination: socket.socket) -> int:
+        """通用实现: 复用同一个缓冲区 recv_into + sendall"""
+        buffer = memoryview(bytearray(self.RELAY_CHUNK_SIZE))
+        relayed = 0
+        while self.running:
+            received = source.recv_into(buffer)
+            if not received:
+                break
+            destination.sendall(buffer[:received])
+            relayed += received
+        return relayed
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="FastMCP代理服务器: 记录日志后转发给MCP-SERVER")
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址, unix:///path 表示监听Unix域套接字 (忽略 --port)')
+    parser.add_argument('--port', type=int, default=25577, help='监听端口')
+    parser.add_argument('--target-host', default='127.0.0.1',
+                        help='FastMCP服务器地址, 同机部署时可用 unix:///path 连接Unix域套接字 (忽略 --target-port)')
+    parser.add_argument('--target-port', type=int, default=5051, help='FastMCP服务器端口')
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default='threaded',
+                        help='threaded: 每个连接三个线程; asyncio: 所有连接共享一个事件循环')
+    parser.add_argument('--protocol', choices=('fastmcp', 'http'), default='fastmcp',
+                        help='fastmcp: 8字节头部的二进制分帧; http: 代理 streamable-http / SSE 传输的MCP服务 '
+                             '(asyncio, 上游长连接复用, 事件流不缓冲, 按 mcp-session-id 会话亲和, 按JSON-RPC方法计时)')
+    parser.add_argument('--passthrough', action='store_true',
+                        help='纯透传模式(仅threaded引擎): 不解析也不记录数据包, Linux下使用splice')
+    parser.add_argument('--upstream-pool', type=int, default=0, metavar='N',
+                        help='上游连接池大小(仅threaded引擎): 预热N条上游连接, 每个会话独占一条, 会话结束后'
+                             '握手成功的连接留给 initialize 参数相同的新会话复用; 0表示不使用')
+    parser.add_argument('--upstream-pool-max', type=int, default=256, metavar='M',
+                        help='与 --upstream-pool 同用: 上游连接总数上限 (不小于N), 达到上限时新会话等待连接归还, '
+                             '超过建连超时后拒绝; 0表示不限制, 默认256')
+    parser.add_argument('--log-level', choices=tuple(LOG_LEVELS), default='DEBUG',
+                        help='文件日志级别, OFF 表示关闭日志')
+    parser.add_argument('--log-queue-size', type=int, default=0, metavar='N',
+                        help='大于0时启用异步日志: 转发线程只入队(最多N条), 后台线程写入, 队列满时丢弃并计数')
+    parser.add_argument('--capture-dir', metavar='DIR',
+                        help='把原始帧写入DIR下的二进制抓包分段, 用 mcp_broker_capture.py 查询')
+    parser.add_argument('--metrics-port', type=int, default=0, metavar='PORT',
+                        help='在 127.0.0.1:PORT 提供 /metrics (Prometheus) 与 /metrics.json')
+    parser.add_argument('--metrics-json', metavar='PATH', help='停止时把指标快照写入PATH')
+    parser.add_argument('--backends', type=lambda v: [a for a in v.split(',') if a], metavar='HOST:PORT,...',
+                        help='多个上游副本 (host:port 或 unix:///path), 每个新会话按未完成请求数(二选一)选择后端, '
+                             '覆盖 --target-host/--target-port')
+    parser.add_argument('--backends-file', metavar='PATH',
+                        help='后端配置文件 {"backends": ["host:port", ...]}, 修改后自动重载, 无需重启')
+    parser.add_argument('--max-frame-size', type=parse_size, default=FastMCPPacket.DEFAULT_MAX_FRAME_SIZE,
+                        metavar='SIZE', help='单个数据包的上限 (支持K/M/G后缀), 超过即关闭连接, 默认64M')
+    parser.add_argument('--connection-memory', type=parse_size, default=4 * 1024 * 1024, metavar='SIZE',
+                        help='每个连接每个方向最多缓冲的字节数, 更大的数据包分块流式转发'
+                             '(--upstream-pool/--capture-dir 模式下拒绝), 默认4M')
+    parser.add_argument('--memory-budget', type=parse_size, default=512 * 1024 * 1024, metavar='SIZE',
+                        help='所有连接帧缓冲的总预算, 用尽时暂停读取直到有内存释放, 默认512M')
+    parser.add_argument('--cache-types', type=lambda v: [int(t, 0) for t in v.split(',') if t], default=[],
+                        metavar='TYPE,...', help='缓存这些数据包类型的请求响应, 例如 0x0002')
+    parser.add_argument('--cache-tools', type=lambda v: [t for t in v.split(',') if t], default=[],
+                        metavar='NAME,...', help='缓存这些工具的 tools/call 响应, 例如 name,sex')
+    parser.add_argument('--cache-ttl', type=float, default=60.0, metavar='SECONDS', help='缓存条目有效期')
+    parser.add_argument('--cache-max-entries', type=int, default=10000, metavar='N', help='缓存条目数上限')
+    parser.add_argument('--cache-max-bytes', type=parse_size, default=64 * 1024 * 1024, metavar='SIZE',
+                        help='缓存响应总字节数上限, 默认64M')
+    parser.add_argument('--coalesce-types', type=lambda v: [int(t, 0) for t in v.split(',') if t], default=[],
+                        metavar='TYPE,...', help='合并这些数据包类型的相同在途请求, 只转发第一个')
+    parser.add_argument('--coalesce-tools', type=lambda v: [t for t in v.split(',') if t], default=[],
+                        metavar='NAME,...', help='合并这些工具参数相同的在途 tools/call 请求')
+    parser.add_argument('--coalesce-max-waiters', type=int, default=100, metavar='N',
+                        help='每个在途请求最多合并的等待者, 超出的请求照常转发')
+    parser.add_argument('--upstream-compression', action='store_true',
+                        help='与上游协商帧压缩 (上游需为开启 --accept-compression 的代理, 上游拒绝时该连接不压缩, '
+                             '未回复时关闭连接); --backends-file 中 "compression": false 的后端不协商')
+    parser.add_argument('--accept-compression', action='store_true',
+                        help='接受下游代理的帧压缩协商')
+    parser.add_argument('--compression-threshold', type=parse_size, default=128, metavar='SIZE',
+                        help='只压缩不小于该长度的数据包, 默认128字节')
+    parser.add_argument('--compression-level', type=int, default=6, choices=range(1, 10), metavar='1-9',
+                        help='zlib 压缩级别, 默认6')
+    parser.add_argument('--sample-log', metavar='PATH',
+                        help='尾部采样日志: 每个连接在内存中保留最近的数据包, 只在慢调用、出错或随机采样时写入该文件')
+    parser.add_argument('--sample-slow-ms', type=float, default=1000.0, metavar='MS',
+                        help='请求延迟不低于该值时写出, 默认1000ms')
+    parser.add_argument('--sample-one-in', type=int, default=1000, metavar='N',
+                        help='每N个请求随机写出一个, 0 表示不随机采样')
+    parser.add_argument('--sample-ring-size', type=int, default=32, metavar='N', help='每个连接保留的最近数据包数')
+    parser.add_argument('--sample-payload-bytes', type=parse_size, default=4096, metavar='SIZE',
+                        help='每个数据包最多保留的数据字节数')
+    parser.add_argument('--hedge-types', type=lambda v: [int(t, 0) for t in v.split(',') if t], default=[],
+                        metavar='TYPE,...', help='对冲这些数据包类型的幂等请求 (需要 --backends, 仅threaded引擎)')
+    parser.add_argument('--hedge-tools', type=lambda v: [t for t in v.split(',') if t], default=[],
+                        metavar='NAME,...', help='对冲这些幂等工具的 tools/call 请求')
+    parser.add_argument('--hedge-percentile', type=float, default=95.0, metavar='P',
+                        help='主请求超过最近延迟的P分位数仍未返回时发送对冲请求, 默认95')
+    parser.add_argument('--hedge-min-delay-ms', type=float, default=5.0, metavar='MS', help='对冲延迟的下限')
+    parser.add_argument('--hedge-max-share', type=float, default=0.05, metavar='RATIO',
+                        help='对冲请求占被跟踪请求的比例上限, 默认0.05')
+    parser.add_argument('--breaker-failures', type=int, default=5, metavar='N',
+                        help='后端连续N个请求失败或超时后熔断, 0 表示不熔断')
+    parser.add_argument('--breaker-timeout-ms', type=float, default=30000.0, metavar='MS',
+                        help='延迟超过该值的请求计为超时, 0 表示只统计失败')
+    parser.add_argument('--breaker-cooldown', type=float, default=10.0, metavar='SECONDS',
+                        help='熔断持续时间, 之后放行请求试探后端')
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help='大于1时以监督进程模式运行: 启动N个工作进程通过SO_REUSEPORT共享监听端口, 汇总指标并重启崩溃的进程')
+    parser.add_argument('--worker-index', type=int, help=argparse.SUPPRESS)  # 由监督进程传给工作进程
+    parser.add_argument('--metrics-dir', default='logs/metrics', help='多进程模式下工作进程写指标快照的目录')
+    args = parser.parse_args(argv)
+
+    if args.passthrough and args.engine != 'threaded':
+        parser.error("--passthrough 只支持 threaded 引擎, 不能与 --engine asyncio 同时使用")
+    if args.passthrough and (args.upstream_pool or args.capture_dir):
+        parser.error("--passthrough 不解析数据包, 不能与 --upstream-pool/--capture-dir 同时使用")
+    if args.passthrough and (args.cache_types or args.cache_tools or args.coalesce_types or args.coalesce_tools):
+        parser.error("--passthrough 不解析数据包, 不能与 --cache-*/--coalesce-* 同时使用")
+    if args.passthrough and (args.upstream_compression or args.accept_compression):
+        parser.error("--passthrough 不解析数据包, 不能与 --upstream-compression/--accept-compression 同时使用")
+    if args.passthrough and args.sample_log:
+        parser.error("--passthrough 不解析数据包, 不能与 --sample-log 同时使用")
+    if args.upstream_pool and args.engine != 'threaded':
+        parser.error("--upstream-pool 只支持 threaded 引擎, 不能与 --engine asyncio 同时使用")
+    if args.upstream_pool and 0 < args.upstream_pool_max < args.upstream_pool:
+        parser.error("--upstream-pool-max 不能小于 --upstream-pool")
+    if args.upstream_pool and (args.backends or args.backends_file):
+        parser.error("--upstream-pool 只支持单个上游, 不能与 --backends/--backends-file 同时使用")
+    if args.hedge_types or args.hedge_tools:
+        if not (args.backends or args.backends_file):
+            parser.error("--hedge-* 需要 --backends/--backends-file 提供多个后端")
+        if args.engine != 'threaded' or args.passthrough:
+            parser.error("--hedge-* 只支持 threaded 引擎, 不能与 --engine asyncio/--passthrough 同时使用")
+        if not 0 < args.hedge_percentile < 100:
+            parser.error("--hedge-percentile 需要在 0 到 100 之间")
+
+    if args.protocol == 'http' and (
+            args.passthrough or args.upstream_pool or args.capture_dir or args.cache_types or args.cache_tools
+            or args.coalesce_types or args.coalesce_tools or args.upstream_compression or args.accept_compression
+            or args.sample_log or args.hedge_types or args.hedge_tools):
+        parser.error("--protocol http 不支持 --passthrough/--upstream-pool/--capture-dir/--cache-*/--coalesce-*/"
+                     "--*-compression/--sample-log/--hedge-*")
+
+    if args.workers > 1 and unix_path(args.host) is not None:
+        parser.error("Unix域套接字不支持 SO_REUSEPORT 分发连接, --workers 只能与 TCP 监听地址同时使用")
+
+    if args.workers > 1 and args.worker_index is None:
+        from mcp_broker_supervisor import BrokerSupervisor
+        BrokerSupervisor(args.workers, sys.argv[1:] if argv is None else argv,
+                         metrics_dir=args.metrics_dir, metrics_port=args.metrics_port).run()
+        return
+
+    options = dict(
+        host=args.host,
+        port=args.port,
+        target_host=args.target_host,
+        target_port=args.target_port,
+        log_level=args.log_level,
+        log_queue_size=args.log_queue_size,
+        capture_dir=args.capture_dir,
+        metrics_port=args.metrics_port,
+        metrics_json=args.metrics_json,
+        backends=args.backends,
+        backends_file=args.backends_file,
+        max_frame_size=args.max_frame_size,
+        connection_memory=args.connection_memory,
+        memory_budget=args.memory_budget,
+        backend_options=dict(breaker_failures=args.breaker_failures,
+                             breaker_timeout_us=int(args.breaker_timeout_ms * 1000),
+                             breaker_cooldown=args.breaker_cooldown)
     )
+    if args.cache_types or args.cache_tools:
+        from mcp_broker_cache import ResponseCache
+        options['cache'] = ResponseCache(args.cache_types, args.cache_tools, ttl=args.cache_ttl,
+                                         max_entries=args.cache_max_entries, max_bytes=args.cache_max_bytes)
+    if args.coalesce_types or args.coalesce_tools:
+        from mcp_broker_cache import SingleFlight
+        options['coalescer'] = SingleFlight(args.coalesce_types, args.coalesce_tools,
+                                            max_waiters=args.coalesce_max_waiters)
+    if args.upstream_compression or args.accept_compression:
+        from mcp_broker_compress import FrameCompression
+        options['compression'] = FrameCompression(upstream=args.upstream_compression, accept=args.accept_compression,
+                                                  threshold=args.compression_threshold, level=args.compression_level,
+                                                  max_frame_size=args.max_frame_size)
+    if args.sample_log:
+        from mcp_broker_sampling import TailSampler
+        sample_log = args.sample_log
+        if args.worker_index is not None:
+            root, ext = os.path.splitext(sample_log)
+            sample_log = f"{root}.worker-{args.worker_index}{ext}"
+        options['sampler'] = TailSampler(sample_log, slow_ms=args.sample_slow_ms, one_in=args.sample_one_in,
+                                         ring_size=args.sample_ring_size, max_payload=args.sample_payload_bytes)
+    if args.hedge_types or args.hedge_tools:
+        from mcp_broker_hedging import HedgedRequests
+        options['hedger'] = HedgedRequests(args.hedge_types, args.hedge_tools, max_share=args.hedge_max_share,
+                                           percentile=args.hedge_percentile / 100,
+                                           min_delay_ms=args.hedge_min_delay_ms)
+    if args.worker_index is not None:
+        # 工作进程: 共享监听端口, 日志分文件, 定期写指标快照供监督进程汇总, 指标端点由监督进程提供
+        options.update(
+            reuse_port=True,
+            log_file=f"logs/fastmcp_proxy.worker-{args.worker_index}.log",
+            metrics_port=0,
+            metrics_json=os.path.join(args.metrics_dir, f"worker-{args.worker_index}.json"),
+            metrics_json_interval=1.0
+        )
+
+    # 创建并启动代理服务器
+    if args.protocol == 'http':
+        from mcp_broker_http import HttpMCPProxy
+        for key in ('capture_dir', 'max_frame_size', 'connection_memory', 'memory_budget'):
+            options.pop(key)  # 只用于二进制分帧
+        proxy = HttpMCPProxy(**options)
+    elif args.engine == 'asyncio':
+        from mcp_broker_async import AsyncFastMCPProxy
+        proxy = AsyncFastMCPProxy(**options)
+    else:
+        proxy = FastMCPProxy(
+            passthrough=args.passthrough,
+            upstream_pool_size=args.upstream_pool,
+            upstream_pool_max=args.upstream_pool_max,
+            **options
+        )
+
+    proxy.start()
 
-    proxy.start()
\ No newline at end of file
+
+# 示例使用
+if __name__ == "__main__":
+    main()
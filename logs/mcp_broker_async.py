@@ -0,0 +1,470 @@
+import asyncio
+import functools
+import itertools
+import time
+import traceback
+from typing import Dict, List, Optional
+
+from mcp_broker import (setup_logging, shutdown_logging, FastMCPPacket, FastMCPFrameReader, FrameTooLargeError,
+                        MemoryBudget, CAPTURE_CLIENT_TO_SERVER, CAPTURE_SERVER_TO_CLIENT, unix_path, format_endpoint,
+                        remove_stale_unix_socket)
+from mcp_broker_compress import COMPRESSED_FLAG, COMPRESSION_HELLO, CompressionError, decode_frame
+from mcp_broker_jsonrpc import peek_message, MESSAGE_REQUEST, MESSAGE_RESPONSE
+from mcp_broker_metrics import BrokerMetrics, MetricsServer
+
+try:
+    import resource
+except ImportError:  # Windows 下没有 resource 模块
+    resource = None
+
+
+async def open_endpoint(host: str, port: int):
+    """asyncio.open_connection 的端点版本: host 为 unix:///path 时连接Unix域套接字"""
+    path = unix_path(host)
+    if path is None:
+        return await asyncio.open_connection(host, port)
+    return await asyncio.open_unix_connection(path)
+
+
+class AsyncClientSession:
+    """asyncio引擎下的客户端会话状态, 由事件循环内的两个协程共享, 无需加锁"""
+
+    __slots__ = ('client_id', 'client_reader', 'client_writer', 'server_reader', 'server_writer',
+                 'request_count', 'latency', 'inflight', 'backend', 'cache_pending', 'flight_pending',
+                 'client_lock', 'upstream_codec', 'client_codec', 'sampler')
+
+    def __init__(self, client_id: str, client_reader: asyncio.StreamReader,
+                 client_writer: asyncio.StreamWriter, latency):
+        self.client_id = client_id
+        self.client_reader = client_reader
+        self.client_writer = client_writer
+        self.server_reader: Optional[asyncio.StreamReader] = None
+        self.server_writer: Optional[asyncio.StreamWriter] = None
+
+        # 性能监控: 按 JSON-RPC id 把响应与请求配对, 通知与服务器推送不参与配对
+        self.request_count = 0
+        self.latency = latency
+        self.inflight = {}  # 请求id -> (请求开始时间ns, 数据包类型, 熔断试探令牌)
+        self.backend = None  # 配置多个后端时本会话分配到的后端
+        self.cache_pending = {}  # 未命中缓存的请求: 请求id -> 缓存键
+        self.flight_pending = {}  # 本会话作为 leader 转发的可合并请求: 请求id -> 请求键
+        self.client_lock = asyncio.Lock()  # 缓存命中的响应不能插入到正在分块转发给客户端的大包中间
+        # 协商压缩后的压缩上下文; 编码与写入之间没有 await, 编码顺序即写出顺序
+        self.upstream_codec = None
+        self.client_codec = None
+        self.sampler = None  # ConnectionSampler, 启用尾部采样时保留最近的数据包
+
+
+class AsyncFastMCPProxy:
+    """基于asyncio事件循环的FastMCP代理服务器
+
+    与 FastMCPProxy 使用相同的数据包格式 (版本/类型/长度 头部), 但所有连接都在同一个事件循环中处理:
+    每个连接只对应两个协程 (客户端->服务器, 服务器->客户端), 不再创建三个线程。
+
+    并发目标: 单进程内 10000 个空闲连接 + 1000 个活跃连接。
+    - 空闲连接只占用 StreamReader/StreamWriter 及少量缓冲区, 没有线程栈开销
+    - 每个会话占用两个文件描述符 (客户端 + 上游), 启动时会尝试把软上限提升到硬上限,
+      硬上限需不低于 2 * 目标连接数 + 余量 (例如 ulimit -n 25000)
+    - listen backlog 为 4096, 以承受会话集中建立时的连接风暴
+    """
+
+    LISTEN_BACKLOG = 4096
+    CONNECT_TIMEOUT = 5
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 25577,
+                 target_host: str = 'localhost', target_port: int = 25578,
+                 log_level: str = 'DEBUG', log_queue_size: int = 0,
+                 log_file: str = 'logs/fastmcp_proxy.log',
+                 capture_dir: Optional[str] = None,
+                 metrics_port: int = 0, metrics_json: Optional[str] = None,
+                 metrics_json_interval: float = 0, reuse_port: bool = False,
+                 backends: Optional[List[str]] = None, backends_file: Optional[str] = None,
+                 max_frame_size: int = FastMCPPacket.DEFAULT_MAX_FRAME_SIZE,
+                 connection_memory: int = 4 * 1024 * 1024, memory_budget: int = 512 * 1024 * 1024,
+                 cache=None, coalescer=None, compression=None, sampler=None,
+                 backend_options: Optional[dict] = None):
+        self.loggers = setup_logging(log_level, log_queue_size, log_file)
+        self.host = host
+        self.port = port
+        self.target_host = target_host
+        self.target_port = target_port
+        self.budget = MemoryBudget(memory_budget, max_frame_size, connection_memory)
+        self.cache = cache
+        self.coalescer = coalescer
+        self.compression = compression
+        self.sampler = sampler
+        self._reply_tasks = set()  # 合并请求的响应写回任务, 保持引用直到完成
+        self.backends = None
+        if backends or backends_file:
+            from mcp_broker_backends import BackendSet
+            self.backends = BackendSet(backends or [], self.loggers, config_path=backends_file,
+                                       **(backend_options or {}))
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.running = False
+        self.sessions: Dict[str, AsyncClientSession] = {}  # 存储客户端会话
+        self._unix_clients = itertools.count(1)
+
+        self.logger = self.loggers['main']
+        self.handler_logger = self.loggers['handler']
+        self.packet_processor = FastMCPPacket(self.loggers, max_frame_size)
+        self._stop_event: Optional[asyncio.Event] = None
+
+        self.metrics = BrokerMetrics()
+        self.metrics_server = MetricsServer(self.metrics, port=metrics_port) if metrics_port else None
+        self.metrics_json = metrics_json
+        self.metrics_json_interval = metrics_json_interval
+        self.reuse_port = reuse_port
+        self.metrics.backends = self.backends
+        self.metrics.memory = self.budget
+        self.metrics.cache = self.cache
+        self.metrics.coalescer = self.coalescer
+        self.metrics.compression = self.compression.stats if self.compression else None
+        self.metrics.sampler = self.sampler
+
+        self.capture = None
+        if capture_dir:
+            from mcp_broker_capture import CaptureWriter
+            self.capture = CaptureWriter(capture_dir)
+
+    def _raise_fd_limit(self) -> None:
+        """把文件描述符软上限提升到硬上限"""
+        if resource is None:
+            return
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if hard == resource.RLIM_INFINITY or soft < hard:
+                target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+                resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+                self.logger.info(f"文件描述符上限: {soft} -> {target}")
+        except (ValueError, OSError) as e:
+            self.logger.warning(f"无法提升文件描述符上限: {e}")
+
+    def start(self) -> None:
+        """启动代理服务器 (阻塞直到停止)"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            self.logger.info("接收到中断信号，正在停止服务器...")
+        finally:
+            if self.backends:
+                self.backends.close()
+            if self.capture:
+                self.capture.close()
+            if self.sampler:
+                self.sampler.close()
+            if self.metrics_server:
+                self.metrics_server.stop()
+            if self.metrics_json:
+                self.metrics.dump_json(self.metrics_json)
+            self.logger.info("FastMCP代理服务器已停止")
+            shutdown_logging()
+
+    async def serve(self) -> None:
+        """在当前事件循环中运行代理服务器"""
+        target = (', '.join(self.backends.backends) if self.backends
+                  else format_endpoint(self.target_host, self.target_port))
+        self.logger.info(f"FastMCP代理服务器(asyncio)启动中: {format_endpoint(self.host, self.port)} -> {target}")
+        self._raise_fd_limit()
+        self._stop_event = asyncio.Event()
+
+        path = unix_path(self.host)
+        if path is None:
+            self.server = await asyncio.start_server(
+                self._handle_client, self.host, self.port,
+                backlog=self.LISTEN_BACKLOG, reuse_address=True, reuse_port=self.reuse_port or None
+            )
+        else:
+            remove_stale_unix_socket(path)
+            self.server = await asyncio.start_unix_server(self._handle_client, path, backlog=self.LISTEN_BACKLOG)
+        self.running = True
+        if self.backends:
+            self.backends.start()
+        if self.metrics_server:
+            self.metrics_server.start()
+        if self.metrics_json and self.metrics_json_interval > 0:
+            self.metrics.start_json_dumper(self.metrics_json, self.metrics_json_interval)
+        if self.sampler:
+            self.sampler.start()
+        self.logger.info(f"FastMCP代理服务器已启动，等待连接...")
+
+        try:
+            async with self.server:
+                await self._stop_event.wait()
+        finally:
+            self.running = False
+            await self._close_sessions()
+
+    def stop(self) -> None:
+        """停止代理服务器, 可从事件循环内调用"""
+        self.running = False
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    async def _close_sessions(self) -> None:
+        """关闭所有客户端会话"""
+        for client_id, session in list(self.sessions.items()):
+            self.logger.info(f"关闭客户端连接: 客户端ID={client_id}")
+            self._close_session(session)
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            if unix_path(self.host) is not None:
+                remove_stale_unix_socket(unix_path(self.host))
+            self.logger.info("服务器套接字已关闭")
+
+    async def _handle_client(self, client_reader: asyncio.StreamReader,
+                             client_writer: asyncio.StreamWriter) -> None:
+        """处理单个客户端连接"""
+        peer = client_writer.get_extra_info('peername')
+        if peer:
+            client_id = f"{peer[0]}_{peer[1]}"
+        else:
+            client_id = f"unix_{next(self._unix_clients)}"  # Unix域套接字的客户端没有地址
+        session = AsyncClientSession(client_id, client_reader, client_writer,
+                                     self.metrics.connection_opened(client_id))
+        if self.sampler:
+            session.sampler = self.sampler.open(client_id)
+        self.sessions[client_id] = session
+        self.handler_logger.info(f"新连接来自: {peer}, 客户端ID={client_id}")
+
+        try:
+            # 连接到目标服务器
+            session.server_reader, session.server_writer = await self._connect_upstream(session)
+            if self.compression and self.compression.offers_to(session.backend):
+                session.upstream_codec = await self.compression.offer_async(
+                    self.packet_processor, session.server_reader, session.server_writer, self.handler_logger)
+
+            tasks = [
+                asyncio.create_task(self._forward(session, client_reader, session.server_writer, True)),
+                asyncio.create_task(self._forward(session, session.server_reader, client_writer, False)),
+            ]
+            # 任意一个方向结束即关闭整个会话
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        except Exception as e:
+            self.handler_logger.error(f"启动客户端处理器时出错 (客户端ID={client_id}): {e}")
+            self.handler_logger.error(traceback.format_exc())  # 记录完整的异常堆栈
+        finally:
+            self._close_session(session)
+
+    async def _connect_upstream(self, session: AsyncClientSession):
+        """连接上游; 配置多个后端时选择负载最低的后端, 建连失败则换下一个"""
+        if self.backends is None:
+            start_time = time.perf_counter_ns()
+            streams = await asyncio.wait_for(open_endpoint(self.target_host, self.target_port),
+                                             timeout=self.CONNECT_TIMEOUT)
+            self.metrics.record_upstream_connect((time.perf_counter_ns() - start_time) // 1000)
+            return streams
+
+        tried = []
+        while True:
+            backend = self.backends.acquire(tried)  # 所有后端都失败时抛出 ConnectionError
+            start_time = time.perf_counter_ns()
+            try:
+                streams = await asyncio.wait_for(open_endpoint(backend.host, backend.port),
+                                                 timeout=self.backends.connect_timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                self.handler_logger.warning(f"连接后端 {backend.address} 失败 (客户端ID={session.client_id}): {e}")
+                self.backends.connect_failed(backend)
+                tried.append(backend)
+                continue
+            self.metrics.record_upstream_connect((time.perf_counter_ns() - start_time) // 1000)
+            session.backend = backend
+            return streams
+
+    async def _forward(self, session: AsyncClientSession, reader: asyncio.StreamReader,
+                       writer: asyncio.StreamWriter, to_server: bool) -> None:
+        """按数据包转发一个方向的数据
+
+        超过单连接缓冲上限的数据包 (抓包模式下拒绝) 分块流式转发; 其余数据包整包读取,
+        超出默认缓冲区的部分从全局内存预算中预留, 预算用尽时暂停读取该连接。
+        写入后等待 drain, 对端接收慢时不再从来源读取。
+        """
+        direction = "客户端到服务器" if to_server else "服务器到客户端"
+        packet_processor = self.packet_processor
+        budget = self.budget
+        try:
+            while True:
+                version, packet_type, length = await packet_processor.read_header_async(reader)
+                stream = FastMCPPacket.HEADER_SIZE + length > budget.connection_limit
+                if stream and self.capture:
+                    raise FrameTooLargeError(f"数据包长度 {length} 超过单连接缓冲上限 {budget.connection_limit}")
+                reserved = length if not stream and length > FastMCPFrameReader.DEFAULT_BUFFER_SIZE else 0
+                if reserved:
+                    await budget.reserve_async(reserved)
+                try:
+                    await self._forward_packet(session, reader, writer, to_server,
+                                               version, packet_type, length, stream)
+                finally:
+                    if reserved:
+                        budget.release(reserved)
+        except EOFError:
+            self.handler_logger.info(f"{'客户端' if to_server else '服务器'}关闭连接: 客户端ID={session.client_id}")
+        except FrameTooLargeError as e:
+            self.handler_logger.warning(f"{'客户端' if to_server else '服务器'}发送的数据包过大, 关闭连接 "
+                                        f"(客户端ID={session.client_id}): {e}")
+        except CompressionError as e:
+            self.handler_logger.warning(f"{'客户端' if to_server else '服务器'}发送的压缩帧无效, 关闭连接 "
+                                        f"(客户端ID={session.client_id}): {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if session.sampler:
+                session.sampler.failed(f"转发{direction}数据时出错: {e}")
+            self.handler_logger.error(f"转发{direction}数据时出错 (客户端ID={session.client_id}): {e}")
+
+    async def _forward_packet(self, session: AsyncClientSession, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter, to_server: bool,
+                              version: int, packet_type: int, length: int, stream: bool) -> None:
+        """转发头部已读取的一个数据包"""
+        data = None if stream else await self.packet_processor.read_data_async(reader, length)
+        first = b''
+        if stream:
+            # 先读出大包的开头部分, 用于按 id 配对请求与响应, 转发时一并写出
+            first = await reader.read(min(length, 64 * 1024))
+            if not first:
+                raise EOFError("连接已关闭: 数据包不完整")
+        decoded = bool(version & COMPRESSED_FLAG)
+        if decoded:
+            version, data = decode_frame(session.client_codec if to_server else session.upstream_codec,
+                                         version, data)
+        elif to_server and packet_type == COMPRESSION_HELLO and self.compression and data is not None:
+            await self._answer_compression(session, data)
+            return
+
+        if self.capture:
+            self.capture.record(session.client_id,
+                                CAPTURE_CLIENT_TO_SERVER if to_server else CAPTURE_SERVER_TO_CLIENT,
+                                version, packet_type, data)
+
+        cached = None
+        coalesced = False
+        if to_server:
+            session.request_count += 1
+            self.metrics.record_request(length)
+            if self.cache and data is not None:
+                cached = self.cache.lookup(packet_type, data, session.cache_pending)
+            if cached is None and self.coalescer and data is not None:
+                coalesced = self.coalescer.join(
+                    packet_type, data,
+                    functools.partial(self._schedule_reply, session, packet_type, time.perf_counter_ns()),
+                    session.flight_pending)
+                if coalesced and self.cache:
+                    self.cache.forget(data, session.cache_pending)
+            if session.sampler:
+                session.sampler.request(version, packet_type, data, length)
+            if cached is None and not coalesced:
+                kind, request_id = peek_message(first if stream else data)
+                if kind == MESSAGE_REQUEST:
+                    trial = self.backends.request_sent(session.backend) if session.backend else 0
+                    session.inflight[request_id] = (time.perf_counter_ns(), packet_type, trial)
+            self.handler_logger.info("客户端#%s 请求 #%d: 类型=0x%04X, 长度=%d",
+                                     session.client_id, session.request_count, packet_type, length)
+        else:
+            self.metrics.record_response(length)
+            if session.cache_pending and data is not None:
+                self.cache.response_received(version, packet_type, data, session.cache_pending)
+            if session.flight_pending and data is not None:
+                self.coalescer.response_received(version, packet_type, data, session.flight_pending)
+            latency_us = None
+            kind, request_id = peek_message(first if stream else data) if session.inflight else (None, None)
+            inflight = session.inflight.pop(request_id, None) if kind == MESSAGE_RESPONSE else None
+            if inflight is not None:
+                started, request_type, trial = inflight
+                latency_us = (time.perf_counter_ns() - started) // 1000
+                self.metrics.record_latency(session.latency, request_type, latency_us)
+                if session.backend:
+                    self.backends.response_received(session.backend, latency_us, trial)
+            if session.sampler:
+                session.sampler.response(version, packet_type, data, length, latency_us)
+            self.handler_logger.info("服务器响应客户端#%s 请求 #%d: 类型=0x%04X, 长度=%d",
+                                     session.client_id, session.request_count, packet_type, length)
+
+        if cached is not None:
+            # 缓存命中: 直接响应客户端, 不转发给上游
+            await self._reply_locally(session, packet_type, time.perf_counter_ns(), *cached)
+        elif coalesced:
+            pass  # 等待参数相同的在途请求的响应
+        elif stream and not to_server:
+            async with session.client_lock:
+                await self.packet_processor.relay_stream_async(reader, writer, version, packet_type, length,
+                                                               first=first)
+        elif stream:
+            await self.packet_processor.relay_stream_async(reader, writer, version, packet_type, length, first=first)
+        else:
+            codec = session.upstream_codec if to_server else session.client_codec
+            if codec is not None:
+                version, data = codec.encode(version, data)
+            await self.packet_processor.write_packet_async(writer, version, packet_type, data)
+
+    async def _reply_locally(self, session: AsyncClientSession, request_type: int, started: int,
+                             version: int, response_type: int, payload: bytes) -> None:
+        """不经过本会话的上游, 直接把响应写回客户端: 缓存命中, 或由其他会话的 leader 请求得到的合并响应"""
+        if session.client_id not in self.sessions:
+            return
+        try:
+            async with session.client_lock:
+                if session.client_codec is not None:
+                    version, payload = session.client_codec.encode(version, payload)
+                await self.packet_processor.write_packet_async(session.client_writer, version, response_type, payload)
+        except Exception as e:
+            self.handler_logger.error(f"写回客户端失败 (客户端ID={session.client_id}): {e}")
+            return
+        latency_us = (time.perf_counter_ns() - started) // 1000
+        self.metrics.record_response(len(payload))
+        self.metrics.record_latency(session.latency, request_type, latency_us)
+        if session.sampler:
+            session.sampler.response(version, response_type, payload, len(payload), latency_us)
+
+    async def _answer_compression(self, session: AsyncClientSession, payload) -> None:
+        """下游代理发来压缩协商: 按配置接受或拒绝, 之后该客户端连接的两个方向按协商结果编码"""
+        async with session.client_lock:
+            reply, session.client_codec = self.compression.answer(payload)
+            await self.packet_processor.write_packet_async(session.client_writer, 1, COMPRESSION_HELLO, reply)
+        self.handler_logger.info(f"客户端ID={session.client_id} 压缩协商: "
+                                 f"{'启用' if session.client_codec else '拒绝'}")
+
+    def _schedule_reply(self, session: AsyncClientSession, request_type: int, started: int,
+                        version: int, response_type: int, payload: bytes) -> None:
+        """合并请求的等待者回调, 在 leader 会话的协程中被调用, 另起任务写回等待者的客户端"""
+        task = asyncio.ensure_future(self._reply_locally(session, request_type, started,
+                                                         version, response_type, payload))
+        self._reply_tasks.add(task)
+        task.add_done_callback(self._reply_tasks.discard)
+
+    def _close_session(self, session: AsyncClientSession) -> None:
+        """关闭会话的两端连接并输出统计"""
+        if self.sessions.pop(session.client_id, None) is None:
+            return
+
+        for writer in (session.client_writer, session.server_writer):
+            if writer is not None:
+                try:
+                    writer.close()
+                except Exception as e:
+                    self.handler_logger.error(f"关闭套接字时出错 (客户端ID={session.client_id}): {e}")
+
+        if session.backend:
+            self.backends.release(session.backend, len(session.inflight))
+            session.backend = None
+        if session.flight_pending:
+            self.coalescer.abandon(session.flight_pending)
+        self.metrics.connection_closed(session.client_id)
+        if session.request_count > 0:
+            stats = session.latency.snapshot()
+            avg_time = stats['sum_us'] / stats['count'] / 1000 if stats['count'] else 0.0
+            self.handler_logger.info(
+                f"客户端连接统计 (客户端ID={session.client_id}): 请求总数={session.request_count}, 平均请求时间={avg_time:.2f}ms, "
+                f"p99={stats['p99_us'] / 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    proxy = AsyncFastMCPProxy(
+        host='0.0.0.0',
+        port=25577,
+        target_host='127.0.0.1',  # 替换为实际的FastMCP服务器地址
+        target_port=5051
+    )
+    proxy.start()
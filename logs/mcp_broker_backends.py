@@ -0,0 +1,408 @@
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from mcp_broker import UNIX_SCHEME, connect_endpoint, format_endpoint
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'  # 冷却中, 不分配给新会话与对冲请求
+BREAKER_HALF_OPEN = 'half_open'  # 冷却结束, 只放行一个试探请求
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """解析 host:port; unix:///path 原样作为主机, 端口为 0"""
+    if address.startswith(UNIX_SCHEME):
+        return address, 0
+    host, _, port = address.rpartition(':')
+    if not host:
+        raise ValueError(f"后端地址格式应为 host:port: {address}")
+    return host.strip('[]'), int(port)
+
+
+class Backend:
+    """一个上游MCP服务器副本
+
+    所有计数由 BackendSet.lock 保护。
+    """
+
+    def __init__(self, host: str, port: int, weight: float = 1.0):
+        self.host = host
+        self.port = port
+        self.weight = weight
+        self.healthy = True  # 由健康检查更新, 新加入的后端先假定健康
+        self.active_sessions = 0
+        self.outstanding = 0  # 已转发、尚未收到响应的请求数
+        self.latency_ewma_us = 0.0
+        self.samples = 0
+        self.added_at = time.monotonic()  # 慢启动起点, 从驱逐中恢复时重置
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.request_failures = 0  # 连续失败或超时的请求数, 达到阈值时熔断
+        self.breaker = BREAKER_CLOSED
+        self.circuit_open_until = 0.0
+        self.trial_allocated = False  # 半开状态下已分配给一个新会话或对冲请求
+        self.trial_token = 0  # 半开状态下已放行的试探请求, 0 表示尚未放行
+        self.trial_deadline = 0.0  # 试探请求在此之前没有结果视为失败
+        self.compression = True  # 配置文件中 "compression": false 表示该后端不是代理, 不协商帧压缩
+
+    @property
+    def address(self) -> str:
+        return format_endpoint(self.host, self.port)
+
+    def available(self, now: float) -> bool:
+        """健康且未被驱逐; 熔断状态由 BackendSet 另外判断"""
+        return self.healthy and now >= self.ejected_until
+
+    def snapshot(self, now: float) -> dict:
+        return {
+            'healthy': self.healthy,
+            'ejected': now < self.ejected_until,
+            'circuit_open': self.breaker != BREAKER_CLOSED,
+            'breaker': self.breaker,
+            'request_failures': self.request_failures,
+            'weight': self.weight,
+            'active_sessions': self.active_sessions,
+            'outstanding': self.outstanding,
+            'latency_ewma_us': int(self.latency_ewma_us),
+        }
+
+
+class BackendSet:
+    """多个上游副本的负载均衡
+
+    - 选择: 每个新会话用 "二选一" (power of two choices) 在可用后端中随机取两个, 选未完成请求数更少的,
+      负载按 权重 x 慢启动系数 归一化
+    - 慢启动: 新加入或从驱逐中恢复的后端在 slow_start 秒内权重从 10% 线性升到 100%, 避免瞬间涌入
+    - 健康检查: 后台线程每 health_interval 秒尝试 TCP 建连, 连续失败 unhealthy_threshold 次标记为不健康
+    - 延迟驱逐: 后端的延迟 EWMA 超过其他可用后端中位数的 eject_ratio 倍 (且超过 eject_min_us) 时驱逐 eject_seconds 秒;
+      任何时候最多驱逐一半的后端
+    - 熔断: 后端连续 breaker_failures 个请求失败 (建连失败、对冲连接断开) 或超时 (延迟超过 breaker_timeout_us)
+      后打开, breaker_cooldown 秒内不分配给新会话与对冲请求, 冷却期间返回的成功响应不改变状态;
+      冷却结束后半开: 只分配一次, 并只放行一个试探请求 (request_sent 返回的非零令牌),
+      该请求成功才关闭, 失败、超时或半开期间有其他请求失败则再次打开。
+      已绑定该后端的会话不受熔断影响, 继续使用直到结束
+    - 配置重载: 指定 config_path 时, 健康检查线程发现文件修改后重新加载后端列表, 已有后端的计数保留,
+      被移除的后端不再分配新会话, 已有会话继续使用直到结束
+    """
+
+    EWMA_ALPHA = 0.2
+    MIN_SAMPLES = 20  # 样本不足时不参与驱逐判断
+    SLOW_START_FLOOR = 0.1
+
+    def __init__(self, addresses: List[str], loggers, config_path: Optional[str] = None,
+                 health_interval: float = 2.0, connect_timeout: float = 1.0, unhealthy_threshold: int = 2,
+                 slow_start: float = 30.0, eject_ratio: float = 3.0, eject_min_us: int = 50_000,
+                 eject_seconds: float = 30.0, breaker_failures: int = 5, breaker_timeout_us: int = 30_000_000,
+                 breaker_cooldown: float = 10.0):
+        self.logger = loggers['main']
+        self.lock = threading.Lock()
+        self.backends: Dict[str, Backend] = {}
+        self.config_path = config_path
+        self._config_mtime = 0.0
+        self.health_interval = health_interval
+        self.connect_timeout = connect_timeout
+        self.unhealthy_threshold = unhealthy_threshold
+        self.slow_start = slow_start
+        self.eject_ratio = eject_ratio
+        self.eject_min_us = eject_min_us
+        self.eject_seconds = eject_seconds
+        self.breaker_failures = breaker_failures
+        self.breaker_timeout_us = breaker_timeout_us
+        self.breaker_cooldown = breaker_cooldown
+        self._trial_tokens = itertools.count(1)
+        self.running = False
+
+        entries = [{'address': address} for address in addresses]
+        if config_path:
+            entries = self._read_config() or entries
+        self._apply(entries, initial=True)
+
+    # ---- 配置 ----
+
+    def _read_config(self) -> Optional[List[dict]]:
+        """读取后端配置文件: {"backends": ["host:port", {"address": "host:port", "weight": 2, "compression": false}, ...]}"""
+        try:
+            self._config_mtime = os.stat(self.config_path).st_mtime
+            with open(self.config_path, encoding='utf-8') as f:
+                config = json.load(f)
+            return [entry if isinstance(entry, dict) else {'address': entry} for entry in config['backends']]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.error(f"读取后端配置失败 ({self.config_path}): {e}")
+            return None
+
+    def _apply(self, entries: List[dict], initial: bool = False) -> None:
+        backends = {}
+        for entry in entries:
+            host, port = parse_address(entry['address'])
+            weight = float(entry.get('weight', 1.0))
+            existing = self.backends.get(format_endpoint(host, port))
+            if existing is not None:
+                existing.weight = weight
+                existing.compression = bool(entry.get('compression', True))
+                backends[existing.address] = existing
+            else:
+                backend = Backend(host, port, weight)
+                backend.compression = bool(entry.get('compression', True))
+                if initial:
+                    backend.added_at -= self.slow_start  # 启动时的后端不需要慢启动
+                backends[backend.address] = backend
+        if not backends:
+            raise ValueError("至少需要一个后端")
+
+        with self.lock:
+            added = backends.keys() - self.backends.keys()
+            removed = self.backends.keys() - backends.keys()
+            self.backends = backends
+        if not initial and (added or removed):
+            self.logger.info(f"后端列表已重载: 新增={sorted(added)}, 移除={sorted(removed)}")
+
+    def reload(self) -> None:
+        """重新读取配置文件"""
+        entries = self._read_config()
+        if entries is not None:
+            try:
+                self._apply(entries)
+            except ValueError as e:
+                self.logger.error(f"后端配置无效, 保持原配置: {e}")
+
+    # ---- 选择与计数 ----
+
+    def _effective_weight(self, backend: Backend, now: float) -> float:
+        ramp = (now - backend.added_at) / self.slow_start if self.slow_start > 0 else 1.0
+        return backend.weight * min(1.0, max(self.SLOW_START_FLOOR, ramp))
+
+    def _load(self, backend: Backend, now: float) -> Tuple[float, float]:
+        weight = self._effective_weight(backend, now)
+        return (backend.outstanding + 1) / weight, (backend.active_sessions + 1) / weight
+
+    def acquire(self, exclude=()) -> Backend:
+        """为新会话选择后端, exclude 为本次已尝试失败的后端"""
+        now = time.monotonic()
+        with self.lock:
+            candidates = [b for b in self.backends.values()
+                          if b.available(now) and self._usable(b, now) and b not in exclude]
+            if not candidates:
+                # 全部不可用时退而求其次: 尝试尚未失败的任意后端, 健康检查可能滞后
+                candidates = [b for b in self.backends.values() if b not in exclude]
+            if not candidates:
+                raise ConnectionError("没有可用的后端")
+            if len(candidates) == 1:
+                backend = candidates[0]
+            else:
+                first, second = random.sample(candidates, 2)
+                backend = first if self._load(first, now) <= self._load(second, now) else second
+            backend.active_sessions += 1
+            if backend.breaker == BREAKER_HALF_OPEN:
+                backend.trial_allocated = True
+            return backend
+
+    def alternate(self, exclude: Backend) -> Optional[Backend]:
+        """为对冲请求选择另一个健康且未熔断的后端 (不计入会话数), 没有时返回 None
+
+        延迟驱逐只影响新会话的分配, 被驱逐的后端仍可接收对冲请求。
+        """
+        now = time.monotonic()
+        with self.lock:
+            candidates = [b for b in self.backends.values()
+                          if b is not exclude and b.healthy and self._usable(b, now)]
+            if not candidates:
+                return None
+            if len(candidates) == 1:
+                backend = candidates[0]
+            else:
+                first, second = random.sample(candidates, 2)
+                backend = first if self._load(first, now) <= self._load(second, now) else second
+            if backend.breaker == BREAKER_HALF_OPEN:
+                backend.trial_allocated = True
+            return backend
+
+    def release(self, backend: Backend, outstanding: int = 0) -> None:
+        """会话结束, outstanding 为该会话仍未收到响应的请求数"""
+        with self.lock:
+            backend.active_sessions -= 1
+            backend.outstanding -= outstanding
+
+    def connect_failed(self, backend: Backend) -> None:
+        """会话建连失败: 归还并立即标记为不健康, 等健康检查恢复"""
+        with self.lock:
+            backend.active_sessions -= 1
+            backend.healthy = False
+            backend.consecutive_failures = max(backend.consecutive_failures, self.unhealthy_threshold)
+            self._request_failed(backend)
+        self.logger.warning(f"后端 {backend.address} 建连失败, 标记为不健康")
+
+    def request_sent(self, backend: Backend) -> int:
+        """请求已转发; 返回非零令牌表示它是半开状态下放行的试探请求, 结果需要带着令牌上报"""
+        with self.lock:
+            backend.outstanding += 1
+            now = time.monotonic()
+            if self._breaker(backend, now) != BREAKER_HALF_OPEN or backend.trial_token:
+                return 0
+            backend.trial_token = next(self._trial_tokens)
+            backend.trial_deadline = now + (self.breaker_timeout_us / 1e6 if self.breaker_timeout_us
+                                            else self.breaker_cooldown)
+            return backend.trial_token
+
+    def request_cancelled(self, backend: Backend, trial: int = 0) -> None:
+        """已转发的请求不再等待响应 (对冲请求中落后的一方); 放弃的是试探请求时允许放行下一个"""
+        with self.lock:
+            backend.outstanding -= 1
+            if trial and trial == backend.trial_token:
+                backend.trial_token = 0
+
+    def request_failed(self, backend: Backend) -> None:
+        """请求因传输错误失败 (建连失败、连接断开); JSON-RPC 错误响应不算失败"""
+        with self.lock:
+            self._request_failed(backend)
+
+    # ---- 熔断 ----
+
+    def _breaker(self, backend: Backend, now: float) -> str:
+        """在持有锁时调用: 推进熔断状态 (冷却结束 -> 半开, 试探请求超时 -> 打开) 并返回当前状态"""
+        if backend.breaker == BREAKER_OPEN and now >= backend.circuit_open_until:
+            backend.breaker = BREAKER_HALF_OPEN
+            backend.trial_allocated = False
+            backend.trial_token = 0
+            self.logger.info(f"后端 {backend.address} 熔断冷却结束, 半开: 放行一个试探请求")
+        elif backend.breaker == BREAKER_HALF_OPEN and backend.trial_token and now >= backend.trial_deadline:
+            self._open(backend, now, "半开试探请求超时")
+        return backend.breaker
+
+    def _usable(self, backend: Backend, now: float) -> bool:
+        """在持有锁时调用: 熔断状态允许分配给新会话或对冲请求"""
+        state = self._breaker(backend, now)
+        return state == BREAKER_CLOSED or (state == BREAKER_HALF_OPEN and not backend.trial_allocated)
+
+    def _open(self, backend: Backend, now: float, reason: str) -> None:
+        """在持有锁时调用"""
+        backend.breaker = BREAKER_OPEN
+        backend.circuit_open_until = now + self.breaker_cooldown
+        backend.request_failures = 0
+        backend.trial_allocated = False
+        backend.trial_token = 0
+        self.logger.warning(f"后端 {backend.address} {reason}, 熔断 {self.breaker_cooldown:g}s")
+
+    def _request_failed(self, backend: Backend) -> None:
+        """在持有锁时调用: 连续失败达到阈值时熔断, 半开期间任何失败都重新熔断"""
+        now = time.monotonic()
+        state = self._breaker(backend, now)
+        if state == BREAKER_HALF_OPEN:
+            self._open(backend, now, "半开期间请求失败")
+        elif state == BREAKER_CLOSED:
+            backend.request_failures += 1
+            if self.breaker_failures and backend.request_failures >= self.breaker_failures:
+                self._open(backend, now, f"连续 {self.breaker_failures} 个请求失败或超时")
+
+    def response_received(self, backend: Backend, latency_us: Optional[int], trial: int = 0) -> None:
+        """收到响应; latency_us 为 None 表示无法与请求配对 (服务器推送), trial 为 request_sent 返回的令牌"""
+        with self.lock:
+            if latency_us is None:
+                return
+            backend.outstanding -= 1
+            self._observe(backend, latency_us, trial)
+
+    def observe_latency(self, backend: Backend, latency_us: int, trial: int = 0) -> None:
+        """已经 request_cancelled 的请求最终返回: 只更新延迟与熔断状态"""
+        with self.lock:
+            self._observe(backend, latency_us, trial)
+
+    def _observe(self, backend: Backend, latency_us: int, trial: int = 0) -> None:
+        """在持有锁时调用"""
+        if self.breaker_timeout_us and latency_us > self.breaker_timeout_us:
+            self._request_failed(backend)
+        elif backend.breaker == BREAKER_CLOSED:
+            backend.request_failures = 0
+        elif trial and trial == backend.trial_token and self._breaker(backend, time.monotonic()) == BREAKER_HALF_OPEN:
+            backend.breaker = BREAKER_CLOSED
+            backend.circuit_open_until = 0.0
+            backend.trial_allocated = False
+            backend.trial_token = 0
+            self.logger.info(f"后端 {backend.address} 半开试探请求成功, 解除熔断")
+        if backend.samples:
+            backend.latency_ewma_us += self.EWMA_ALPHA * (latency_us - backend.latency_ewma_us)
+        else:
+            backend.latency_ewma_us = latency_us
+        backend.samples += 1
+        if backend.samples >= self.MIN_SAMPLES and backend.latency_ewma_us > self.eject_min_us:
+            self._maybe_eject(backend)
+
+    def _maybe_eject(self, backend: Backend) -> None:
+        """在持有锁时调用"""
+        now = time.monotonic()
+        if now < backend.ejected_until:
+            return
+        others = [b for b in self.backends.values()
+                  if b is not backend and b.available(now) and b.breaker == BREAKER_CLOSED
+                  and b.samples >= self.MIN_SAMPLES]
+        if not others:
+            return
+        ejected = sum(1 for b in self.backends.values() if now < b.ejected_until)
+        if ejected + 1 > len(self.backends) // 2:
+            return
+        latencies = sorted(b.latency_ewma_us for b in others)
+        median = latencies[len(latencies) // 2]
+        if backend.latency_ewma_us <= self.eject_ratio * median:
+            return
+        backend.ejected_until = now + self.eject_seconds
+        backend.added_at = backend.ejected_until  # 恢复后重新慢启动
+        self.logger.warning(f"后端 {backend.address} 延迟异常被驱逐 {self.eject_seconds:.0f}s: "
+                            f"EWMA={backend.latency_ewma_us / 1000:.1f}ms, 其他后端中位数={median / 1000:.1f}ms")
+        # 恢复后从新的样本开始判断
+        backend.samples = 0
+        backend.latency_ewma_us = 0.0
+
+    # ---- 健康检查 ----
+
+    def _check(self, backend: Backend) -> bool:
+        try:
+            connect_endpoint(backend.host, backend.port, timeout=self.connect_timeout).close()
+            return True
+        except OSError:
+            return False
+
+    def _health_loop(self) -> None:
+        while self.running:
+            if self.config_path:
+                try:
+                    if os.stat(self.config_path).st_mtime != self._config_mtime:
+                        self.reload()
+                except OSError:
+                    pass
+
+            for backend in list(self.backends.values()):
+                ok = self._check(backend)
+                with self.lock:
+                    was_healthy = backend.healthy
+                    if ok:
+                        backend.consecutive_failures = 0
+                        backend.healthy = True
+                        if not was_healthy:
+                            backend.added_at = time.monotonic()  # 恢复后慢启动
+                    else:
+                        backend.consecutive_failures += 1
+                        if backend.consecutive_failures >= self.unhealthy_threshold:
+                            backend.healthy = False
+                if ok and not was_healthy:
+                    self.logger.info(f"后端 {backend.address} 恢复健康")
+                elif was_healthy and not backend.healthy:
+                    self.logger.warning(f"后端 {backend.address} 健康检查失败, 标记为不健康")
+
+            time.sleep(self.health_interval)
+
+    def start(self) -> None:
+        self.running = True
+        threading.Thread(target=self._health_loop, daemon=True).start()
+
+    def close(self) -> None:
+        self.running = False
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            for backend in self.backends.values():
+                self._breaker(backend, now)
+            return {address: backend.snapshot(now) for address, backend in self.backends.items()}
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""FastMCP代理端到端基准: 吞吐与延迟
+
+启动一个本地回显服务 (FastMCPPacket 头部格式, 原样返回每个数据包), 先直连回显服务测得基线,
+再经由代理 (每个 --engines 启动一个 mcp_broker.py 子进程) 以相同负载测量, 两者之差即代理开销。
+每个场景报告 msgs/s、MB/s (请求+响应的数据部分) 与 p50/p99/p999 延迟, 结果写出为JSON以便比较多次运行。
+
+--rate 为所有连接合计的每秒数据包数 (开环: 按计划时间发送, 延迟从计划发送时间算起, 不受协调遗漏影响);
+为 0 时每个连接收到响应后立即发送下一个 (闭环)。
+默认负载为原始字节; --jsonrpc 时发送带递增 id 的 tools/call 请求, 回显服务返回对应的 JSON-RPC 响应,
+连接池、响应缓存、请求合并等需要解析 JSON-RPC 的代理模式必须使用该选项。
+--transports tcp unix 时每种传输各启动一组回显服务与代理 (客户端->代理->回显服务全程使用同一种传输),
+最后按场景输出Unix域套接字相对回环TCP的吞吐与延迟变化: 小包看 p50/p99, 大包看 MB/s。
+
+用法:
+    python logs/mcp_broker_bench.py --connections 1 16 --sizes 256 4096 --duration 5 --output bench.json
+    python logs/mcp_broker_bench.py --engines threaded --proxy-args="--upstream-pool 4" --jsonrpc --compare bench.json
+    python logs/mcp_broker_bench.py --transports tcp unix --sizes 64 1048576 --connections 1 8
+"""
+
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import platform
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional, Tuple
+
+from mcp_broker import FastMCPPacket, connect_endpoint, unix_path, remove_stale_unix_socket
+from mcp_broker_async import open_endpoint
+from mcp_broker_jsonrpc import parse_message, encode_message
+
+HEADER = FastMCPPacket.HEADER
+BROKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcp_broker.py')
+
+
+async def _echo_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, jsonrpc: bool) -> None:
+    try:
+        while True:
+            header = await reader.readexactly(HEADER.size)
+            version, packet_type, length = HEADER.unpack(header)
+            data = await reader.readexactly(length) if length else b''
+            if jsonrpc:
+                message = parse_message(data)
+                if message is None or message.get('id') is None:
+                    continue  # 通知不需要响应
+                data = encode_message({'jsonrpc': '2.0', 'id': message['id'],
+                                       'result': {'content': message.get('params', {}).get('arguments')}})
+                header = HEADER.pack(version, packet_type, len(data))
+            writer.write(header + data)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve_echo(host: str, port: int, jsonrpc: bool) -> None:
+    path = unix_path(host)
+    if path is None:
+        server = await asyncio.start_server(lambda r, w: _echo_client(r, w, jsonrpc), host, port, backlog=4096)
+    else:
+        remove_stale_unix_socket(path)
+        server = await asyncio.start_unix_server(lambda r, w: _echo_client(r, w, jsonrpc), path, backlog=4096)
+    async with server:
+        await server.serve_forever()
+
+
+def serve_echo(host: str, port: int, jsonrpc: bool = False) -> None:
+    """回显服务 (在子进程中运行, 不与负载生成器争抢GIL)"""
+    try:
+        asyncio.run(_serve_echo(host, port, jsonrpc))
+    except KeyboardInterrupt:
+        pass
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _endpoint(transport: str, workdir: str, name: str) -> Tuple[str, int]:
+    """tcp: 127.0.0.1 上的空闲端口; unix: 临时目录中的套接字文件"""
+    if transport == 'unix':
+        return f"unix://{os.path.join(workdir, name + '.sock')}", 0
+    return '127.0.0.1', _free_port()
+
+
+def _endpoint_args(endpoint: Tuple[str, int]) -> str:
+    host, port = endpoint
+    return host if unix_path(host) is not None else str(port)
+
+
+def _wait_for_endpoint(endpoint: Tuple[str, int], process: subprocess.Popen, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"子进程已退出: {' '.join(process.args)}")
+        try:
+            connect_endpoint(*endpoint, timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"端点 {_endpoint_args(endpoint)} 在 {timeout}s 内未就绪")
+
+
+def _stop(process: subprocess.Popen) -> None:
+    """先发送 SIGINT 让代理正常退出, 超时后强制结束"""
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def start_echo(jsonrpc: bool, transport: str, workdir: str) -> Tuple[subprocess.Popen, Tuple[str, int]]:
+    endpoint = _endpoint(transport, workdir, 'echo')
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve-echo', _endpoint_args(endpoint),
+                                *(['--jsonrpc'] if jsonrpc else [])])
+    _wait_for_endpoint(endpoint, process)
+    return process, endpoint
+
+
+def start_broker(engine: str, target: Tuple[str, int], proxy_args: List[str], workdir: str,
+                 transport: str = 'tcp') -> Tuple[subprocess.Popen, Tuple[str, int]]:
+    """启动代理子进程, 日志与控制台输出写入临时目录, 日志级别 WARNING 以免日志本身成为瓶颈"""
+    endpoint = _endpoint(transport, workdir, f"broker-{engine}")
+    command = [sys.executable, BROKER_SCRIPT, '--host', endpoint[0], '--port', str(endpoint[1]),
+               '--target-host', target[0], '--target-port', str(target[1]),
+               '--engine', engine, '--log-level', 'WARNING', *proxy_args]
+    with open(os.path.join(workdir, f"broker-{engine}.out"), 'ab') as output:
+        process = subprocess.Popen(command, cwd=workdir, stdout=output, stderr=subprocess.STDOUT)
+    _wait_for_endpoint(endpoint, process)
+    return process, endpoint
+
+
+class LoadResult:
+    def __init__(self):
+        self.latencies: List[float] = []  # 秒
+        self.payload_bytes = 0
+        self.errors = 0
+
+
+def _frame_builder(size: int, jsonrpc: bool) -> Callable[[int], bytes]:
+    """返回 第i个请求 -> 完整帧 的函数"""
+    if not jsonrpc:
+        frame = HEADER.pack(1, 0x0001, size) + b'x' * size
+        return lambda i: frame
+    padding = 'x' * max(0, size - 100)  # 使 JSON-RPC 请求的总长度约为 size
+
+    def build(i: int) -> bytes:
+        data = encode_message({'jsonrpc': '2.0', 'id': i, 'method': 'tools/call',
+                               'params': {'name': 'bench', 'arguments': {'padding': padding}}})
+        return HEADER.pack(1, 0x0001, len(data)) + data
+    return build
+
+
+async def _read_response(reader: asyncio.StreamReader) -> int:
+    """读取一个响应帧, 返回数据部分长度"""
+    length = HEADER.unpack(await reader.readexactly(HEADER.size))[2]
+    if length:
+        await reader.readexactly(length)
+    return length
+
+
+async def _closed_loop(reader, writer, build: Callable[[int], bytes], deadline: float, measure_from: float,
+                       result: LoadResult) -> None:
+    for i in itertools.count():
+        if time.perf_counter() >= deadline:
+            break
+        frame = build(i)
+        started = time.perf_counter()
+        writer.write(frame)
+        await writer.drain()
+        received = await _read_response(reader)
+        if started >= measure_from:
+            result.latencies.append(time.perf_counter() - started)
+            result.payload_bytes += len(frame) - HEADER.size + received
+
+
+async def _open_loop(reader, writer, build: Callable[[int], bytes], interval: float, deadline: float,
+                     measure_from: float, result: LoadResult) -> None:
+    scheduled = collections.deque()  # (计划发送时间, 请求数据长度), 按先进先出与响应配对
+
+    async def receive():
+        while True:
+            received = await _read_response(reader)
+            started, sent = scheduled.popleft()
+            if started >= measure_from:
+                result.latencies.append(time.perf_counter() - started)
+                result.payload_bytes += sent + received
+
+    receiver = asyncio.create_task(receive())
+    try:
+        next_send = time.perf_counter()
+        for i in itertools.count():
+            if next_send >= deadline:
+                break
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            frame = build(i)
+            scheduled.append((next_send, len(frame) - HEADER.size))
+            writer.write(frame)
+            await writer.drain()
+            next_send += interval
+        # 等待在途请求的响应
+        drain_deadline = time.perf_counter() + 5
+        while scheduled and time.perf_counter() < drain_deadline and not receiver.done():
+            await asyncio.sleep(0.001)
+        result.errors += len(scheduled)
+    finally:
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+
+
+async def _connection(endpoint: Tuple[str, int], build: Callable[[int], bytes], rate_per_connection: float,
+                      deadline: float, measure_from: float, result: LoadResult) -> None:
+    try:
+        reader, writer = await open_endpoint(*endpoint)
+    except OSError:
+        result.errors += 1
+        return
+    if unix_path(endpoint[0]) is None:
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        if rate_per_connection > 0:
+            await _open_loop(reader, writer, build, 1 / rate_per_connection, deadline, measure_from, result)
+        else:
+            await _closed_loop(reader, writer, build, deadline, measure_from, result)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        result.errors += 1
+    finally:
+        writer.close()
+
+
+def _percentile(ordered: List[float], q: float) -> int:
+    """返回微秒"""
+    if not ordered:
+        return 0
+    return int(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e6)
+
+
+def run_load(endpoint: Tuple[str, int], connections: int, size: int, rate: float, duration: float, warmup: float,
+             jsonrpc: bool = False) -> dict:
+    """对端点 (host, port) 施加负载, 返回一个场景的统计"""
+    result = LoadResult()
+    build = _frame_builder(size, jsonrpc)
+
+    async def main():
+        start = time.perf_counter()
+        measure_from = start + warmup
+        deadline = measure_from + duration
+        await asyncio.gather(*(_connection(endpoint, build, rate / connections, deadline, measure_from, result)
+                               for _ in range(connections)))
+
+    asyncio.run(main())
+    ordered = sorted(result.latencies)
+    return {
+        'messages': len(ordered),
+        'msgs_per_s': round(len(ordered) / duration, 1),
+        'mb_per_s': round(result.payload_bytes / duration / (1024 * 1024), 3),
+        'p50_us': _percentile(ordered, 0.50),
+        'p99_us': _percentile(ordered, 0.99),
+        'p999_us': _percentile(ordered, 0.999),
+        'max_us': _percentile(ordered, 1.0),
+        'errors': result.errors,
+    }
+
+
+def _scenario_key(row: dict) -> tuple:
+    return row.get('transport', 'tcp'), row['target'], row['connections'], row['size'], row['rate']
+
+
+def _print_row(row: dict, previous: Optional[dict]) -> None:
+    line = (f"{row['transport']:>5} {row['target']:>10} {row['connections']:>6} {row['size']:>8} {row['rate']:>8} "
+            f"{row['msgs_per_s']:>11,.0f} {row['mb_per_s']:>9.2f} "
+            f"{row['p50_us']:>9} {row['p99_us']:>9} {row['p999_us']:>9} {row.get('overhead_p50_us', ''):>9}")
+    if previous and previous['msgs_per_s']:
+        change = (row['msgs_per_s'] / previous['msgs_per_s'] - 1) * 100
+        line += f"  吞吐 {change:+.1f}%, p99 {previous['p99_us']} -> {row['p99_us']}us"
+    print(line, flush=True)
+
+
+def _print_transport_comparison(results: List[dict]) -> None:
+    """同一场景下Unix域套接字相对回环TCP的变化"""
+    tcp = {_scenario_key(row)[1:]: row for row in results if row['transport'] == 'tcp'}
+    rows = [(row, tcp.get(_scenario_key(row)[1:])) for row in results if row['transport'] == 'unix']
+    rows = [(row, base) for row, base in rows if base and base['msgs_per_s']]
+    if not rows:
+        return
+    print("\nUnix域套接字 相对 回环TCP:")
+    print(f"{'目标':>10} {'连接':>6} {'大小':>8} {'速率':>8} {'msgs/s':>9} {'MB/s':>9} {'p50(us)':>15} {'p99(us)':>15}")
+    for row, base in rows:
+        print(f"{row['target']:>10} {row['connections']:>6} {row['size']:>8} {row['rate']:>8} "
+              f"{(row['msgs_per_s'] / base['msgs_per_s'] - 1) * 100:>+8.1f}% "
+              f"{(row['mb_per_s'] / base['mb_per_s'] - 1) * 100 if base['mb_per_s'] else 0:>+8.1f}% "
+              f"{base['p50_us']:>7}->{row['p50_us']:<7} {base['p99_us']:>7}->{row['p99_us']:<7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FastMCP代理端到端基准: 直连基线与经由代理的吞吐/延迟")
+    parser.add_argument('--connections', type=int, nargs='+', default=[1, 16], help='并发连接数')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 4096], help='数据部分大小(字节)')
+    parser.add_argument('--rate', type=float, nargs='+', default=[0],
+                        help='所有连接合计的每秒数据包数, 0 表示闭环压测')
+    parser.add_argument('--duration', type=float, default=5.0, help='每个场景的测量时长(秒)')
+    parser.add_argument('--warmup', type=float, default=1.0, help='测量前的预热时长(秒), 不计入结果')
+    parser.add_argument('--engines', nargs='*', default=['threaded', 'asyncio'],
+                        help='要测量的代理引擎, 为空时只测直连基线')
+    parser.add_argument('--proxy-args', type=shlex.split, default=[],
+                        help='传给 mcp_broker.py 的额外参数, 例如 "--upstream-pool 4"')
+    parser.add_argument('--jsonrpc', action='store_true',
+                        help='发送 JSON-RPC 请求并由回显服务返回 JSON-RPC 响应 (连接池等模式需要)')
+    parser.add_argument('--transports', nargs='+', choices=('tcp', 'unix'), default=['tcp'],
+                        help='客户端、代理与回显服务之间的传输: 回环TCP 或 Unix域套接字')
+    parser.add_argument('--output', help='结果JSON文件')
+    parser.add_argument('--compare', help='之前运行的结果JSON, 按场景输出吞吐与p99的变化')
+    parser.add_argument('--serve-echo', metavar='PORT|unix:///PATH', help=argparse.SUPPRESS)  # 回显服务子进程
+    args = parser.parse_args()
+
+    if args.serve_echo:
+        if unix_path(args.serve_echo) is not None:
+            serve_echo(args.serve_echo, 0, args.jsonrpc)
+        else:
+            serve_echo('127.0.0.1', int(args.serve_echo), args.jsonrpc)
+        return
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = {_scenario_key(row): row for row in json.load(f)['results']}
+
+    print(f"{'传输':>5} {'目标':>10} {'连接':>6} {'大小':>8} {'速率':>8} {'msgs/s':>11} {'MB/s':>9} "
+          f"{'p50(us)':>9} {'p99(us)':>9} {'p999(us)':>9} {'开销p50':>9}")
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, 'logs'))  # 代理默认日志文件 logs/fastmcp_proxy.log
+        for transport in args.transports:
+            echo, echo_endpoint = start_echo(args.jsonrpc, transport, workdir)
+            brokers = {}
+            try:
+                for engine in args.engines:
+                    brokers[engine] = start_broker(engine, echo_endpoint, args.proxy_args, workdir, transport)
+
+                for size in args.sizes:
+                    for connections in args.connections:
+                        for rate in args.rate:
+                            baseline = None
+                            for target in ['direct', *args.engines]:
+                                endpoint = echo_endpoint if target == 'direct' else brokers[target][1]
+                                row = {'transport': transport, 'target': target, 'connections': connections,
+                                       'size': size, 'rate': rate,
+                                       **run_load(endpoint, connections, size, rate, args.duration, args.warmup,
+                                                  args.jsonrpc)}
+                                if baseline is None:
+                                    baseline = row
+                                else:
+                                    row['overhead_p50_us'] = row['p50_us'] - baseline['p50_us']
+                                    row['overhead_p99_us'] = row['p99_us'] - baseline['p99_us']
+                                results.append(row)
+                                _print_row(row, previous.get(_scenario_key(row)))
+            finally:
+                for process, _ in brokers.values():
+                    _stop(process)
+                _stop(echo)
+    _print_transport_comparison(results)
+
+    if args.output:
+        report = {
+            'timestamp': time.time(),
+            'host': {'python': platform.python_version(), 'platform': platform.platform(),
+                     'cpus': os.cpu_count()},
+            'config': {'duration': args.duration, 'warmup': args.warmup, 'jsonrpc': args.jsonrpc,
+                       'transports': args.transports, 'proxy_args': args.proxy_args},
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""FastMCP帧读取微基准: 对比 FastMCPPacket.read_packet 与 FastMCPFrameReader
+
+用法: python logs/mcp_broker_bench_framing.py --count 200000 --sizes 64 256 1024 4096
+"""
+
+import argparse
+import logging
+import socket
+import threading
+import time
+
+from mcp_broker import FastMCPPacket, FastMCPFrameReader
+
+
+class CountingSocket(socket.socket):
+    """统计 recv/recv_into 调用次数的套接字"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recv_calls = 0
+
+    def recv(self, *args):
+        self.recv_calls += 1
+        return super().recv(*args)
+
+    def recv_into(self, *args):
+        self.recv_calls += 1
+        return super().recv_into(*args)
+
+
+def _quiet_loggers():
+    """基准测试中关闭协议日志, 只测量解析本身"""
+    logger = logging.getLogger('bench.protocol')
+    logger.setLevel(logging.CRITICAL)
+    logger.propagate = False
+    return {'protocol': logger}
+
+
+def _socket_pair():
+    left, right = socket.socketpair()
+    reader = CountingSocket(right.family, right.type, right.proto, fileno=right.detach())
+    return left, reader
+
+
+def _start_sender(sock: socket.socket, packet: bytes, count: int) -> threading.Thread:
+    """后台线程按数据包逐个写入, 模拟工具调用的小包流量"""
+    def send():
+        batch = packet * 64
+        full, rest = divmod(count, 64)
+        for _ in range(full):
+            sock.sendall(batch)
+        if rest:
+            sock.sendall(packet * rest)
+        sock.shutdown(socket.SHUT_WR)
+
+    thread = threading.Thread(target=send, daemon=True)
+    thread.start()
+    return thread
+
+
+def bench_legacy(packet: bytes, count: int) -> dict:
+    writer, reader = _socket_pair()
+    processor = FastMCPPacket(_quiet_loggers())
+    sender = _start_sender(writer, packet, count)
+
+    start = time.perf_counter()
+    for _ in range(count):
+        processor.read_packet(reader)
+    elapsed = time.perf_counter() - start
+
+    sender.join()
+    writer.close()
+    reader.close()
+    return {'seconds': elapsed, 'recv_calls': reader.recv_calls}
+
+
+def bench_buffered(packet: bytes, count: int) -> dict:
+    writer, reader = _socket_pair()
+    frames = FastMCPFrameReader(reader)
+    sender = _start_sender(writer, packet, count)
+
+    start = time.perf_counter()
+    received = 0
+    for version, packet_type, payload in frames:
+        received += 1
+    elapsed = time.perf_counter() - start
+
+    sender.join()
+    writer.close()
+    reader.close()
+    assert received == count, f"收到 {received} 个数据包, 期望 {count}"
+    return {'seconds': elapsed, 'recv_calls': reader.recv_calls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FastMCP帧读取微基准")
+    parser.add_argument('--count', type=int, default=100000, help='每种包大小发送的数据包数量')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 256, 1024, 4096], help='数据部分大小(字节)')
+    args = parser.parse_args()
+
+    print(f"{'大小':>8} {'读取器':>10} {'包/秒':>12} {'recv次数/包':>12}")
+    for size in args.sizes:
+        packet = FastMCPPacket.HEADER.pack(1, 0x0001, size) + b'x' * size
+        for name, bench in (('legacy', bench_legacy), ('buffered', bench_buffered)):
+            result = bench(packet, args.count)
+            rate = args.count / result['seconds']
+            per_packet = result['recv_calls'] / args.count
+            print(f"{size:>8} {name:>10} {rate:>12,.0f} {per_packet:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
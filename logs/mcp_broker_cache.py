@@ -0,0 +1,228 @@
+import collections
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from mcp_broker_jsonrpc import (parse_message, peek_message, is_request, is_response, with_id, error_response,
+                                JSONRPC_SERVER_ERROR)
+
+
+class RequestMatcher:
+    """幂等请求白名单: 数据包类型在 packet_types 中, 或 JSON-RPC 方法为 tools/call 且工具名在 tool_names 中
+
+    请求键是请求去掉 id (以及 params._meta, 其中的 progressToken 每次不同) 后规范化 JSON 的哈希,
+    参数相同的请求得到相同的键。
+    """
+
+    def __init__(self, packet_types: Iterable[int] = (), tool_names: Iterable[str] = ()):
+        self.packet_types = frozenset(packet_types)
+        self.tool_names = frozenset(tool_names)
+
+    @staticmethod
+    def _key(packet_type: int, message: Dict[str, Any]) -> bytes:
+        request = {k: v for k, v in message.items() if k != 'id'}
+        params = request.get('params')
+        if isinstance(params, dict) and '_meta' in params:
+            request['params'] = {k: v for k, v in params.items() if k != '_meta'}
+        canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.blake2b(packet_type.to_bytes(2, 'big') + canonical.encode('utf-8'), digest_size=16).digest()
+
+    def match(self, packet_type: int, payload) -> Optional[Tuple[bytes, Any]]:
+        """判断请求是否在白名单中, 是则返回 (请求键, 请求id)"""
+        payload = bytes(payload)
+        if packet_type not in self.packet_types:
+            # 只按工具名匹配时, 先做一次廉价的字节查找, 避免解析所有请求
+            if not self.tool_names or b'tools/call' not in payload:
+                return None
+        message = parse_message(payload)
+        if message is None or not is_request(message):
+            return None
+        if packet_type not in self.packet_types:
+            params = message.get('params')
+            if (message.get('method') != 'tools/call' or not isinstance(params, dict)
+                    or params.get('name') not in self.tool_names):
+                return None
+        return self._key(packet_type, message), message['id']
+
+
+class ResponseCache(RequestMatcher):
+    """幂等请求的响应缓存
+
+    只缓存白名单中的请求, 命中时把缓存的响应改写为本次请求的 id 后直接返回, 不再访问上游。
+    错误响应 (error 或 result.isError) 不缓存。淘汰策略为 LRU + TTL, 同时限制条目数与响应总字节数。
+    """
+
+    def __init__(self, packet_types: Iterable[int] = (), tool_names: Iterable[str] = (),
+                 ttl: float = 60.0, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+        super().__init__(packet_types, tool_names)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # 缓存键 -> (过期时间, 协议版本, 响应数据包类型, 响应消息, 响应字节数), 按最近使用排序
+        self._entries: 'collections.OrderedDict[bytes, Tuple[float, int, int, Dict[str, Any], int]]' = \
+            collections.OrderedDict()
+        self.bytes = 0
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: bytes, request_id: Any) -> Optional[Tuple[int, int, bytes]]:
+        """查询缓存, 命中时返回改写为 request_id 的响应 (协议版本, 数据包类型, 数据)"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        _, version, packet_type, message, _ = entry
+        return version, packet_type, with_id(message, request_id)
+
+    def put(self, key: bytes, version: int, packet_type: int, message: Dict[str, Any], size: int) -> None:
+        """缓存一个成功的响应"""
+        result = message.get('result')
+        if 'error' in message or (isinstance(result, dict) and result.get('isError')):
+            return
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, version, packet_type, message, size)
+            self.bytes += size
+            self.stores += 1
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    MAX_PENDING = 1024  # 每个连接最多登记的未完成可缓存请求
+
+    def lookup(self, packet_type: int, payload, pending: Dict[Any, bytes]) -> Optional[Tuple[int, int, bytes]]:
+        """处理一个客户端请求: 命中时返回缓存的响应; 可缓存但未命中时在连接的 pending 中登记 请求id -> 缓存键"""
+        matched = self.match(packet_type, payload)
+        if matched is None:
+            return None
+        key, request_id = matched
+        cached = self.get(key, request_id)
+        if cached is None and len(pending) < self.MAX_PENDING:
+            pending[request_id] = key
+        return cached
+
+    def response_received(self, version: int, packet_type: int, payload, pending: Dict[Any, bytes]) -> None:
+        """处理一个上游响应: 对应 pending 中登记的请求时写入缓存 (调用方在 pending 非空时才调用)"""
+        message = parse_message(payload)
+        if message is None or not is_response(message):
+            return
+        key = pending.pop(message['id'], None)
+        if key is not None:
+            self.put(key, version, packet_type, message, len(payload))
+
+    @staticmethod
+    def forget(payload, pending: Dict[Any, bytes]) -> None:
+        """未命中缓存的请求不经过本连接的上游 (被合并为等待者, 由 leader 的响应写入缓存): 撤销 pending 中的登记"""
+        if pending:
+            pending.pop(peek_message(payload)[1], None)
+
+    def _remove(self, key: bytes) -> None:
+        """在持有锁时调用"""
+        self.bytes -= self._entries.pop(key)[4]
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class SingleFlight(RequestMatcher):
+    """相同在途请求的合并 (single-flight)
+
+    白名单中的请求到达时, 如果已有参数相同的请求正在等待上游响应, 本请求不再转发, 而是登记为等待者;
+    第一个请求 (leader) 的响应到达后改写为各等待者自己的请求 id 分别返回。
+    每个在途请求最多 max_waiters 个等待者, 超出的请求照常转发。leader 所在会话结束时等待者收到错误响应。
+
+    等待者以 deliver(协议版本, 数据包类型, 数据) 回调表示, 由各引擎提供写回客户端的实现。
+    """
+
+    def __init__(self, packet_types: Iterable[int] = (), tool_names: Iterable[str] = (), max_waiters: int = 100):
+        super().__init__(packet_types, tool_names)
+        self.max_waiters = max_waiters
+        self.lock = threading.Lock()
+        self._flights: Dict[bytes, List[Tuple[Callable, Any, int]]] = {}  # 请求键 -> [(deliver, 请求id, 数据包类型)]
+
+        # 统计信息
+        self.leaders = 0  # 实际转发给上游的请求数
+        self.coalesced = 0  # 被合并、节省的上游调用数
+        self.overflow = 0  # 等待者已满而照常转发的请求数
+
+    def join(self, packet_type: int, payload, deliver: Callable, pending: Dict[Any, bytes]) -> bool:
+        """处理一个客户端请求, 返回 True 表示已作为等待者登记, 调用方不需要转发
+
+        成为 leader 时在连接的 pending 中登记 请求id -> 请求键, 收到响应后调用 response_received。
+        """
+        matched = self.match(packet_type, payload)
+        if matched is None:
+            return False
+        key, request_id = matched
+        with self.lock:
+            waiters = self._flights.get(key)
+            if waiters is None:
+                self._flights[key] = []
+                self.leaders += 1
+                pending[request_id] = key
+                return False
+            if len(waiters) >= self.max_waiters:
+                self.overflow += 1
+                return False
+            waiters.append((deliver, request_id, packet_type))
+            self.coalesced += 1
+            return True
+
+    def response_received(self, version: int, packet_type: int, payload, pending: Dict[Any, bytes]) -> None:
+        """leader 的响应到达: 分发给所有等待者 (调用方在 pending 非空时才调用)"""
+        message = parse_message(payload)
+        if message is None or not is_response(message):
+            return
+        key = pending.pop(message['id'], None)
+        if key is None:
+            return
+        with self.lock:
+            waiters = self._flights.pop(key, ())
+        for deliver, request_id, _ in waiters:
+            deliver(version, packet_type, with_id(message, request_id))
+
+    def abandon(self, pending: Dict[Any, bytes]) -> None:
+        """leader 所在会话结束: 等待者收到错误响应"""
+        for key in pending.values():
+            with self.lock:
+                waiters = self._flights.pop(key, ())
+            for deliver, request_id, request_type in waiters:
+                deliver(1, request_type, error_response(request_id, JSONRPC_SERVER_ERROR, "合并请求的上游调用已取消"))
+        pending.clear()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'inflight': len(self._flights),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'overflow': self.overflow,
+            }
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""FastMCP代理的二进制抓包格式与查询工具
+
+抓包目录由若干分段组成, 每个分段包含:
+- capture-<起始毫秒>-<进程号>-<序号>.seg  原始帧记录: RECORD 头部 + 数据
+- capture-<起始毫秒>-<进程号>-<序号>.idx  定长索引: 每条记录一项, 查询时只扫描索引
+- capture-<起始毫秒>-<进程号>-<序号>.json 分段摘要 (分段关闭时写入): 时间范围、客户端、数据包类型, 查询时可整段跳过
+
+查询示例:
+    python logs/mcp_broker_capture.py logs/capture --client 127.0.0.1_52344
+    python logs/mcp_broker_capture.py logs/capture --type 0x0001 --since 2026-10-18T09:00:00 --until 2026-10-18T10:00:00
+"""
+
+import argparse
+import base64
+import glob
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Set
+
+# 时间戳(秒), 客户端键, 方向, 协议版本, 数据包类型, 数据长度
+RECORD = struct.Struct('<dQBHHI')
+# 时间戳(秒), 客户端键, 方向, 数据包类型, 记录在 .seg 中的偏移, 数据长度
+INDEX_ENTRY = struct.Struct('<dQBHQI')
+
+CLIENT_TO_SERVER = 0
+SERVER_TO_CLIENT = 1
+DIRECTION_NAMES = {CLIENT_TO_SERVER: 'c2s', SERVER_TO_CLIENT: 's2c'}
+
+
+def client_key(client_id: str) -> int:
+    """客户端ID的稳定64位键"""
+    return int.from_bytes(hashlib.blake2b(client_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class CaptureWriter:
+    """追加写入抓包分段, 按大小或时间滚动, 多个转发线程并发调用"""
+
+    def __init__(self, directory: str, segment_bytes: int = 256 * 1024 * 1024,
+                 segment_seconds: float = 3600, flush_interval: float = 1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self._sequence = 0
+        self._data_file = None
+        self._index_file = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_segment(self, now: float) -> None:
+        self._sequence += 1
+        self._base = os.path.join(self.directory, f"capture-{int(now * 1000)}-{os.getpid()}-{self._sequence:06d}")
+        self._data_file = open(self._base + '.seg', 'wb', buffering=1024 * 1024)
+        self._index_file = open(self._base + '.idx', 'wb', buffering=64 * 1024)
+        self._offset = 0
+        self._opened_at = now
+        self._last_flush = now
+        self._first_ts = self._last_ts = now
+        self._clients: Dict[int, str] = {}
+        self._packet_types: Set[int] = set()
+
+    def _close_segment(self) -> None:
+        self._data_file.close()
+        self._index_file.close()
+        summary = {
+            'first_ts': self._first_ts,
+            'last_ts': self._last_ts,
+            'clients': {str(key): client_id for key, client_id in self._clients.items()},
+            'packet_types': sorted(self._packet_types),
+        }
+        with open(self._base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False)
+        self._data_file = self._index_file = None
+
+    def record(self, client_id: str, direction: int, version: int, packet_type: int, payload) -> None:
+        """追加一帧"""
+        now = time.time()
+        key = client_key(client_id)
+        length = len(payload)
+        with self.lock:
+            if self._data_file is None:
+                self._open_segment(now)
+            elif self._offset >= self.segment_bytes or now - self._opened_at >= self.segment_seconds:
+                self._close_segment()
+                self._open_segment(now)
+
+            self._data_file.write(RECORD.pack(now, key, direction, version, packet_type, length))
+            self._data_file.write(payload)
+            self._index_file.write(INDEX_ENTRY.pack(now, key, direction, packet_type, self._offset, length))
+            self._offset += RECORD.size + length
+
+            if key not in self._clients:
+                self._clients[key] = client_id
+            self._packet_types.add(packet_type)
+            self._last_ts = now
+
+            if now - self._last_flush >= self.flush_interval:
+                self._data_file.flush()
+                self._index_file.flush()
+                self._last_flush = now
+
+    def close(self) -> None:
+        with self.lock:
+            if self._data_file is not None:
+                self._close_segment()
+
+
+class CaptureReader:
+    """通过内存映射查询抓包目录"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def segments(self):
+        """按时间顺序返回分段路径前缀"""
+        return sorted(path[:-4] for path in glob.glob(os.path.join(self.directory, 'capture-*.idx')))
+
+    @staticmethod
+    def _summary(base: str) -> Optional[dict]:
+        try:
+            with open(base + '.json', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None  # 分段仍在写入中
+
+    def query(self, client_id: Optional[str] = None, packet_type: Optional[int] = None,
+              direction: Optional[int] = None, since: Optional[float] = None,
+              until: Optional[float] = None) -> Iterator[dict]:
+        """按客户端、数据包类型、方向和时间范围过滤记录"""
+        key = client_key(client_id) if client_id is not None else None
+
+        for base in self.segments():
+            started = int(os.path.basename(base).split('-')[1]) / 1000
+            if until is not None and started > until:
+                break
+
+            summary = self._summary(base)
+            if summary is not None:
+                if since is not None and summary['last_ts'] < since:
+                    continue
+                if key is not None and str(key) not in summary['clients']:
+                    continue
+                if packet_type is not None and packet_type not in summary['packet_types']:
+                    continue
+
+            yield from self._scan(base, key, client_id, packet_type, direction, since, until)
+
+    def _scan(self, base, key, client_id, packet_type, direction, since, until) -> Iterator[dict]:
+        with open(base + '.idx', 'rb') as index_file, open(base + '.seg', 'rb') as data_file:
+            index_size = os.fstat(index_file.fileno()).st_size // INDEX_ENTRY.size * INDEX_ENTRY.size
+            data_size = os.fstat(data_file.fileno()).st_size
+            if not index_size or not data_size:
+                return
+
+            clients = (self._summary(base) or {}).get('clients', {})
+            with mmap.mmap(index_file.fileno(), index_size, access=mmap.ACCESS_READ) as index, \
+                    mmap.mmap(data_file.fileno(), data_size, access=mmap.ACCESS_READ) as data:
+                for ts, entry_key, entry_direction, entry_type, offset, length in INDEX_ENTRY.iter_unpack(index):
+                    if key is not None and entry_key != key:
+                        continue
+                    if packet_type is not None and entry_type != packet_type:
+                        continue
+                    if direction is not None and entry_direction != direction:
+                        continue
+                    if since is not None and ts < since:
+                        continue
+                    if until is not None and ts > until:
+                        continue
+                    if offset + RECORD.size + length > data_size:
+                        break  # 数据尚未刷盘
+
+                    _, _, _, version, _, _ = RECORD.unpack_from(data, offset)
+                    start = offset + RECORD.size
+                    yield {
+                        'ts': ts,
+                        'client_id': client_id or clients.get(str(entry_key), f"{entry_key:016x}"),
+                        'direction': DIRECTION_NAMES.get(entry_direction, entry_direction),
+                        'version': version,
+                        'packet_type': entry_type,
+                        'payload': data[start:start + length],
+                    }
+
+
+def _parse_time(value: str) -> float:
+    """支持 epoch 秒或 ISO 时间"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询FastMCP代理抓包")
+    parser.add_argument('directory', help='抓包目录')
+    parser.add_argument('--client', help='客户端ID, 例如 127.0.0.1_52344')
+    parser.add_argument('--type', type=lambda v: int(v, 0), help='数据包类型, 例如 0x0001')
+    parser.add_argument('--direction', choices=('c2s', 's2c'), help='c2s: 客户端到服务器, s2c: 服务器到客户端')
+    parser.add_argument('--since', type=_parse_time, help='起始时间 (epoch秒或ISO格式)')
+    parser.add_argument('--until', type=_parse_time, help='结束时间 (epoch秒或ISO格式)')
+    parser.add_argument('--count', action='store_true', help='只输出匹配记录数')
+    args = parser.parse_args()
+
+    direction = {'c2s': CLIENT_TO_SERVER, 's2c': SERVER_TO_CLIENT}.get(args.direction)
+    records = CaptureReader(args.directory).query(args.client, args.type, direction, args.since, args.until)
+
+    if args.count:
+        print(sum(1 for _ in records))
+        return
+
+    for record in records:
+        payload = record.pop('payload')
+        try:
+            record['payload'] = payload.decode('utf-8')
+        except UnicodeDecodeError:
+            record['payload_base64'] = base64.b64encode(payload).decode('ascii')
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""FastMCP代理与上游之间协商的帧压缩
+
+压缩帧在协议版本字段的最高位 (COMPRESSED_FLAG) 置1, 数据部分为 raw deflate 流的一段。
+每条连接的每个方向各有一个压缩上下文, 帧与帧之间保留滑动窗口 (每帧 Z_SYNC_FLUSH 后去掉固定的
+00 00 FF FF 尾部, 与 WebSocket permessage-deflate 相同), 因此字段名重复的小 JSON-RPC 消息也能压缩。
+只压缩不小于阈值的数据包; 超过单连接缓冲上限、需要流式转发的大帧原样转发。
+
+协商: 开启 --upstream-compression 的代理连接上游后先发送一个 COMPRESSION_HELLO 控制包,
+上游 (开启 --accept-compression 的代理) 回复选定的算法, 之后双方按帧标志位解压。
+上游回复不支持时该连接不压缩; 超时未回复时关闭该连接 (迟到的回复会被当作普通数据包), 会话按上游建连失败处理,
+所以只对同样开启 --accept-compression 的代理开启 --upstream-compression。
+
+阈值评估: 对抓包目录中的真实流量重放压缩, 输出各阈值下的线路字节数与每MB的CPU耗时
+    python logs/mcp_broker_compress.py logs/capture --thresholds 0 64 256 1024 4096
+"""
+
+import argparse
+import asyncio
+import socket
+import threading
+import time
+import zlib
+from typing import Optional, Tuple
+
+from mcp_broker_jsonrpc import parse_message, encode_message
+
+COMPRESSED_FLAG = 0x8000  # 协议版本字段最高位: 数据部分为压缩后的字节
+COMPRESSION_HELLO = 0xFFF0  # 协商压缩的控制包类型, 不转发给上游服务
+COMPRESSION_DEFLATE = 'deflate'
+
+_SYNC_TAIL = b'\x00\x00\xff\xff'
+
+
+class CompressionError(ValueError):
+    """收到无法解压的帧"""
+
+
+class CompressionStats:
+    """所有连接共享的压缩统计: 原始字节、线路字节与压缩/解压的CPU时间"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames_compressed = 0
+        self.frames_uncompressed = 0  # 低于阈值原样发送的数据包
+        self.raw_bytes_out = 0
+        self.wire_bytes_out = 0
+        self.compress_cpu_ns = 0
+        self.frames_decompressed = 0
+        self.wire_bytes_in = 0
+        self.raw_bytes_in = 0
+        self.decompress_cpu_ns = 0
+
+    def record_compress(self, raw: int, wire: int, cpu_ns: int) -> None:
+        with self.lock:
+            self.frames_compressed += 1
+            self.raw_bytes_out += raw
+            self.wire_bytes_out += wire
+            self.compress_cpu_ns += cpu_ns
+
+    def record_uncompressed(self, size: int) -> None:
+        with self.lock:
+            self.frames_uncompressed += 1
+            self.raw_bytes_out += size
+            self.wire_bytes_out += size
+
+    def record_decompress(self, wire: int, raw: int, cpu_ns: int) -> None:
+        with self.lock:
+            self.frames_decompressed += 1
+            self.wire_bytes_in += wire
+            self.raw_bytes_in += raw
+            self.decompress_cpu_ns += cpu_ns
+
+    @staticmethod
+    def _cpu_ms_per_mb(cpu_ns: int, raw: int) -> float:
+        return round(cpu_ns / 1e6 / (raw / (1024 * 1024)), 3) if raw else 0.0
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'frames_compressed': self.frames_compressed,
+                'frames_uncompressed': self.frames_uncompressed,
+                'raw_bytes_out': self.raw_bytes_out,
+                'wire_bytes_out': self.wire_bytes_out,
+                'ratio_out': round(self.wire_bytes_out / self.raw_bytes_out, 4) if self.raw_bytes_out else 1.0,
+                'compress_cpu_seconds': self.compress_cpu_ns / 1e9,
+                'compress_cpu_ms_per_mb': self._cpu_ms_per_mb(self.compress_cpu_ns, self.raw_bytes_out),
+                'frames_decompressed': self.frames_decompressed,
+                'wire_bytes_in': self.wire_bytes_in,
+                'raw_bytes_in': self.raw_bytes_in,
+                'decompress_cpu_seconds': self.decompress_cpu_ns / 1e9,
+                'decompress_cpu_ms_per_mb': self._cpu_ms_per_mb(self.decompress_cpu_ns, self.raw_bytes_in),
+            }
+
+
+class FrameCodec:
+    """一条连接上的压缩上下文: 发送方向一个 compressobj, 接收方向一个 decompressobj
+
+    encode 必须按写出顺序调用 (调用方在持有该连接的写锁时编码), decode 按读取顺序调用。
+    """
+
+    def __init__(self, stats: CompressionStats, threshold: int = 128, level: int = 6,
+                 max_frame_size: int = 64 * 1024 * 1024):
+        self.stats = stats
+        self.threshold = threshold
+        self.max_frame_size = max_frame_size
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def encode(self, version: int, data) -> Tuple[int, bytes]:
+        """返回要写出的 (协议版本, 数据): 不小于阈值的数据包压缩并在版本字段置压缩标志"""
+        if len(data) < self.threshold:
+            self.stats.record_uncompressed(len(data))
+            return version, data
+        started = time.thread_time_ns()
+        payload = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if payload.endswith(_SYNC_TAIL):
+            payload = payload[:-len(_SYNC_TAIL)]
+        self.stats.record_compress(len(data), len(payload), time.thread_time_ns() - started)
+        return version | COMPRESSED_FLAG, payload
+
+    def decode(self, version: int, payload) -> Tuple[int, bytes]:
+        """解压一个带压缩标志的帧, 返回 (原协议版本, 原始数据)"""
+        started = time.thread_time_ns()
+        try:
+            data = self._decompressor.decompress(bytes(payload) + _SYNC_TAIL, self.max_frame_size + 1)
+        except zlib.error as e:
+            raise CompressionError(f"解压失败: {e}") from None
+        if len(data) > self.max_frame_size or self._decompressor.unconsumed_tail:
+            raise CompressionError(f"解压后的数据包超过上限 {self.max_frame_size}")
+        self.stats.record_decompress(len(payload), len(data), time.thread_time_ns() - started)
+        return version & ~COMPRESSED_FLAG, data
+
+
+def decode_frame(codec: Optional[FrameCodec], version: int, data) -> Tuple[int, bytes]:
+    """转发循环读到带压缩标志的帧时调用"""
+    if codec is None:
+        raise CompressionError("连接未协商压缩却收到压缩帧")
+    if data is None:
+        raise CompressionError("压缩帧超过单连接缓冲上限")
+    return codec.decode(version, data)
+
+
+class FrameCompression:
+    """代理的压缩配置
+
+    upstream: 与上游 (每个会话的上游连接或连接池中的连接) 协商压缩, 上游必须是开启 accept 的代理;
+              配置多个后端时, 配置文件中 "compression": false 的后端 (普通MCP服务器) 不协商
+    accept: 接受下游代理发来的压缩协商, 对该客户端连接的两个方向压缩
+    """
+
+    def __init__(self, upstream: bool = False, accept: bool = False, threshold: int = 128, level: int = 6,
+                 max_frame_size: int = 64 * 1024 * 1024, negotiate_timeout: float = 2.0):
+        self.upstream = upstream
+        self.accept = accept
+        self.threshold = threshold
+        self.level = level
+        self.max_frame_size = max_frame_size
+        self.negotiate_timeout = negotiate_timeout
+        self.stats = CompressionStats()
+
+    def offers_to(self, backend=None) -> bool:
+        """是否与该上游 (backend 为 None 时是 --target-host 指定的上游) 协商压缩"""
+        return self.upstream and (backend is None or backend.compression)
+
+    def new_codec(self) -> FrameCodec:
+        return FrameCodec(self.stats, self.threshold, self.level, self.max_frame_size)
+
+    @staticmethod
+    def offer_payload() -> bytes:
+        return encode_message({'compression': [COMPRESSION_DEFLATE]})
+
+    def _accepted(self, packet_type: int, payload, logger) -> Optional[FrameCodec]:
+        if packet_type != COMPRESSION_HELLO:
+            logger.warning(f"上游不支持压缩协商 (收到类型=0x{packet_type:04X}), 该连接不压缩")
+            return None
+        message = parse_message(payload) or {}
+        if message.get('compression') != COMPRESSION_DEFLATE:
+            logger.info("上游拒绝压缩, 该连接不压缩")
+            return None
+        return self.new_codec()
+
+    def offer(self, packet_processor, sock: socket.socket, logger) -> Optional[FrameCodec]:
+        """在新建的上游连接上协商压缩, 在转发开始之前调用; 返回 None 表示不压缩
+
+        上游在 negotiate_timeout 内没有回复时抛出 ConnectionError, 调用方关闭该连接:
+        迟到的回复会被当作普通数据包, 不能在同一连接上继续转发。
+        """
+        packet_processor.write_packet(sock, 1, COMPRESSION_HELLO, self.offer_payload())
+        timeout = sock.gettimeout()
+        sock.settimeout(self.negotiate_timeout)
+        try:
+            _, packet_type, payload = packet_processor.read_packet(sock)
+        except socket.timeout:
+            raise ConnectionError(f"上游 {self.negotiate_timeout}s 内未回复压缩协商 (上游不是代理?), 关闭连接") from None
+        finally:
+            sock.settimeout(timeout)
+        return self._accepted(packet_type, payload, logger)
+
+    async def offer_async(self, packet_processor, reader, writer, logger) -> Optional[FrameCodec]:
+        """offer 的 asyncio 版本"""
+        await packet_processor.write_packet_async(writer, 1, COMPRESSION_HELLO, self.offer_payload())
+        try:
+            _, packet_type, payload = await asyncio.wait_for(packet_processor.read_packet_async(reader),
+                                                             self.negotiate_timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"上游 {self.negotiate_timeout}s 内未回复压缩协商 (上游不是代理?), 关闭连接") from None
+        return self._accepted(packet_type, payload, logger)
+
+    def answer(self, payload) -> Tuple[bytes, Optional[FrameCodec]]:
+        """处理下游代理的协商请求, 返回 (回复数据, 该客户端连接的压缩上下文)"""
+        message = parse_message(payload) or {}
+        offered = message.get('compression')
+        if not self.accept or not isinstance(offered, list) or COMPRESSION_DEFLATE not in offered:
+            return encode_message({'compression': None}), None
+        return encode_message({'compression': COMPRESSION_DEFLATE}), self.new_codec()
+
+
+def replay_capture(directory: str, threshold: int, level: int) -> dict:
+    """按抓包中的客户端与方向分别建立压缩上下文, 重放全部数据包"""
+    from mcp_broker_capture import CaptureReader
+
+    stats = CompressionStats()
+    codecs = {}
+    for record in CaptureReader(directory).query():
+        key = (record['client_id'], record['direction'])
+        codec = codecs.get(key)
+        if codec is None:
+            codec = codecs[key] = FrameCodec(stats, threshold, level)
+        version, payload = codec.encode(record['version'], record['payload'])
+        if version & COMPRESSED_FLAG:
+            codec.decode(version, payload)
+    return stats.snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用抓包流量评估FastMCP帧压缩的阈值")
+    parser.add_argument('directory', help='抓包目录 (mcp_broker.py --capture-dir)')
+    parser.add_argument('--thresholds', type=int, nargs='+', default=[0, 64, 256, 1024, 4096])
+    parser.add_argument('--level', type=int, default=6, help='zlib 压缩级别 1-9')
+    args = parser.parse_args()
+
+    print(f"{'阈值':>8} {'原始字节':>12} {'线路字节':>12} {'压缩比':>8} {'压缩帧':>8} "
+          f"{'压缩ms/MB':>10} {'解压ms/MB':>10}")
+    for threshold in args.thresholds:
+        stats = replay_capture(args.directory, threshold, args.level)
+        print(f"{threshold:>8} {stats['raw_bytes_out']:>12} {stats['wire_bytes_out']:>12} "
+              f"{stats['ratio_out']:>8.3f} {stats['frames_compressed']:>8} "
+              f"{stats['compress_cpu_ms_per_mb']:>10.2f} {stats['decompress_cpu_ms_per_mb']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import collections
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from mcp_broker_cache import RequestMatcher
+from mcp_broker_jsonrpc import parse_message, is_response
+
+HEDGE_PENDING = 0  # 主请求与对冲请求都未返回
+HEDGE_PRIMARY = 1  # 主请求先返回
+HEDGE_WON = 2  # 对冲请求先返回
+HEDGE_ABANDONED = 3  # 会话结束
+
+
+class Hedge:
+    """一个可对冲的在途请求
+
+    主请求照常经会话自己的上游连接转发; 到期仍未返回时由 HedgedRequests 经另一个后端的连接池发送副本。
+    副本的响应通过 deliver 回到 HedgedRequests, 副本所在连接断开时调用 connection_lost。
+    """
+
+    __slots__ = ('hedger', 'handler', 'primary', 'version', 'packet_type', 'message', 'request_id',
+                 'inflight', 'state', 'sent', 'backend', 'connection', 'upstream_id', 'sent_at', 'trial')
+
+    def __init__(self, hedger: 'HedgedRequests', handler, version: int, packet_type: int,
+                 message: Dict[str, Any], inflight: tuple):
+        self.hedger = hedger
+        self.handler = handler
+        self.primary = handler.backend
+        self.version = version
+        self.packet_type = packet_type
+        self.message = message
+        self.request_id = message['id']
+        self.inflight = inflight  # 会话 _inflight 中对应的 (请求开始时间ns, 数据包类型, 熔断试探令牌)
+        self.state = HEDGE_PENDING
+        self.sent = False
+        self.backend = None  # 对冲请求发往的后端
+        self.connection = None
+        self.upstream_id = None
+        self.sent_at = 0
+        self.trial = 0  # 对冲后端处于半开状态时, 本请求是放行的试探请求
+
+    def deliver(self, version: int, packet_type: int, data: bytes) -> None:
+        """由对冲连接池的读取线程调用"""
+        self.hedger._hedge_response(self, version, packet_type, data)
+
+    def connection_lost(self) -> None:
+        """对冲请求所在的连接断开"""
+        self.hedger._hedge_failed(self)
+
+
+class HedgedRequests(RequestMatcher):
+    """对冲请求 (hedged requests) 与延迟预算
+
+    白名单中的幂等请求转发后, 如果在 延迟阈值 内主请求还没有返回, 就把同一请求发给另一个可用后端,
+    先返回的响应写回客户端, 另一方发送 MCP 取消通知 (notifications/cancelled), 其迟到的响应被丢弃。
+
+    - 延迟阈值: 最近 window 个被跟踪请求延迟的 percentile 分位数, 不低于 min_delay_ms; 样本不足 MIN_SAMPLES 时不对冲
+    - 对冲比例: 令牌桶, 每个被跟踪的请求积累 max_share 个令牌, 每次对冲消耗 1 个, 额外请求不超过 max_share
+    - 对冲请求经每个后端一个的专用连接池 (UpstreamPool, size=1) 发送, JSON-RPC id 改写为池内唯一 id;
+      所用连接先以发起会话的 initialize 参数完成握手, 建连与握手在单独的 hedge-send 线程中进行, 不阻塞调度;
+      对冲请求返回 JSON-RPC 错误或连接断开时不写回客户端, 继续等待主请求; 只有连接断开 (传输失败) 与超时
+      计入该后端的熔断失败次数, 应用层错误响应照常计入延迟
+    - 只支持 threaded 引擎且需要配置多个后端 (--backends)
+    """
+
+    MIN_SAMPLES = 20
+    BURST = 10.0  # 令牌桶容量: 最多连续对冲的请求数
+    MAX_HEDGED_OUT = 1024  # 每个会话记住的对冲成功请求数, 用于丢弃主请求迟到的响应
+
+    def __init__(self, packet_types: Iterable[int] = (), tool_names: Iterable[str] = (), max_share: float = 0.05,
+                 percentile: float = 0.95, min_delay_ms: float = 5.0, window: int = 1000):
+        super().__init__(packet_types, tool_names)
+        self.max_share = max_share
+        self.percentile = percentile
+        self.min_delay_us = int(min_delay_ms * 1000)
+        self.lock = threading.Lock()
+        self._cond = threading.Condition(self.lock)
+        self._latencies = collections.deque(maxlen=window)
+        self._delay_us: Optional[int] = None
+        self._since_update = 0
+        self._tokens = 0.0
+        self._heap = []  # (到期时间ns, 序号, Hedge)
+        self._seq = itertools.count()
+        self._pools: Dict[str, Any] = {}  # 后端地址 -> UpstreamPool
+        self.backends = None
+        self.running = False
+
+        # 统计信息
+        self.tracked = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.budget_denied = 0  # 到期但超出对冲比例的请求数
+        self.no_backend = 0  # 到期但没有其他可用后端的请求数
+        self.hedge_errors = 0  # 对冲请求发送失败或连接断开
+
+    def start(self, backends, loggers, budget=None, compression=None) -> None:
+        self.backends = backends
+        self.loggers = loggers
+        self.logger = loggers['main']
+        self.budget = budget
+        self.compression = compression
+        self.running = True
+        threading.Thread(target=self._schedule_loop, name='hedge-scheduler', daemon=True).start()
+
+    def close(self) -> None:
+        with self._cond:
+            self.running = False
+            self._heap.clear()
+            self._cond.notify()
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+    # ---- 会话转发线程调用 ----
+
+    def track(self, handler, version: int, packet_type: int, data, inflight: tuple) -> None:
+        """主请求转发之前调用: 白名单中的请求登记到会话的 _hedges 并安排对冲"""
+        if handler.backend is None or self.match(packet_type, data) is None:
+            return
+        message = parse_message(data)
+        hedge = Hedge(self, handler, version, packet_type, message, inflight)
+        with self._cond:
+            self.tracked += 1
+            self._tokens = min(self.BURST, self._tokens + self.max_share)
+            handler._hedges[hedge.request_id] = hedge
+            if self._delay_us is None:
+                return
+            heapq.heappush(self._heap, (inflight[0] + self._delay_us * 1000, next(self._seq), hedge))
+            if self._heap[0][2] is hedge:
+                self._cond.notify()
+
+    def primary_response(self, handler, data) -> bool:
+        """主请求的上游返回一个数据包 (会话 _hedges 或 _hedged_out 非空时调用), 返回 False 表示应丢弃"""
+        message = parse_message(data)
+        if message is None or not is_response(message):
+            return True
+        request_id = message['id']
+        with self.lock:
+            hedge = handler._hedges.pop(request_id, None)
+            if hedge is None:
+                hedge = handler._hedged_out.pop(request_id, None)
+                if hedge is None:
+                    return True
+            if hedge.state == HEDGE_WON:
+                latency_us = (time.perf_counter_ns() - hedge.inflight[0]) // 1000
+            else:
+                hedge.state = HEDGE_PRIMARY
+                self.primary_wins += hedge.sent
+                self._record((time.perf_counter_ns() - hedge.inflight[0]) // 1000)
+                latency_us = None
+        if latency_us is not None:
+            # 对冲请求已先返回, 主请求迟到的响应只用于更新后端延迟
+            if hedge.primary:
+                self.backends.observe_latency(hedge.primary, latency_us, hedge.inflight[2])
+            return False
+        if hedge.sent and hedge.connection is not None:
+            self._cancel_hedge(hedge, "主请求已返回")
+        return True
+
+    def abandon(self, handler) -> None:
+        """会话结束: 取消已发出的对冲请求"""
+        with self.lock:
+            hedges = list(handler._hedges.values())
+            handler._hedges.clear()
+            handler._hedged_out.clear()
+            for hedge in hedges:
+                hedge.state = HEDGE_ABANDONED
+        for hedge in hedges:
+            if hedge.sent and hedge.connection is not None:
+                self._cancel_hedge(hedge, "会话已结束")
+
+    # ---- 内部 ----
+
+    def _record(self, latency_us: int) -> None:
+        """在持有锁时调用: 更新延迟样本, 每积累一批样本重新计算延迟阈值"""
+        self._latencies.append(latency_us)
+        self._since_update += 1
+        if len(self._latencies) < self.MIN_SAMPLES or (self._delay_us is not None and self._since_update < 50):
+            return
+        self._since_update = 0
+        latencies = sorted(self._latencies)
+        quantile = latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile))]
+        self._delay_us = max(self.min_delay_us, quantile)
+
+    def _schedule_loop(self) -> None:
+        while True:
+            with self._cond:
+                while self.running and (not self._heap or self._heap[0][0] > time.perf_counter_ns()):
+                    timeout = (self._heap[0][0] - time.perf_counter_ns()) / 1e9 if self._heap else None
+                    self._cond.wait(timeout)
+                if not self.running:
+                    return
+                _, _, hedge = heapq.heappop(self._heap)
+                if hedge.state != HEDGE_PENDING or not hedge.handler.running:
+                    continue
+                if self._tokens < 1:
+                    self.budget_denied += 1
+                    continue
+                backend = self.backends.alternate(hedge.primary)
+                if backend is None:
+                    self.no_backend += 1
+                    continue
+                self._tokens -= 1
+                hedge.sent = True
+                hedge.backend = backend
+            # 发送可能要先建连并代为握手, 放到单独的线程里, 不耽误其他到期请求的调度
+            threading.Thread(target=self._send, args=(hedge,), name='hedge-send', daemon=True).start()
+
+    def _pool(self, backend):
+        from mcp_broker_pool import UpstreamPool
+        with self.lock:
+            if not self.running:
+                raise ConnectionError("对冲已停止")
+            pool = self._pools.get(backend.address)
+            if pool is None:
+                pool = self._pools[backend.address] = UpstreamPool(
+                    backend.host, backend.port, self.loggers, size=1, connect_timeout=self.backends.connect_timeout,
+                    budget=self.budget,
+                    compression=self.compression if self.compression and self.compression.offers_to(backend) else None)
+        return pool
+
+    def _send(self, hedge: Hedge) -> None:
+        """在 hedge-send 线程中发送对冲请求"""
+        backend = hedge.backend
+        hedge.sent_at = time.perf_counter_ns()
+        try:
+            connection, upstream_id = self._pool(backend).call(hedge, hedge.version, hedge.packet_type,
+                                                               hedge.message, hedge.handler.initialize)
+        except (OSError, ConnectionError) as e:
+            self.logger.warning(f"发送对冲请求到后端 {backend.address} 失败: {e}")
+            with self.lock:
+                self.hedge_errors += 1
+            self.backends.request_failed(backend)
+            return
+        hedge.trial = self.backends.request_sent(backend)
+        with self.lock:
+            self.hedged += 1
+            hedge.connection = connection
+            hedge.upstream_id = upstream_id
+            decided = hedge.state in (HEDGE_PRIMARY, HEDGE_ABANDONED)
+        if decided:
+            self._cancel_hedge(hedge, "主请求已返回")
+
+    def _cancel_hedge(self, hedge: Hedge, reason: str) -> None:
+        # cancel 在连接的锁内检查并移除在途请求, 已经返回或已经取消时返回 False
+        if hedge.connection.cancel(hedge.upstream_id, hedge.version, hedge.packet_type, reason):
+            self.backends.request_cancelled(hedge.backend, hedge.trial)
+
+    def _hedge_failed(self, hedge: Hedge) -> None:
+        """对冲请求所在的连接断开: 计入该后端的熔断失败, 继续等待主请求"""
+        with self.lock:
+            self.hedge_errors += 1
+        self.backends.request_cancelled(hedge.backend)
+        self.backends.request_failed(hedge.backend)
+
+    def _hedge_response(self, hedge: Hedge, version: int, packet_type: int, data: bytes) -> None:
+        """对冲请求的响应 (id 已恢复为客户端的原始 id)"""
+        latency_us = (time.perf_counter_ns() - hedge.sent_at) // 1000
+        self.backends.response_received(hedge.backend, latency_us, hedge.trial)
+        message = parse_message(data) or {}
+        if 'error' in message:
+            return  # 应用层错误不代替主请求的响应, 也不算后端故障
+        handler = hedge.handler
+        with self.lock:
+            if hedge.state != HEDGE_PENDING:
+                return
+            hedge.state = HEDGE_WON
+            self.hedge_wins += 1
+            self._record((time.perf_counter_ns() - hedge.inflight[0]) // 1000)
+            handler._hedges.pop(hedge.request_id, None)
+            handler._hedged_out[hedge.request_id] = hedge
+            while len(handler._hedged_out) > self.MAX_HEDGED_OUT:
+                handler._hedged_out.popitem(last=False)
+        handler.hedge_won(hedge, version, packet_type, data)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'tracked': self.tracked,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'primary_wins': self.primary_wins,
+                'budget_denied': self.budget_denied,
+                'no_backend': self.no_backend,
+                'hedge_errors': self.hedge_errors,
+                'share': round(self.hedged / self.tracked, 4) if self.tracked else 0.0,
+                'delay_us': self._delay_us,
+            }
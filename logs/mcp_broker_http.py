@@ -0,0 +1,848 @@
+#!/usr/bin/env python3
+"""HTTP代理模式: 位于 streamable-http (/streamable) 与 SSE (/sse + /messages/) MCP服务之前
+
+与 FastMCP 二进制分帧代理共用后端选择、健康检查、熔断与指标, 请求按 HTTP/1.1 转发:
+- 上游连接保持长连接并按后端放入空闲池复用, 复用的连接在收到响应之前断开时 (服务器关闭了空闲连接) 换新连接重试一次
+- 响应体不缓冲: Content-Length、chunked 与 text/event-stream 都按到达的分块边读边写, 写客户端后等待 drain
+- 会话亲和: 响应中出现 mcp-session-id (streamable-http) 或 SSE endpoint 事件中的 session_id (SSE 传输) 时
+  把会话绑定到处理它的后端, 之后带该会话id的请求都发往同一后端; DELETE 会话或长时间不用时解除绑定
+- JSON-RPC 计时: 解析请求体中的方法 (tools/call 带工具名), 与 JSON 响应体、SSE 事件中相同 id 的响应配对,
+  按方法记录延迟与错误数 (未知方法与超过上限的工具名记为 other), 每个调用写一行日志
+
+用法:
+    python logs/mcp_broker.py --protocol http --port 25580 --target-port 5051
+    python logs/mcp_broker.py --protocol http --backends 127.0.0.1:5051,127.0.0.1:5052
+"""
+
+import asyncio
+import collections
+import itertools
+import json
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from mcp_broker import setup_logging, shutdown_logging, unix_path, format_endpoint, remove_stale_unix_socket
+from mcp_broker_async import open_endpoint
+from mcp_broker_metrics import BrokerMetrics, MetricsServer
+
+HEADER_LIMIT = 64 * 1024  # 请求/响应头部的上限
+PARSE_LIMIT = 1024 * 1024  # 不超过该长度的请求体整体读取并解析 JSON-RPC, 更大的直接流式转发
+READ_CHUNK = 64 * 1024
+SESSION_HEADER = 'mcp-session-id'
+HOP_BY_HOP = frozenset(('connection', 'keep-alive', 'proxy-connection', 'te', 'trailer', 'upgrade'))
+_SESSION_QUERY = re.compile(rb'session_id=([0-9A-Za-z_-]+)')
+
+
+class HttpError(Exception):
+    """客户端请求无法处理, 由代理直接返回 status"""
+
+    def __init__(self, status: int, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class HttpMessage:
+    """请求或响应的起始行与头部 (保留原始大小写与顺序)"""
+
+    __slots__ = ('start_line', 'headers')
+    INVALID_STATUS = 400  # 格式错误时回复的状态码: 客户端请求为 400, 上游响应为 502
+
+    def __init__(self, head: bytes):
+        try:
+            lines = head.decode('latin-1').split('\r\n')
+        except UnicodeDecodeError:
+            raise HttpError(self.INVALID_STATUS, "头部编码无效") from None
+        self.start_line = lines[0]
+        self.headers: List[Tuple[str, str]] = []
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep or not name or name != name.strip():
+                raise HttpError(self.INVALID_STATUS, f"无效的头部: {line[:80]}")
+            self.headers.append((name, value.strip()))
+
+    def header(self, name: str) -> Optional[str]:
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    def tokens(self, name: str) -> List[str]:
+        """逗号分隔的头部值 (Connection, Transfer-Encoding), 小写"""
+        name = name.lower()
+        return [token.strip().lower() for key, value in self.headers if key.lower() == name
+                for token in value.split(',') if token.strip()]
+
+    @property
+    def chunked(self) -> bool:
+        return 'chunked' in self.tokens('transfer-encoding')
+
+    @property
+    def content_length(self) -> Optional[int]:
+        value = self.header('content-length')
+        if value is None:
+            return None
+        if not value.isdigit():
+            raise HttpError(self.INVALID_STATUS, f"无效的 Content-Length: {value}")
+        return int(value)
+
+    def forwarded_head(self, start_line: str, extra: List[Tuple[str, str]] = ()) -> bytes:
+        """去掉逐跳头部 (以及 Connection 中列出的头部) 后重新编码"""
+        drop = HOP_BY_HOP | set(self.tokens('connection'))
+        lines = [start_line]
+        lines.extend(f"{name}: {value}" for name, value in self.headers if name.lower() not in drop)
+        lines.extend(f"{name}: {value}" for name, value in extra)
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+class HttpRequest(HttpMessage):
+    __slots__ = ('method', 'target', 'version')
+
+    def __init__(self, head: bytes):
+        super().__init__(head)
+        parts = self.start_line.split(' ')
+        if len(parts) != 3 or not parts[2].startswith('HTTP/1.'):
+            raise HttpError(400, f"无效的请求行: {self.start_line[:80]}")
+        self.method, self.target, self.version = parts
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.tokens('connection')
+        if self.version == 'HTTP/1.0':
+            return 'keep-alive' in connection
+        return 'close' not in connection
+
+    @property
+    def session_id(self) -> Optional[str]:
+        """streamable-http 的 mcp-session-id 头部, 或 SSE 传输 /messages/?session_id= 的查询参数"""
+        session_id = self.header(SESSION_HEADER)
+        if session_id:
+            return session_id
+        query = urlsplit(self.target).query
+        if 'session_id' in query:
+            values = parse_qs(query).get('session_id')
+            if values:
+                return values[0]
+        return None
+
+
+class HttpResponse(HttpMessage):
+    __slots__ = ('version', 'status')
+    INVALID_STATUS = 502
+
+    def __init__(self, head: bytes):
+        super().__init__(head)
+        parts = self.start_line.split(' ', 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/1.') or not parts[1].isdigit():
+            raise HttpError(502, f"上游返回了无效的状态行: {self.start_line[:80]}")
+        self.version = parts[0]
+        self.status = int(parts[1])
+
+    def has_body(self, request_method: str) -> bool:
+        return not (request_method == 'HEAD' or 100 <= self.status < 200 or self.status in (204, 304))
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.version == 'HTTP/1.1' and 'close' not in self.tokens('connection')
+
+
+# 客户端可以调用的 MCP 方法; 其他方法名与超出上限的工具名归入 "other", 避免指标标签无限增长
+MCP_METHODS = frozenset((
+    'initialize', 'ping', 'tools/list', 'tools/call', 'resources/list', 'resources/templates/list',
+    'resources/read', 'resources/subscribe', 'resources/unsubscribe', 'prompts/list', 'prompts/get',
+    'completion/complete', 'logging/setLevel',
+))
+OTHER_LABEL = 'other'
+_TOOL_NAME = re.compile(r'[A-Za-z0-9_.\-/]{1,64}')
+
+
+class CallLabels:
+    """计时与日志使用的方法名: tools/call 附带工具名, 只记录前 max_tools 个出现过的工具"""
+
+    def __init__(self, max_tools: int = 64):
+        self.max_tools = max_tools
+        self.tools: set = set()
+
+    def label(self, message: Dict[str, Any]) -> str:
+        method = message.get('method')
+        if method not in MCP_METHODS:
+            return OTHER_LABEL
+        params = message.get('params')
+        if method != 'tools/call' or not isinstance(params, dict):
+            return method
+        name = params.get('name')
+        if not isinstance(name, str) or not _TOOL_NAME.fullmatch(name):
+            return f"tools/call:{OTHER_LABEL}"
+        if name not in self.tools:
+            if len(self.tools) >= self.max_tools:
+                return f"tools/call:{OTHER_LABEL}"
+            self.tools.add(name)
+        return f"tools/call:{name}"
+
+
+def _parse_calls(body: bytes, labels: CallLabels) -> List[Tuple[Any, str]]:
+    """请求体中带 id 的 JSON-RPC 请求 (支持批量), 返回 [(id, 方法名)]"""
+    if not body or body[:1] not in (b'{', b'['):
+        return []
+    try:
+        payload = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        return []
+    messages = payload if isinstance(payload, list) else [payload]
+    return [(message['id'], labels.label(message)) for message in messages
+            if isinstance(message, dict) and 'method' in message and message.get('id') is not None]
+
+
+def _parse_results(data: bytes) -> List[Tuple[Any, bool]]:
+    """JSON 响应体或 SSE 事件数据中的 JSON-RPC 响应, 返回 [(id, 是否错误)]"""
+    if not data or data.lstrip()[:1] not in (b'{', b'['):
+        return []
+    try:
+        payload = json.loads(data)
+    except (ValueError, UnicodeDecodeError):
+        return []
+    messages = payload if isinstance(payload, list) else [payload]
+    results = []
+    for message in messages:
+        if isinstance(message, dict) and 'method' not in message and message.get('id') is not None:
+            result = message.get('result')
+            results.append((message['id'], 'error' in message or
+                            (isinstance(result, dict) and bool(result.get('isError')))))
+    return results
+
+
+class SseScanner:
+    """增量解析转发中的 text/event-stream, 每个完整事件回调 on_event(事件名, 数据)
+
+    只观察不修改数据; 单行超过 max_line 时停止解析 (继续转发)。
+    """
+
+    __slots__ = ('on_event', 'max_line', 'buffer', 'event', 'data', 'enabled')
+
+    def __init__(self, on_event, max_line: int = PARSE_LIMIT):
+        self.on_event = on_event
+        self.max_line = max_line
+        self.buffer = bytearray()
+        self.event = b''
+        self.data: List[bytes] = []
+        self.enabled = True
+
+    def feed(self, chunk: bytes) -> None:
+        if not self.enabled:
+            return
+        self.buffer += chunk
+        while True:
+            index = self.buffer.find(b'\n')
+            if index < 0:
+                if len(self.buffer) > self.max_line:
+                    self.enabled = False
+                    self.buffer.clear()
+                return
+            line = bytes(self.buffer[:index]).rstrip(b'\r')
+            del self.buffer[:index + 1]
+            if not line:
+                if self.data:
+                    self.on_event(self.event, b'\n'.join(self.data))
+                self.event, self.data = b'', []
+            elif line.startswith(b'data:'):
+                value = line[5:]
+                self.data.append(value[1:] if value[:1] == b' ' else value)
+            elif line.startswith(b'event:'):
+                self.event = line[6:].strip()
+
+
+class EventStream:
+    """一个转发中的 text/event-stream 响应"""
+
+    __slots__ = ('call_key', 'backend', 'acquired', 'session_id')
+
+    def __init__(self, call_key: str, backend):
+        self.call_key = call_key  # 事件中的 JSON-RPC 响应按该键配对
+        self.backend = backend
+        self.acquired = False  # SSE 传输的 GET: 为新会话占用了后端, 等待 endpoint 事件绑定
+        self.session_id: Optional[str] = None  # endpoint 事件中的会话id
+
+
+class HttpProxyStats:
+    """HTTP代理模式的计数器"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.responses = collections.Counter()  # 状态码类别 (2xx/4xx/5xx...) -> 次数
+        self.upstream_opened = 0
+        self.upstream_reused = 0
+        self.retries = 0  # 复用的连接已被上游关闭而重试的请求数
+        self.streams_active = 0
+        self.streams_total = 0
+        self.unmatched_calls = 0  # 超出上限或超时仍未配对而丢弃的 JSON-RPC 调用
+        self.sessions = 0  # 当前绑定到后端的会话数
+
+    def add(self, key: str, value: int = 1) -> None:
+        with self.lock:
+            setattr(self, key, getattr(self, key) + value)
+
+    def response(self, status: int) -> None:
+        with self.lock:
+            self.responses[f"{status // 100}xx"] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'responses': dict(self.responses),
+                'upstream_opened': self.upstream_opened,
+                'upstream_reused': self.upstream_reused,
+                'retries': self.retries,
+                'streams_active': self.streams_active,
+                'streams_total': self.streams_total,
+                'unmatched_calls': self.unmatched_calls,
+                'sessions': self.sessions,
+            }
+
+
+class UpstreamHttpPool:
+    """按上游端点分组的 HTTP/1.1 空闲长连接池
+
+    连接在响应完整读完且双方都允许长连接时归还; 空闲超过 idle_timeout 或对端已关闭的连接在取用时丢弃。
+    """
+
+    def __init__(self, stats: HttpProxyStats, metrics: BrokerMetrics, max_idle: int = 32,
+                 idle_timeout: float = 30.0, connect_timeout: float = 5.0):
+        self.stats = stats
+        self.metrics = metrics
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._idle: Dict[Tuple[str, int], collections.deque] = {}  # 端点 -> [(reader, writer, 归还时间)]
+
+    async def acquire(self, endpoint: Tuple[str, int]):
+        """返回 (reader, writer, 是否复用)"""
+        idle = self._idle.get(endpoint)
+        now = time.monotonic()
+        while idle:
+            reader, writer, since = idle.pop()
+            if reader.at_eof() or writer.is_closing() or now - since > self.idle_timeout:
+                writer.close()
+                continue
+            self.stats.add('upstream_reused')
+            return reader, writer, True
+        start_time = time.perf_counter_ns()
+        reader, writer = await asyncio.wait_for(open_endpoint(*endpoint), timeout=self.connect_timeout)
+        self.metrics.record_upstream_connect((time.perf_counter_ns() - start_time) // 1000)
+        self.stats.add('upstream_opened')
+        return reader, writer, False
+
+    def release(self, endpoint: Tuple[str, int], reader, writer) -> None:
+        idle = self._idle.setdefault(endpoint, collections.deque())
+        if len(idle) >= self.max_idle or writer.is_closing():
+            writer.close()
+            return
+        idle.append((reader, writer, time.monotonic()))
+
+    def close(self) -> None:
+        for idle in self._idle.values():
+            for _, writer, _ in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class SessionAffinity:
+    """MCP会话 -> 后端 的绑定; 每个绑定占用后端的一个会话计数 (BackendSet.acquire), 解除时归还"""
+
+    def __init__(self, backends, stats: HttpProxyStats, ttl: float = 3600.0, max_sessions: int = 100_000):
+        self.backends = backends
+        self.stats = stats
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: collections.OrderedDict = collections.OrderedDict()  # 会话id -> (后端, 最近使用时间)
+
+    def lookup(self, session_id: str):
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        self._sessions[session_id] = (entry[0], time.monotonic())
+        self._sessions.move_to_end(session_id)
+        return entry[0]
+
+    def bind(self, session_id: str, backend) -> None:
+        """调用方已为该会话 acquire 了 backend"""
+        previous = self._sessions.pop(session_id, None)
+        if previous is not None:
+            self.backends.release(previous[0])
+        self._sessions[session_id] = (backend, time.monotonic())
+        self._expire()
+        self.stats.sessions = len(self._sessions)
+
+    def unbind(self, session_id: str) -> None:
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self.backends.release(entry[0])
+            self.stats.sessions = len(self._sessions)
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            session_id, (backend, used) = next(iter(self._sessions.items()))
+            if used > deadline and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+            self.backends.release(backend)
+
+
+class CallTracker:
+    """在途 JSON-RPC 调用: (会话键, 请求id) -> (方法名, 开始时间ns)
+
+    SSE 传输下 POST 只返回 202, 响应经另一条 GET 事件流返回, 因此按会话键而不是按HTTP请求配对。
+    """
+
+    def __init__(self, metrics: BrokerMetrics, stats: HttpProxyStats, logger, max_pending: int = 10_000):
+        self.metrics = metrics
+        self.stats = stats
+        self.logger = logger
+        self.max_pending = max_pending
+        self._pending: collections.OrderedDict = collections.OrderedDict()
+
+    def start(self, key: str, calls: List[Tuple[Any, str]], started: int) -> None:
+        for request_id, label in calls:
+            self._pending[(key, json.dumps(request_id))] = (label, started)
+        while len(self._pending) > self.max_pending:
+            self._pending.popitem(last=False)
+            self.stats.add('unmatched_calls')
+
+    def finish(self, key: str, request_id: Any, error: bool) -> None:
+        entry = self._pending.pop((key, json.dumps(request_id)), None)
+        if entry is not None:
+            self._record(key, request_id, entry, error)
+
+    def finish_all(self, key: str, calls: List[Tuple[Any, str]], error: bool) -> None:
+        """HTTP响应结束时仍未配对的调用 (非JSON响应体): 以响应结束时间计"""
+        for request_id, _ in calls:
+            self.finish(key, request_id, error)
+
+    def _record(self, key: str, request_id: Any, entry: Tuple[str, int], error: bool) -> None:
+        label, started = entry
+        latency_us = (time.perf_counter_ns() - started) // 1000
+        self.metrics.record_method(label, latency_us, error)
+        self.logger.info("JSON-RPC 调用完成: 会话=%s, id=%s, 方法=%s, 耗时=%.2fms%s",
+                         key, request_id, label, latency_us / 1000, ", 错误" if error else "")
+
+
+class HttpMCPProxy:
+    """HTTP/1.1 MCP代理 (asyncio), 与 AsyncFastMCPProxy 相同的启动/停止方式"""
+
+    LISTEN_BACKLOG = 4096
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 25577,
+                 target_host: str = 'localhost', target_port: int = 5051,
+                 log_level: str = 'DEBUG', log_queue_size: int = 0,
+                 log_file: str = 'logs/fastmcp_proxy.log',
+                 metrics_port: int = 0, metrics_json: Optional[str] = None,
+                 metrics_json_interval: float = 0, reuse_port: bool = False,
+                 backends: Optional[List[str]] = None, backends_file: Optional[str] = None,
+                 backend_options: Optional[dict] = None, max_idle_upstream: int = 32,
+                 upstream_idle_timeout: float = 30.0, session_ttl: float = 3600.0,
+                 max_tool_labels: int = 64):
+        self.loggers = setup_logging(log_level, log_queue_size, log_file)
+        self.logger = self.loggers['main']
+        self.handler_logger = self.loggers['handler']
+        self.host = host
+        self.port = port
+        self.target_host = target_host
+        self.target_port = target_port
+        self.reuse_port = reuse_port
+        self.metrics = BrokerMetrics()
+        self.metrics_server = MetricsServer(self.metrics, port=metrics_port) if metrics_port else None
+        self.metrics_json = metrics_json
+        self.metrics_json_interval = metrics_json_interval
+        self.stats = HttpProxyStats()
+        self.metrics.http = self.stats
+        # 多个后端时按会话亲和路由, 新会话按未完成请求数选择; 单个目标时所有请求发往 target
+        self.backends = None
+        self.affinity = None
+        if backends or backends_file:
+            from mcp_broker_backends import BackendSet
+            self.backends = BackendSet(backends or [], self.loggers, config_path=backends_file,
+                                       **(backend_options or {}))
+            self.affinity = SessionAffinity(self.backends, self.stats, ttl=session_ttl)
+        self.metrics.backends = self.backends
+        self.pool = UpstreamHttpPool(self.stats, self.metrics, max_idle=max_idle_upstream,
+                                     idle_timeout=upstream_idle_timeout)
+        self.calls = CallTracker(self.metrics, self.stats, self.handler_logger)
+        self.labels = CallLabels(max_tool_labels)
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.running = False
+        self._stop_event: Optional[asyncio.Event] = None
+        self._client_ids = itertools.count(1)
+
+    def start(self) -> None:
+        """启动代理服务器 (阻塞直到停止)"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            self.logger.info("接收到中断信号，正在停止服务器...")
+        finally:
+            if self.backends:
+                self.backends.close()
+            if self.metrics_server:
+                self.metrics_server.stop()
+            if self.metrics_json:
+                self.metrics.dump_json(self.metrics_json)
+            self.logger.info("HTTP代理服务器已停止")
+            shutdown_logging()
+
+    async def serve(self) -> None:
+        target = (', '.join(self.backends.backends) if self.backends
+                  else format_endpoint(self.target_host, self.target_port))
+        self.logger.info(f"HTTP代理服务器启动中: {format_endpoint(self.host, self.port)} -> {target}")
+        self._stop_event = asyncio.Event()
+        path = unix_path(self.host)
+        if path is None:
+            self.server = await asyncio.start_server(
+                self._handle_client, self.host, self.port, limit=HEADER_LIMIT,
+                backlog=self.LISTEN_BACKLOG, reuse_address=True, reuse_port=self.reuse_port or None)
+        else:
+            remove_stale_unix_socket(path)
+            self.server = await asyncio.start_unix_server(self._handle_client, path, limit=HEADER_LIMIT,
+                                                          backlog=self.LISTEN_BACKLOG)
+        self.running = True
+        if self.backends:
+            self.backends.start()
+        if self.metrics_server:
+            self.metrics_server.start()
+        if self.metrics_json and self.metrics_json_interval > 0:
+            self.metrics.start_json_dumper(self.metrics_json, self.metrics_json_interval)
+        self.logger.info("HTTP代理服务器已启动，等待连接...")
+        try:
+            async with self.server:
+                await self._stop_event.wait()
+        finally:
+            self.running = False
+            self.pool.close()
+            if path is not None:
+                remove_stale_unix_socket(path)
+
+    def stop(self) -> None:
+        self.running = False
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    # ---- 客户端连接 ----
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info('peername')
+        client_id = f"{peer[0]}_{peer[1]}" if peer else f"unix_{next(self._client_ids)}"
+        forwarded_for = peer[0] if peer else 'unix'
+        self.metrics.connection_opened(client_id)
+        self.handler_logger.info(f"新HTTP连接来自: {peer}, 客户端ID={client_id}")
+        try:
+            while self.running:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    break  # 客户端在请求之间关闭连接
+                except asyncio.LimitOverrunError:
+                    raise HttpError(431, "请求头部过大")
+                request = HttpRequest(head)
+                if not await self._proxy(client_id, forwarded_for, request, reader, writer):
+                    break
+        except HttpError as e:
+            self.handler_logger.warning(f"拒绝客户端#{client_id} 的请求: {e.status} {e.reason}")
+            self.stats.response(e.status)
+            await self._send_error(writer, e.status, e.reason)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            self.handler_logger.info(f"客户端连接中断: 客户端ID={client_id}: {e!r}")
+        finally:
+            writer.close()
+            self.metrics.connection_closed(client_id)
+
+    @staticmethod
+    async def _send_error(writer: asyncio.StreamWriter, status: int, reason: str) -> None:
+        body = json.dumps({'error': reason}, ensure_ascii=False).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {'Bad Gateway' if status >= 500 else 'Error'}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+        try:
+            writer.write(head.encode('latin-1') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    # ---- 路由 ----
+
+    def _route(self, session_id: Optional[str]):
+        """返回 (后端或None, 端点, 是否为本请求新占用的后端)"""
+        if self.backends is None:
+            return None, (self.target_host, self.target_port), False
+        backend = self.affinity.lookup(session_id) if session_id else None
+        if backend is not None:
+            return backend, (backend.host, backend.port), False
+        backend = self.backends.acquire()  # 没有可用后端时抛出 ConnectionError
+        return backend, (backend.host, backend.port), True
+
+    async def _open(self, session_id: Optional[str]):
+        """选择后端并取得上游连接; 新选择的后端建连失败时换下一个"""
+        tried = []
+        while True:
+            if self.backends is not None and not session_id and tried:
+                backend = self.backends.acquire(tried)
+                endpoint, acquired = (backend.host, backend.port), True
+            else:
+                backend, endpoint, acquired = self._route(session_id)
+            try:
+                reader, writer, reused = await self.pool.acquire(endpoint)
+                return backend, endpoint, acquired, reader, writer, reused
+            except (OSError, asyncio.TimeoutError) as e:
+                self.handler_logger.warning(f"连接上游 {format_endpoint(*endpoint)} 失败: {e}")
+                if backend is None:
+                    raise HttpError(502, f"上游不可用: {e}")
+                if not acquired:
+                    self.backends.request_failed(backend)  # 会话绑定的后端不可用, 不换后端
+                    raise HttpError(502, f"会话所在的后端不可用: {e}")
+                self.backends.connect_failed(backend)
+                tried.append(backend)
+                session_id = None
+
+    # ---- 转发 ----
+
+    async def _proxy(self, client_id: str, forwarded_for: str, request: HttpRequest,
+                     reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """转发一个请求并写回响应, 返回客户端连接能否继续使用"""
+        started = time.perf_counter_ns()
+        self.stats.add('requests')
+        content_length = request.content_length
+        body = None
+        if not request.chunked and (content_length or 0) <= PARSE_LIMIT:
+            body = await reader.readexactly(content_length) if content_length else b''
+            self.metrics.record_request(len(body))
+        calls = _parse_calls(body, self.labels) if body and request.method == 'POST' else []
+        session_id = request.session_id
+        call_key = session_id or client_id
+        if calls:
+            self.calls.start(call_key, calls, started)
+
+        head = request.forwarded_head(f"{request.method} {request.target} HTTP/1.1",
+                                      [('X-Forwarded-For', forwarded_for)])
+        for attempt in range(2):
+            try:
+                backend, endpoint, acquired, up_reader, up_writer, reused = await self._open(session_id)
+            except ConnectionError as e:
+                raise HttpError(502, str(e))
+            trial = self.backends.request_sent(backend) if backend is not None else 0
+            try:
+                up_writer.write(head)
+                if body is not None:
+                    up_writer.write(body)
+                    await up_writer.drain()
+                else:
+                    await self._relay_body(reader, up_writer, request, None)
+                response = HttpResponse(await up_reader.readuntil(b'\r\n\r\n'))
+                # 1xx 临时响应直接转给客户端
+                while 100 <= response.status < 200 and response.status != 101:
+                    writer.write(response.forwarded_head(response.start_line))
+                    response = HttpResponse(await up_reader.readuntil(b'\r\n\r\n'))
+                response_length = response.content_length  # 无效时为 502, 和其他上游错误一样清理
+                break
+            except BaseException as e:
+                # 收到响应头之前的所有异常 (包括取消) 都在这里关闭上游连接、撤销请求并归还本请求占用的后端
+                up_writer.close()
+                if backend is not None:
+                    self.backends.request_cancelled(backend, trial)
+                    if acquired:
+                        self.backends.release(backend)
+                broken = isinstance(e, (ConnectionError, asyncio.IncompleteReadError))
+                if broken and reused and body is not None and attempt == 0:
+                    # 空闲连接已被上游关闭, 请求尚未被处理, 换新连接重试
+                    self.stats.add('retries')
+                    continue
+                if broken:
+                    if backend is not None:
+                        self.backends.request_failed(backend)
+                    raise HttpError(502, f"上游连接中断: {e!r}") from None
+                if isinstance(e, asyncio.LimitOverrunError):
+                    raise HttpError(502, "上游响应头部过大") from None
+                raise
+
+        ttfb_us = (time.perf_counter_ns() - started) // 1000
+        if backend is not None:
+            self.backends.response_received(backend, ttfb_us, trial)
+        stream = EventStream(call_key, backend) if 'text/event-stream' in (
+            response.header('content-type') or '') else None
+        self._track_session(request, response, session_id, stream, backend, acquired)
+
+        streaming = stream is not None
+        has_body = response.has_body(request.method)
+        close_delimited = (has_body and not response.chunked and response_length is None)
+        keep_alive = request.keep_alive and not close_delimited
+
+        scanner = None
+        json_body = bytearray() if 'json' in (response.header('content-type') or '') else None
+        if streaming:
+            scanner = SseScanner(lambda event, data: self._on_event(stream, request, event, data))
+            self.stats.add('streams_active')
+            self.stats.add('streams_total')
+        upstream_reusable = False
+        received = 0
+        try:
+            writer.write(response.forwarded_head(response.start_line,
+                                                 [] if keep_alive else [('Connection', 'close')]))
+            if has_body:
+                def observe(chunk: bytes) -> None:
+                    if scanner is not None:
+                        scanner.feed(chunk)
+                    elif json_body is not None and len(json_body) <= PARSE_LIMIT:
+                        json_body.extend(chunk)
+
+                received = await self._relay_response(up_reader, writer, response, reader if streaming else None,
+                                                      observe)
+            else:
+                await writer.drain()
+            upstream_reusable = response.keep_alive and not close_delimited
+        except (ConnectionError, asyncio.IncompleteReadError, _ClientGone):
+            keep_alive = False
+        except (HttpError, asyncio.LimitOverrunError) as e:
+            # 响应头已经写出, 不能再回复错误状态, 只能中断客户端连接
+            self.handler_logger.warning(f"上游 {format_endpoint(*endpoint)} 的响应体无效, 中断客户端#{client_id}: {e!r}")
+            keep_alive = False
+        finally:
+            if streaming:
+                self.stats.add('streams_active', -1)
+                self._stream_closed(stream)
+            if upstream_reusable:
+                self.pool.release(endpoint, up_reader, up_writer)
+            else:
+                up_writer.close()
+
+        if json_body:
+            for request_id, error in _parse_results(bytes(json_body)):
+                self.calls.finish(call_key, request_id, error)
+        if calls and response.status != 202:
+            self.calls.finish_all(call_key, calls, response.status >= 400)
+        self.metrics.record_response(received)
+        self.stats.response(response.status)
+        self.handler_logger.info("HTTP客户端#%s %s %s -> %s: 状态=%d, 首字节=%.2fms, 总耗时=%.2fms, 响应=%dB",
+                                 client_id, request.method, request.target, format_endpoint(*endpoint),
+                                 response.status, ttfb_us / 1000, (time.perf_counter_ns() - started) / 1e6,
+                                 received)
+        return keep_alive and self.running
+
+    def _track_session(self, request: HttpRequest, response: HttpResponse, session_id: Optional[str],
+                       stream: Optional[EventStream], backend, acquired: bool) -> None:
+        """按响应维护会话亲和; 本请求占用的后端要么绑定到会话, 要么归还"""
+        if self.affinity is None:
+            return
+        new_session = response.header(SESSION_HEADER)
+        if request.method == 'DELETE' and session_id:
+            self.affinity.unbind(session_id)
+        elif session_id and response.status == 404:
+            self.affinity.unbind(session_id)  # 服务器已不认识该会话
+        if not acquired:
+            return
+        if new_session and request.method != 'DELETE':
+            self.affinity.bind(new_session, backend)
+        elif session_id and request.method != 'DELETE' and response.status != 404:
+            self.affinity.bind(session_id, backend)  # 代理重启后首次见到的会话: 绑定到本次选择的后端
+        elif stream is not None and request.method == 'GET' and not session_id:
+            stream.acquired = True  # SSE 传输: 会话id在第一个 endpoint 事件中, 由 _on_event 绑定
+        else:
+            self.backends.release(backend)
+
+    def _on_event(self, stream: EventStream, request: HttpRequest, event: bytes, data: bytes) -> None:
+        if event == b'endpoint':
+            match = _SESSION_QUERY.search(data)
+            if match and stream.session_id is None:
+                # SSE 传输: 之后的 POST 以 session_id 为会话键登记调用, 响应从这条事件流返回
+                stream.session_id = stream.call_key = match.group(1).decode('ascii')
+                if stream.acquired and self.affinity is not None:
+                    self.affinity.bind(stream.session_id, stream.backend)
+                    stream.acquired = False
+            return
+        for request_id, error in _parse_results(data):
+            self.calls.finish(stream.call_key, request_id, error)
+
+    def _stream_closed(self, stream: EventStream) -> None:
+        """SSE 传输的事件流结束即会话结束"""
+        if self.affinity is None:
+            return
+        if stream.session_id is not None:
+            self.affinity.unbind(stream.session_id)
+        elif stream.acquired:
+            self.backends.release(stream.backend)
+
+    async def _relay_body(self, source: asyncio.StreamReader, destination: asyncio.StreamWriter,
+                          message: HttpMessage, observe) -> int:
+        """按 Content-Length 或 chunked 边读边写消息体, 返回数据字节数 (chunked 时不含分块标记)"""
+        total = 0
+        invalid = message.INVALID_STATUS
+        if message.chunked:
+            while True:
+                try:
+                    size_line = await source.readuntil(b'\r\n')
+                    size = int(size_line.split(b';', 1)[0].strip(), 16)
+                except (ValueError, asyncio.LimitOverrunError):
+                    raise HttpError(invalid, "无效的分块长度") from None
+                if size < 0:
+                    raise HttpError(invalid, "无效的分块长度")
+                if size == 0:
+                    trailer = size_line
+                    while True:
+                        try:
+                            line = await source.readuntil(b'\r\n')
+                        except asyncio.LimitOverrunError:
+                            raise HttpError(invalid, "分块尾部过长") from None
+                        trailer += line
+                        if line == b'\r\n':
+                            break
+                    destination.write(trailer)
+                    await destination.drain()
+                    return total
+                chunk = await source.readexactly(size + 2)
+                if chunk[-2:] != b'\r\n':
+                    raise HttpError(invalid, "分块缺少结尾的 CRLF")
+                destination.write(size_line + chunk)
+                await destination.drain()
+                total += size
+                if observe is not None:
+                    observe(chunk[:-2])
+        remaining = message.content_length
+        while remaining is None or remaining > 0:
+            chunk = await source.read(READ_CHUNK if remaining is None else min(READ_CHUNK, remaining))
+            if not chunk:
+                if remaining is None:
+                    return total  # 以关闭连接结束的响应体
+                raise asyncio.IncompleteReadError(b'', remaining)
+            destination.write(chunk)
+            await destination.drain()
+            total += len(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+            if observe is not None:
+                observe(chunk)
+        return total
+
+    async def _relay_response(self, source: asyncio.StreamReader, destination: asyncio.StreamWriter,
+                              response: HttpResponse, client_reader: Optional[asyncio.StreamReader],
+                              observe) -> int:
+        """转发响应体; 事件流同时监视客户端连接, 客户端断开时立即停止 (否则要等下一个事件才能发现)"""
+        relay = asyncio.ensure_future(self._relay_body(source, destination, response, observe))
+        if client_reader is None:
+            return await relay
+        watch = asyncio.ensure_future(client_reader.read(1))
+        try:
+            done, _ = await asyncio.wait((relay, watch), return_when=asyncio.FIRST_COMPLETED)
+            if relay in done:
+                return relay.result()
+            raise _ClientGone()
+        finally:
+            for task in (relay, watch):
+                task.cancel()
+            await asyncio.gather(relay, watch, return_exceptions=True)
+
+
+class _ClientGone(Exception):
+    """事件流转发期间客户端关闭连接 (或违反协议发送了数据)"""
@@ -0,0 +1,107 @@
+import json
+import re
+from json.decoder import scanstring
+from typing import Any, Dict, Optional, Tuple, Union
+
+# FastMCP数据包的数据部分是 JSON-RPC 2.0 消息, 这里提供代理需要的最小解析/改写工具
+
+MESSAGE_REQUEST = 1  # 带 id 的请求
+MESSAGE_RESPONSE = 2  # 对某个请求的响应
+
+JSONRPC_METHOD_NOT_FOUND = -32601
+JSONRPC_INTERNAL_ERROR = -32603
+JSONRPC_SERVER_ERROR = -32000
+
+
+def parse_message(payload: Union[bytes, memoryview]) -> Optional[Dict[str, Any]]:
+    """解析数据包中的 JSON-RPC 消息, 不是 JSON 对象时返回 None"""
+    try:
+        message = json.loads(bytes(payload))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return message if isinstance(message, dict) else None
+
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_MISSING = object()
+
+
+def peek_message(payload: Union[bytes, memoryview]) -> Tuple[Optional[int], Any]:
+    """只扫描顶层字段判断消息类型, 返回 (MESSAGE_REQUEST 或 MESSAGE_RESPONSE, id), 通知或其他数据返回 (None, None)
+
+    拿到 id 与 method/result/error 之一后就停止, 不解析后面的 params/result, 用于在转发路径上按 id 配对请求与响应;
+    payload 可以只是大帧开头的一部分。
+    """
+    text = str(payload, 'utf-8', 'ignore')
+    try:
+        pos = _WHITESPACE.match(text).end()
+        if text[pos:pos + 1] != '{':
+            return None, None
+        kind, message_id = None, _MISSING
+        pos += 1
+        while True:
+            pos = _WHITESPACE.match(text, pos).end()
+            if text[pos:pos + 1] != '"':
+                break
+            key, pos = scanstring(text, pos + 1)
+            pos = _WHITESPACE.match(text, pos).end()
+            if text[pos:pos + 1] != ':':
+                return None, None
+            pos = _WHITESPACE.match(text, pos + 1).end()
+            if key == 'id':
+                message_id, pos = _DECODER.raw_decode(text, pos)
+            else:
+                if key == 'method':
+                    kind = MESSAGE_REQUEST
+                elif key in ('result', 'error') and kind is None:
+                    kind = MESSAGE_RESPONSE
+                if kind is not None and message_id is not _MISSING:
+                    break
+                _, pos = _DECODER.raw_decode(text, pos)
+            if kind is not None and message_id is not _MISSING:
+                break
+            pos = _WHITESPACE.match(text, pos).end()
+            if text[pos:pos + 1] != ',':
+                break
+            pos += 1
+    except ValueError:
+        return None, None
+    if kind is None or message_id is _MISSING or message_id is None or isinstance(message_id, (dict, list)):
+        return None, None
+    return kind, message_id
+
+
+def encode_message(message: Dict[str, Any]) -> bytes:
+    """编码 JSON-RPC 消息"""
+    return json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def is_request(message: Dict[str, Any]) -> bool:
+    """带 id 的请求 (通知没有 id, 不需要响应)"""
+    return 'method' in message and message.get('id') is not None
+
+
+def is_response(message: Dict[str, Any]) -> bool:
+    """对某个请求的响应"""
+    return 'method' not in message and message.get('id') is not None
+
+
+def initialize_key(message: Optional[Dict[str, Any]]) -> Optional[str]:
+    """initialize 请求的参数 (协议版本、客户端能力与信息) 规范化为字符串, 其他消息返回 None
+
+    握手参数相同的会话可以复用同一条已完成握手的上游连接。
+    """
+    if not message or message.get('method') != 'initialize':
+        return None
+    return json.dumps(message.get('params'), sort_keys=True, separators=(',', ':'))
+
+
+def with_id(message: Dict[str, Any], message_id: Any) -> bytes:
+    """替换消息 id 后重新编码, 不修改原消息"""
+    return encode_message({**message, 'id': message_id})
+
+
+def error_response(message_id: Any, code: int, text: str) -> bytes:
+    """构造 JSON-RPC 错误响应"""
+    return encode_message({'jsonrpc': '2.0', 'id': message_id, 'error': {'code': code, 'message': text}})
@@ -0,0 +1,595 @@
+import collections
+import glob
+import json
+import os
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+
+class LatencyHistogram:
+    """固定内存的对数-线性延迟直方图 (单位: 微秒)
+
+    每个2的幂区间再均分为 SUB_BUCKETS 个子桶, 相对误差不超过 1/SUB_BUCKETS;
+    计数存放在预分配的 array 中, 记录样本时不创建新的容器对象。
+    """
+
+    SUB_BITS = 3
+    SUB_BUCKETS = 1 << SUB_BITS
+    MAX_SHIFT = 32 - SUB_BITS  # 最大可区分约 2^32 微秒 (约71分钟), 更大的值计入最后一个桶
+    BUCKET_COUNT = SUB_BUCKETS + (MAX_SHIFT + 1) * SUB_BUCKETS
+
+    __slots__ = ('counts', 'count', 'total', 'max', 'lock')
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * self.BUCKET_COUNT))
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def bucket_index(cls, value: int) -> int:
+        if value < cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BITS - 1
+        if shift > cls.MAX_SHIFT:
+            return cls.BUCKET_COUNT - 1
+        return cls.SUB_BUCKETS + shift * cls.SUB_BUCKETS + (value >> shift) - cls.SUB_BUCKETS
+
+    @classmethod
+    def bucket_upper_bound(cls, index: int) -> int:
+        """桶内最大值, 用作分位数的估计值"""
+        if index < cls.SUB_BUCKETS:
+            return index
+        shift, offset = divmod(index - cls.SUB_BUCKETS, cls.SUB_BUCKETS)
+        return ((offset + cls.SUB_BUCKETS + 1) << shift) - 1
+
+    def record(self, value_us: int) -> None:
+        """记录一个样本 (微秒)"""
+        index = self.bucket_index(value_us)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value_us
+            if value_us > self.max:
+                self.max = value_us
+
+    def percentile(self, q: float) -> int:
+        """估算分位数 (微秒), q 取值 0~1"""
+        with self.lock:
+            if not self.count:
+                return 0
+            threshold = max(1, int(self.count * q + 0.5))
+            seen = 0
+            for index, bucket in enumerate(self.counts):
+                seen += bucket
+                if seen >= threshold:
+                    return min(self.bucket_upper_bound(index), self.max)
+            return self.max
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            buckets = {str(index): bucket for index, bucket in enumerate(self.counts) if bucket}
+        return {
+            'count': self.count,
+            'sum_us': self.total,
+            'p50_us': self.percentile(0.50),
+            'p95_us': self.percentile(0.95),
+            'p99_us': self.percentile(0.99),
+            'max_us': self.max,
+            'buckets': buckets,  # 非空桶, 用于合并多个进程的直方图
+        }
+
+    def merge_snapshot(self, snapshot: dict) -> None:
+        """合并另一个直方图的快照"""
+        with self.lock:
+            for index, bucket in snapshot.get('buckets', {}).items():
+                self.counts[int(index)] += bucket
+            self.count += snapshot['count']
+            self.total += snapshot['sum_us']
+            self.max = max(self.max, snapshot['max_us'])
+
+
+class BrokerMetrics:
+    """代理的运行指标: 按数据包类型和客户端的延迟直方图、流量、连接数、上游建连耗时"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.packet_types: Dict[int, LatencyHistogram] = {}
+        self.clients: Dict[str, LatencyHistogram] = {}
+        self.methods: Dict[str, LatencyHistogram] = {}  # HTTP代理模式: JSON-RPC 方法名 -> 延迟直方图
+        self.method_errors: Dict[str, int] = {}
+        self.upstream_connect = LatencyHistogram()
+        self.bytes_from_clients = 0
+        self.bytes_to_clients = 0
+        self.packets_from_clients = 0
+        self.packets_to_clients = 0
+        self.active_connections = 0
+        self.total_connections = 0
+        self.backends = None  # BackendSet, 配置多个后端时输出每个后端的状态
+        self.memory = None  # MemoryBudget, 帧缓冲的内存预算
+        self.cache = None  # ResponseCache, 启用响应缓存时输出命中率
+        self.coalescer = None  # SingleFlight, 启用请求合并时输出节省的上游调用数
+        self.compression = None  # CompressionStats, 启用帧压缩时输出线路字节数与CPU耗时
+        self.sampler = None  # TailSampler, 启用尾部采样时输出各触发原因的写出次数
+        self.hedger = None  # HedgedRequests, 启用对冲请求时输出对冲次数与胜出方
+        self.upstream_pool = None  # UpstreamPool, 启用上游连接池时输出连接数与拒绝的会话数
+        self.http = None  # HttpProxyStats, HTTP代理模式的状态码、上游连接复用与事件流计数
+
+    def connection_opened(self, client_id: str) -> LatencyHistogram:
+        """新连接, 返回该客户端的延迟直方图"""
+        histogram = LatencyHistogram()
+        with self.lock:
+            self.active_connections += 1
+            self.total_connections += 1
+            self.clients[client_id] = histogram
+        return histogram
+
+    def connection_closed(self, client_id: str) -> None:
+        with self.lock:
+            if self.clients.pop(client_id, None) is not None:
+                self.active_connections -= 1
+
+    def packet_type_histogram(self, packet_type: int) -> LatencyHistogram:
+        histogram = self.packet_types.get(packet_type)
+        if histogram is None:
+            with self.lock:
+                histogram = self.packet_types.setdefault(packet_type, LatencyHistogram())
+        return histogram
+
+    def record_request(self, length: int) -> None:
+        """客户端 -> 服务器 的一个数据包"""
+        with self.lock:
+            self.packets_from_clients += 1
+            self.bytes_from_clients += length
+
+    def record_response(self, length: int) -> None:
+        """服务器 -> 客户端 的一个数据包"""
+        with self.lock:
+            self.packets_to_clients += 1
+            self.bytes_to_clients += length
+
+    def record_latency(self, client_histogram: Optional[LatencyHistogram], packet_type: int,
+                       latency_us: int) -> None:
+        """记录一次请求到响应的延迟"""
+        self.packet_type_histogram(packet_type).record(latency_us)
+        if client_histogram is not None:
+            client_histogram.record(latency_us)
+
+    def record_method(self, method: str, latency_us: int, error: bool = False) -> None:
+        """记录一次 JSON-RPC 调用 (HTTP代理模式按方法名计时, tools/call 带工具名)"""
+        histogram = self.methods.get(method)
+        if histogram is None or error:
+            with self.lock:
+                histogram = self.methods.setdefault(method, LatencyHistogram())
+                if error:
+                    self.method_errors[method] = self.method_errors.get(method, 0) + 1
+        histogram.record(latency_us)
+
+    def record_upstream_connect(self, connect_us: int) -> None:
+        self.upstream_connect.record(connect_us)
+
+    def snapshot(self, clients: bool = True) -> dict:
+        """JSON 快照, clients 为 False 时不含按客户端的延迟直方图"""
+        with self.lock:
+            packet_types = dict(self.packet_types)
+            client_histograms = dict(self.clients) if clients else {}
+            methods = dict(self.methods)
+            method_errors = dict(self.method_errors)
+            counters = {
+                'active_connections': self.active_connections,
+                'total_connections': self.total_connections,
+                'bytes_from_clients': self.bytes_from_clients,
+                'bytes_to_clients': self.bytes_to_clients,
+                'packets_from_clients': self.packets_from_clients,
+                'packets_to_clients': self.packets_to_clients,
+            }
+        return {
+            'timestamp': time.time(),
+            'pid': os.getpid(),
+            'uptime_seconds': time.time() - self.started_at,
+            **counters,
+            'upstream_connect': self.upstream_connect.snapshot(),
+            'packet_types': {f"0x{packet_type:04X}": histogram.snapshot()
+                             for packet_type, histogram in sorted(packet_types.items())},
+            'clients': {client_id: histogram.snapshot() for client_id, histogram in client_histograms.items()},
+            'methods': {method: histogram.snapshot() for method, histogram in sorted(methods.items())},
+            'method_errors': method_errors,
+            **({'backends': self.backends.snapshot()} if self.backends is not None else {}),
+            **({'memory_budget': self.memory.snapshot()} if self.memory is not None else {}),
+            **({'cache': self.cache.snapshot()} if self.cache is not None else {}),
+            **({'coalescing': self.coalescer.snapshot()} if self.coalescer is not None else {}),
+            **({'compression': self.compression.snapshot()} if self.compression is not None else {}),
+            **({'sampling': self.sampler.snapshot()} if self.sampler is not None else {}),
+            **({'hedging': self.hedger.snapshot()} if self.hedger is not None else {}),
+            **({'upstream_pool': self.upstream_pool.snapshot()} if self.upstream_pool is not None else {}),
+            **({'http': self.http.snapshot()} if self.http is not None else {}),
+        }
+
+    def dump_json(self, path: str, clients: bool = True) -> None:
+        """写出JSON快照, 先写临时文件再替换, 读取方不会看到写了一半的文件"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(clients), f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def start_json_dumper(self, path: str, interval: float) -> None:
+        """后台线程定期写出JSON快照 (供监督进程汇总)
+
+        每个周期都要序列化整个快照, 所以不含按客户端的延迟直方图: 其大小随客户端数增长,
+        多进程模式下按客户端的延迟只记录在各工作进程的日志里。
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        def dump_loop():
+            while True:
+                try:
+                    self.dump_json(path, clients=False)
+                except OSError:
+                    pass  # 下个周期重试
+                time.sleep(interval)
+
+        threading.Thread(target=dump_loop, daemon=True).start()
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        return render_prometheus(self.snapshot())
+
+
+_COUNTER_KEYS = ('active_connections', 'total_connections', 'bytes_from_clients', 'bytes_to_clients',
+                 'packets_from_clients', 'packets_to_clients')
+
+
+def merge_snapshots(snapshots) -> dict:
+    """合并多个进程的指标快照, 计数器求和, 直方图按桶合并后重新计算分位数"""
+    merged = {'timestamp': time.time(), 'workers': len(snapshots),
+              'uptime_seconds': max((s['uptime_seconds'] for s in snapshots), default=0)}
+    for key in _COUNTER_KEYS:
+        merged[key] = sum(s.get(key, 0) for s in snapshots)
+
+    def merge_histograms(items) -> dict:
+        histogram = LatencyHistogram()
+        for item in items:
+            histogram.merge_snapshot(item)
+        return histogram.snapshot()
+
+    merged['upstream_connect'] = merge_histograms(s['upstream_connect'] for s in snapshots)
+    for group in ('packet_types', 'clients', 'methods'):
+        keys = sorted({key for s in snapshots for key in s.get(group, {})})
+        merged[group] = {key: merge_histograms(s[group][key] for s in snapshots if key in s[group])
+                         for key in keys}
+    merged['method_errors'] = dict(sum((collections.Counter(s.get('method_errors', {})) for s in snapshots),
+                                       collections.Counter()))
+
+    # 各组件的计数按字段求和, 比例与跨进程不可相加的状态重新计算
+    for section in ('memory_budget', 'cache', 'coalescing', 'compression', 'sampling', 'hedging', 'upstream_pool',
+                    'http'):
+        parts = [s[section] for s in snapshots if s.get(section)]
+        if parts:
+            merged[section] = _sum_fields(parts)
+    compression = merged.get('compression')
+    if compression:
+        compression['ratio_out'] = (round(compression['wire_bytes_out'] / compression['raw_bytes_out'], 4)
+                                    if compression['raw_bytes_out'] else 1.0)
+        for direction, raw in (('compress', 'raw_bytes_out'), ('decompress', 'raw_bytes_in')):
+            compression[f'{direction}_cpu_ms_per_mb'] = (
+                round(compression[f'{direction}_cpu_seconds'] * 1000 / (compression[raw] / (1024 * 1024)), 3)
+                if compression[raw] else 0.0)
+    hedging = merged.get('hedging')
+    if hedging:
+        hedging['share'] = round(hedging['hedged'] / hedging['tracked'], 4) if hedging['tracked'] else 0.0
+        delays = [s['hedging']['delay_us'] for s in snapshots
+                  if s.get('hedging') and s['hedging'].get('delay_us') is not None]
+        hedging['delay_us'] = max(delays) if delays else None
+
+    # 每个工作进程各自做健康检查与熔断: 任一进程认为不可用即视为不可用, 延迟取平均
+    backends = {}
+    for s in snapshots:
+        for address, backend in s.get('backends', {}).items():
+            backends.setdefault(address, []).append(backend)
+    if backends:
+        merged['backends'] = {}
+        for address, parts in backends.items():
+            backend = _sum_fields(parts)
+            backend['healthy'] = all(part['healthy'] for part in parts)
+            backend['ejected'] = any(part['ejected'] for part in parts)
+            backend['circuit_open'] = any(part['circuit_open'] for part in parts)
+            backend['weight'] = max(part['weight'] for part in parts)
+            backend['latency_ewma_us'] = sum(part['latency_ewma_us'] for part in parts) // len(parts)
+            merged['backends'][address] = backend
+    return merged
+
+
+def _sum_fields(parts) -> dict:
+    """逐字段求和, 嵌套的字典逐层合并, 非数值字段保留第一个进程的值"""
+    merged = {}
+    for part in parts:
+        for key, value in part.items():
+            if isinstance(value, dict):
+                merged[key] = _sum_fields([merged.get(key, {}), value])
+            elif isinstance(value, (int, float)) and not isinstance(value, bool) and key in merged:
+                merged[key] += value
+            else:
+                merged.setdefault(key, value)
+    return merged
+
+
+def _alive(pid) -> bool:
+    """快照所属的工作进程是否仍在运行 (没有 pid 的快照视为在运行)"""
+    if not pid:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class AggregatedMetrics:
+    """多进程模式下监督进程的指标视图: 读取各工作进程定期写出的快照并合并, 跳过已退出进程留下的快照"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def snapshot(self) -> dict:
+        snapshots = []
+        for path in sorted(glob.glob(os.path.join(self.directory, 'worker-*.json'))):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue  # 工作进程尚未写出快照
+            if _alive(snapshot.get('pid')):
+                snapshots.append(snapshot)
+        return merge_snapshots(snapshots)
+
+    def to_prometheus(self) -> str:
+        return render_prometheus(self.snapshot())
+
+
+def _label(value) -> str:
+    """转义 Prometheus 标签值中的反斜杠、双引号与换行"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _summary_lines(lines, name: str, help_text: str, series) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} summary")
+    for labels, histogram in series:
+        prefix = f"{labels}," if labels else ""
+        for quantile, key in (('0.5', 'p50_us'), ('0.95', 'p95_us'), ('0.99', 'p99_us')):
+            lines.append(f'{name}{{{prefix}quantile="{quantile}"}} {histogram[key] / 1e6:.6f}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {histogram['sum_us'] / 1e6:.6f}")
+        lines.append(f"{name}_count{suffix} {histogram['count']}")
+    lines.append(f"# TYPE {name}_max gauge")
+    for labels, histogram in series:
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_max{suffix} {histogram['max_us'] / 1e6:.6f}")
+
+
+def render_prometheus(snapshot: dict) -> str:
+    """把 BrokerMetrics.snapshot() 渲染为 Prometheus 文本格式"""
+    lines = []
+    for key, metric_type, help_text in (
+            ('active_connections', 'gauge', '当前客户端连接数'),
+            ('total_connections', 'counter', '累计客户端连接数'),
+            ('bytes_from_clients', 'counter', '从客户端接收的字节数'),
+            ('bytes_to_clients', 'counter', '发送给客户端的字节数'),
+            ('packets_from_clients', 'counter', '从客户端接收的数据包数'),
+            ('packets_to_clients', 'counter', '发送给客户端的数据包数'),
+    ):
+        name = f"fastmcp_proxy_{key}" + ('_total' if metric_type == 'counter' else '')
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.append(f"{name} {snapshot[key]}")
+
+    _summary_lines(lines, 'fastmcp_proxy_request_latency_seconds', '请求到响应的延迟(按数据包类型)',
+                   [(f'packet_type="{_label(packet_type)}"', histogram)
+                    for packet_type, histogram in snapshot['packet_types'].items()])
+    _summary_lines(lines, 'fastmcp_proxy_client_latency_seconds', '请求到响应的延迟(按客户端)',
+                   [(f'client_id="{_label(client_id)}"', histogram)
+                    for client_id, histogram in snapshot['clients'].items()])
+    _summary_lines(lines, 'fastmcp_proxy_upstream_connect_seconds', '上游建连耗时',
+                   [('', snapshot['upstream_connect'])])
+    methods = snapshot.get('methods')
+    if methods:
+        _summary_lines(lines, 'fastmcp_proxy_method_latency_seconds', 'JSON-RPC 调用延迟(按方法, HTTP代理模式)',
+                       [(f'method="{_label(method)}"', histogram) for method, histogram in methods.items()])
+        lines.append("# HELP fastmcp_proxy_method_errors_total 返回错误的 JSON-RPC 调用数(按方法)")
+        lines.append("# TYPE fastmcp_proxy_method_errors_total counter")
+        for method in methods:
+            lines.append(f'fastmcp_proxy_method_errors_total{{method="{_label(method)}"}} '
+                         f'{snapshot.get("method_errors", {}).get(method, 0)}')
+
+    http = snapshot.get('http')
+    if http:
+        lines.append("# HELP fastmcp_proxy_http_responses_total 返回给客户端的HTTP响应数(按状态码类别)")
+        lines.append("# TYPE fastmcp_proxy_http_responses_total counter")
+        for status_class, count in sorted(http['responses'].items()):
+            lines.append(f'fastmcp_proxy_http_responses_total{{class="{_label(status_class)}"}} {count}')
+        for key, metric_type, help_text in (
+                ('requests', 'counter', 'HTTP请求数'),
+                ('upstream_opened', 'counter', '新建的上游HTTP连接数'),
+                ('upstream_reused', 'counter', '复用空闲上游连接的请求数'),
+                ('retries', 'counter', '空闲连接已被上游关闭而重试的请求数'),
+                ('streams_total', 'counter', '转发的事件流(text/event-stream)响应数'),
+                ('streams_active', 'gauge', '转发中的事件流数'),
+                ('sessions', 'gauge', '绑定到后端的MCP会话数'),
+                ('unmatched_calls', 'counter', '未能与响应配对的 JSON-RPC 调用数'),
+        ):
+            name = f"fastmcp_proxy_http_{key}" + ('_total' if metric_type == 'counter' else '')
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name} {http[key]}")
+
+    memory = snapshot.get('memory_budget')
+    if memory:
+        for name, metric_type, help_text, value in (
+                ('fastmcp_proxy_memory_budget_bytes', 'gauge', '帧缓冲总预算', memory['total']),
+                ('fastmcp_proxy_memory_budget_used_bytes', 'gauge', '已预留的帧缓冲', memory['used']),
+                ('fastmcp_proxy_memory_budget_waits_total', 'counter', '因预算用尽而暂停读取的次数', memory['waits']),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name} {value}")
+
+    cache = snapshot.get('cache')
+    if cache:
+        for key, metric_type, help_text in (
+                ('entries', 'gauge', '响应缓存条目数'),
+                ('bytes', 'gauge', '响应缓存占用字节数'),
+                ('hits', 'counter', '响应缓存命中次数'),
+                ('misses', 'counter', '响应缓存未命中次数'),
+                ('evictions', 'counter', '因容量淘汰的缓存条目数'),
+                ('expirations', 'counter', '因过期淘汰的缓存条目数'),
+        ):
+            name = f"fastmcp_proxy_cache_{key}" + ('_total' if metric_type == 'counter' else '')
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name} {cache[key]}")
+
+    coalescing = snapshot.get('coalescing')
+    if coalescing:
+        for key, metric_type, help_text in (
+                ('inflight', 'gauge', '可合并的在途请求数'),
+                ('leaders', 'counter', '实际转发给上游的可合并请求数'),
+                ('coalesced', 'counter', '被合并而节省的上游调用数'),
+                ('overflow', 'counter', '等待者已满而照常转发的请求数'),
+        ):
+            name = f"fastmcp_proxy_coalescing_{key}" + ('_total' if metric_type == 'counter' else '')
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name} {coalescing[key]}")
+
+    compression = snapshot.get('compression')
+    if compression:
+        for key, help_text in (
+                ('frames_compressed', '压缩发送的数据包数'),
+                ('frames_uncompressed', '低于阈值原样发送的数据包数'),
+                ('raw_bytes_out', '发送方向压缩前的字节数'),
+                ('wire_bytes_out', '发送方向线路上的字节数'),
+                ('compress_cpu_seconds', '压缩耗费的CPU时间(秒)'),
+                ('frames_decompressed', '解压的数据包数'),
+                ('wire_bytes_in', '接收方向线路上的压缩字节数'),
+                ('raw_bytes_in', '接收方向解压后的字节数'),
+                ('decompress_cpu_seconds', '解压耗费的CPU时间(秒)'),
+        ):
+            name = f"fastmcp_proxy_compression_{key}_total"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {compression[key]}")
+
+    sampling = snapshot.get('sampling')
+    if sampling:
+        lines.append("# HELP fastmcp_proxy_samples_persisted_total 尾部采样写出次数 (按触发原因)")
+        lines.append("# TYPE fastmcp_proxy_samples_persisted_total counter")
+        for reason, count in sorted(sampling['persisted'].items()):
+            lines.append(f'fastmcp_proxy_samples_persisted_total{{reason="{_label(reason)}"}} {count}')
+        for key, help_text in (
+                ('frames_written', '尾部采样写出的数据包数'),
+                ('dropped', '写出队列已满而丢弃的采样次数'),
+        ):
+            name = f"fastmcp_proxy_samples_{key}_total"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {sampling[key]}")
+
+    hedging = snapshot.get('hedging')
+    for key, help_text in (
+            ('tracked', '可对冲的请求数'),
+            ('hedged', '发出的对冲请求数'),
+            ('hedge_wins', '对冲请求先返回的次数'),
+            ('primary_wins', '已对冲但主请求先返回的次数'),
+            ('budget_denied', '超出对冲比例而未对冲的次数'),
+            ('no_backend', '没有其他可用后端而未对冲的次数'),
+            ('hedge_errors', '对冲请求失败的次数'),
+    ) if hedging else ():
+        name = f"fastmcp_proxy_hedge_{key}_total"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {hedging[key]}")
+
+    upstream_pool = snapshot.get('upstream_pool')
+    if upstream_pool:
+        for key, help_text in (
+                ('open', '上游连接池当前打开的连接数'),
+                ('idle', '上游连接池中空闲待复用的连接数'),
+        ):
+            name = f"fastmcp_proxy_upstream_pool_{key}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {upstream_pool[key]}")
+        lines.append("# HELP fastmcp_proxy_upstream_pool_rejected_total 上游连接数达到上限而被拒绝的会话数")
+        lines.append("# TYPE fastmcp_proxy_upstream_pool_rejected_total counter")
+        lines.append(f"fastmcp_proxy_upstream_pool_rejected_total {upstream_pool['rejected']}")
+
+    backends = snapshot.get('backends', {})
+    for key, help_text in (
+            ('healthy', '后端健康检查是否通过'),
+            ('ejected', '后端是否因延迟异常被驱逐'),
+            ('circuit_open', '后端是否处于熔断状态'),
+            ('active_sessions', '后端当前会话数'),
+            ('outstanding', '后端未完成请求数'),
+            ('latency_ewma_us', '后端延迟EWMA(微秒)'),
+    ) if backends else ():
+        name = f"fastmcp_proxy_backend_{key}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for address, backend in backends.items():
+            lines.append(f'{name}{{backend="{_label(address)}"}} {int(backend[key])}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """本地指标HTTP端点: /metrics (Prometheus文本) 与 /metrics.json (JSON快照)
+
+    metrics 可以是 BrokerMetrics 或 AggregatedMetrics, 只需提供 snapshot() 与 to_prometheus()。
+    """
+
+    def __init__(self, metrics, host: str = '127.0.0.1', port: int = 9577):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.httpd: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> None:
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = metrics.to_prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # 抓取请求不写入代理日志
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
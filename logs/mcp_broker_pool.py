@@ -0,0 +1,492 @@
+import collections
+import itertools
+import socket
+import threading
+import time
+import traceback
+from typing import Any, Dict, List, Optional, Tuple
+
+from mcp_broker import FastMCPPacket, FastMCPFrameReader, connect_endpoint, format_endpoint, set_nodelay
+from mcp_broker_compress import COMPRESSED_FLAG, decode_frame
+from mcp_broker_jsonrpc import (parse_message, encode_message, is_request, is_response, with_id, error_response,
+                                initialize_key, JSONRPC_SERVER_ERROR, JSONRPC_METHOD_NOT_FOUND)
+
+
+class UpstreamConnection:
+    """连接池中的一条上游连接
+
+    会话独占使用 (owner): 请求发送前把 JSON-RPC id 改写为池内唯一的上游 id, 后台线程读取响应后按上游 id
+    找回请求方并恢复原始 id; 没有 id 的通知与服务器发起的请求只交给 owner。
+    不属于任何会话的连接 (空闲中, 或由 UpstreamPool.call 共享) 收到的通知被丢弃, 服务器发起的请求直接返回错误。
+    """
+
+    MAX_CANCELLED = 4096
+
+    def __init__(self, pool: 'UpstreamPool', index: int):
+        self.pool = pool
+        self.index = index
+        self.logger = pool.logger
+        self.packet_processor = pool.packet_processor
+        self.sock: Optional[socket.socket] = None
+        self.alive = False
+        self.send_lock = threading.Lock()  # 保护写套接字以及 pending / cancelled 的所有访问
+        self.pending: Dict[int, Tuple[Any, Any, int]] = {}  # 上游id -> (请求方, 原始id, 请求包类型)
+        self.cancelled = collections.OrderedDict()  # 已取消的上游id, 之后到达的响应直接丢弃 (最多保留 MAX_CANCELLED 个)
+        self.codec = None  # 与上游协商压缩后的压缩上下文, 在 send_lock 内编码
+        self.owner = None  # 独占该连接的会话
+        self.init_key: Optional[str] = None  # 该连接上 initialize 请求的参数 (initialize_key)
+        self.init_result: Optional[Dict[str, Any]] = None  # initialize 成功后的响应, 复用连接时直接返回给新会话
+        self.init_upstream_id: Optional[int] = None  # 在途的 initialize 请求的上游id
+        self.skip_initialized = False  # 复用连接时丢弃新会话的 notifications/initialized (上游已经收到过)
+        self.counted = True  # 占用连接池的一个名额, 连接结束时 (UpstreamPool._closed) 归还
+
+    def connect(self) -> None:
+        """建立连接并启动响应读取线程"""
+        start_time = time.time()
+        sock = connect_endpoint(self.pool.host, self.pool.port, timeout=self.pool.connect_timeout)
+        set_nodelay(sock)
+        compression = self.pool.compression
+        try:
+            self.codec = (compression.offer(self.packet_processor, sock, self.logger)
+                          if compression and compression.upstream else None)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.alive = True
+        connect_time = (time.time() - start_time) * 1000  # 毫秒
+        if self.pool.metrics:
+            self.pool.metrics.record_upstream_connect(int(connect_time * 1000))
+        self.logger.info(f"上游连接#{self.index} 已建立: {format_endpoint(self.pool.host, self.pool.port)}, "
+                         f"耗时={connect_time:.2f}ms")
+        threading.Thread(target=self._read_loop, args=(sock,), daemon=True).start()
+
+    def send(self, version: int, packet_type: int, data, upstream_id: Optional[int] = None,
+             target: Optional[Tuple[Any, Any, int]] = None) -> None:
+        """发送一个数据包; upstream_id 不为空时先登记等待响应的请求方"""
+        with self.send_lock:
+            if not self.alive:
+                raise ConnectionError(f"上游连接#{self.index} 已断开")
+            if upstream_id is not None:
+                self.pending[upstream_id] = target
+            if self.codec is not None:
+                version, data = self.codec.encode(version, data)
+            self.packet_processor.write_packet(self.sock, version, packet_type, data)
+
+    def handshake(self, version: int, packet_type: int, initialize: Dict[str, Any], timeout: float) -> None:
+        """在这条连接上代替会话完成 initialize 握手 (UpstreamPool.call 使用), 失败时抛出 ConnectionError"""
+        waiter = _HandshakeWaiter()
+        upstream_id = next(self.pool._upstream_ids)
+        self.init_key = initialize_key(initialize)
+        self.init_upstream_id = upstream_id
+        self.send(version, packet_type, with_id(initialize, upstream_id), upstream_id, (waiter, upstream_id, packet_type))
+        if not waiter.done.wait(timeout):
+            self.cancel(upstream_id, version, packet_type, "握手超时")
+            raise ConnectionError(f"上游连接#{self.index} initialize 超时")
+        if self.init_result is None:
+            raise ConnectionError(f"上游连接#{self.index} initialize 失败")
+        self.send(version, packet_type, encode_message({'jsonrpc': '2.0', 'method': 'notifications/initialized'}))
+
+    def _read_loop(self, sock: socket.socket) -> None:
+        """读取上游数据包并分发给对应的请求方"""
+        try:
+            for version, packet_type, data in FastMCPFrameReader(sock, budget=self.pool.budget):
+                if version & COMPRESSED_FLAG:
+                    version, data = decode_frame(self.codec, version, data)
+                message = parse_message(data)
+                if message is not None and is_response(message):
+                    with self.send_lock:
+                        target = self.pending.pop(message['id'], None)
+                        cancelled = target is None and self.cancelled.pop(message['id'], False)
+                    if target is None:
+                        if not cancelled:
+                            self.logger.warning(f"上游连接#{self.index} 收到未知请求的响应: id={message['id']}")
+                        continue
+                    if message['id'] == self.init_upstream_id:
+                        self.init_upstream_id = None
+                        if 'result' in message:
+                            self.init_result = {key: value for key, value in message.items() if key != 'id'}
+                    requester, original_id, _ = target
+                    requester.deliver(version, packet_type, with_id(message, original_id))
+                    continue
+                owner = self.owner
+                if owner is not None:
+                    owner.deliver(version, packet_type, bytes(data))
+                elif message is not None and is_request(message):
+                    self.logger.warning(f"上游连接#{self.index} 没有所属会话, 拒绝服务器请求: {message.get('method')}")
+                    try:
+                        self.send(version, packet_type, error_response(message['id'], JSONRPC_METHOD_NOT_FOUND,
+                                                                       "代理连接池中的连接不接受服务器请求"))
+                    except (OSError, ConnectionError):
+                        pass
+                else:
+                    self.logger.debug(f"上游连接#{self.index} 没有所属会话, 丢弃服务器通知")
+            self.logger.info(f"上游连接#{self.index} 已被服务器关闭")
+        except Exception as e:
+            if self.alive:
+                self.logger.error(f"上游连接#{self.index} 读取失败: {e}")
+                self.logger.debug(traceback.format_exc())
+        finally:
+            self._fail(sock)
+
+    def _fail(self, sock: socket.socket) -> None:
+        """连接断开: 为所有未完成的请求返回错误, 所属会话随之结束 (会话状态在上游, 不能换一条连接继续)"""
+        self.alive = False
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+        with self.send_lock:
+            pending, self.pending = self.pending, {}
+        for requester, original_id, packet_type in pending.values():
+            connection_lost = getattr(requester, 'connection_lost', None)
+            if connection_lost is not None:
+                connection_lost()  # 对冲请求: 按传输失败处理, 不当作上游的错误响应
+            else:
+                requester.deliver(1, packet_type, error_response(original_id, JSONRPC_SERVER_ERROR, "上游连接已断开"))
+        owner = self.owner
+        if owner is not None:
+            owner.stop()
+        self.pool._closed(self)
+
+    def forget(self, session) -> None:
+        """会话结束: 它未完成的请求改为已取消, 之后到达的响应直接丢弃"""
+        with self.send_lock:
+            for upstream_id, (owner, _, _) in list(self.pending.items()):
+                if owner is session:
+                    del self.pending[upstream_id]
+                    self._mark_cancelled(upstream_id)
+        if self.owner is session:
+            self.owner = None
+
+    def cancel(self, upstream_id: int, version: int, packet_type: int, reason: str) -> bool:
+        """放弃一个在途请求: 之后到达的响应直接丢弃, 并发送 MCP 取消通知 (notifications/cancelled)
+
+        请求已经返回或已经取消时返回 False。
+        """
+        with self.send_lock:
+            if self.pending.pop(upstream_id, None) is None:
+                return False
+            self._mark_cancelled(upstream_id)
+        notification = encode_message({'jsonrpc': '2.0', 'method': 'notifications/cancelled',
+                                       'params': {'requestId': upstream_id, 'reason': reason}})
+        try:
+            self.send(version, packet_type, notification)
+        except (OSError, ConnectionError):
+            pass
+        return True
+
+    def _mark_cancelled(self, upstream_id: int) -> None:
+        """在持有 send_lock 时调用"""
+        self.cancelled[upstream_id] = True
+        while len(self.cancelled) > self.MAX_CANCELLED:
+            self.cancelled.popitem(last=False)
+
+    def close(self) -> None:
+        self.alive = False
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)  # 唤醒阻塞在 recv 上的读取线程, 由它归还名额
+            except OSError:
+                pass
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+
+
+class _HandshakeWaiter:
+    """UpstreamConnection.handshake 等待 initialize 响应"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+    def deliver(self, version: int, packet_type: int, data: bytes) -> None:
+        self.done.set()
+
+
+class UpstreamPool:
+    """预热的上游连接池
+
+    启动时预先建立 size 条到目标MCP服务器的连接, 新会话不再需要等待建连。
+    MCP 会话是有状态的 (initialize 协商的能力、订阅、服务器发起的请求), 所以每个客户端会话独占一条上游连接:
+    - 会话的第一个消息到达时才分配连接: 是 initialize 请求时, 优先复用一条以相同参数完成握手的空闲连接,
+      直接返回缓存的 initialize 响应并丢弃随后的 notifications/initialized; 否则取一条预热的新连接并转发握手
+    - 会话结束时, 握手成功且仍然可用的连接回到空闲列表 (最多 size 条), 其余关闭
+    - 会话的上游连接断开时会话随之结束, 不会换到另一条连接上继续
+    - 所有连接 (预热、会话占用、空闲、共享) 合计不超过 max_connections 条: 达到上限时先关闭其他参数的空闲连接
+      腾出名额, 仍然没有名额时新会话最多等待 connect_timeout 秒, 之后拒绝
+    复用的连接上可能还有上一个会话已取消的请求的迟到响应, 所以请求 id 仍改写为池内唯一的上游 id。
+    call 发送不属于任何会话的请求 (对冲请求), 按 initialize 参数共享已代为完成握手的连接;
+    共享连接超过 MAX_SHARED 条时关闭最久未用且没有在途请求的连接。
+    建连与握手都不持有连接池的锁, 一个慢的上游不会阻塞其他会话分配连接。
+    """
+
+    MAX_SHARED = 16
+
+    def __init__(self, host: str, port: int, loggers, size: int = 4, connect_timeout: float = 5,
+                 metrics=None, budget=None, compression=None, max_connections: int = 0):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.max_connections = max_connections  # 0 表示不限制
+        self.connect_timeout = connect_timeout
+        self.metrics = metrics  # BrokerMetrics, 记录上游建连耗时
+        self.budget = budget  # MemoryBudget, 限制上游响应的帧大小与缓冲
+        self.compression = compression  # FrameCompression, 每条连接建立时与上游协商压缩
+        self.logger = loggers['client']
+        self.packet_processor = FastMCPPacket(loggers)
+        self.lock = threading.Lock()
+        self._slots = threading.Condition(self.lock)  # 有连接归还或关闭时通知等待名额的会话
+        self._open = 0  # 已占用的名额: 已建立与正在建立的连接数
+        self._fresh: List[UpstreamConnection] = []  # 预热的、从未使用过的连接
+        self._idle: Dict[Optional[str], List[UpstreamConnection]] = {}  # initialize 参数 -> 已握手的空闲连接
+        # initialize 参数 -> call 共享的连接, 按最近使用排序, 最多保留 MAX_SHARED 条
+        self._shared: 'collections.OrderedDict[Optional[str], UpstreamConnection]' = collections.OrderedDict()
+        self._indexes = itertools.count()
+        self._upstream_ids = itertools.count(1)
+        self._refilling = False
+        self.running = True
+
+        # 统计信息
+        self.rejected = 0  # 等待名额超时而拒绝的会话数
+
+    def start(self) -> None:
+        """预热连接池, 连接失败的在取用时补足"""
+        self._refill()
+
+    def _has_slot(self) -> bool:
+        """在持有锁时调用"""
+        return not self.max_connections or self._open < self.max_connections
+
+    def _connect(self) -> UpstreamConnection:
+        """在不持有锁时调用: 用调用方已占用的名额建立一条新连接, 失败时归还名额"""
+        connection = UpstreamConnection(self, next(self._indexes))
+        try:
+            connection.connect()
+        except OSError:
+            with self.lock:
+                self._open -= 1
+                self._slots.notify_all()
+            raise
+        return connection
+
+    def _closed(self, connection: UpstreamConnection) -> None:
+        """连接结束 (读取线程退出) 时归还名额"""
+        with self.lock:
+            if connection.counted:
+                connection.counted = False
+                self._open -= 1
+                self._slots.notify_all()
+
+    def _refill(self) -> None:
+        """补足预热的新连接"""
+        while True:
+            with self.lock:
+                self._fresh = [connection for connection in self._fresh if connection.alive]
+                if not self.running or len(self._fresh) >= self.size or not self._has_slot():
+                    self._refilling = False
+                    return
+                self._open += 1
+            try:
+                connection = self._connect()
+            except OSError as e:
+                self.logger.error(f"预热上游连接失败: {e}")
+                with self.lock:
+                    self._refilling = False
+                return
+            with self.lock:
+                if self.running:
+                    self._fresh.append(connection)
+                    self._slots.notify_all()
+                    continue
+            connection.close()
+
+    def _acquire(self, key: Optional[str]) -> Tuple[UpstreamConnection, bool]:
+        """为会话或共享连接取一条连接, 返回 (连接, 是否为以 key 完成握手的空闲连接)
+
+        依次尝试: 相同 initialize 参数的空闲连接、预热的新连接、空余名额 (新建)、关闭一条其他参数的空闲连接;
+        都没有时等待其他会话归还或关闭连接, 超过 connect_timeout 抛出 ConnectionError。建连在锁外进行。
+        """
+        deadline = time.monotonic() + self.connect_timeout
+        victim = None
+        with self.lock:
+            while True:
+                if not self.running:
+                    raise ConnectionError("上游连接池已关闭")
+                connection = self._take_idle(key) if key is not None else None
+                if connection is not None:
+                    return connection, True
+                connection = self._take_fresh()
+                if connection is not None:
+                    return connection, False
+                if self._has_slot():
+                    self._open += 1
+                    break
+                victim = self._take_idle_any()
+                if victim is not None:
+                    victim.counted = False  # 名额直接转给新连接
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += 1
+                    raise ConnectionError(f"上游连接数已达上限 {self.max_connections}: "
+                                          f"{format_endpoint(self.host, self.port)}")
+                self._slots.wait(remaining)
+        if victim is not None:
+            self.logger.debug(f"上游连接数已达上限, 关闭空闲连接#{victim.index}")
+            victim.close()
+        try:
+            return self._connect(), False
+        except OSError as e:
+            raise ConnectionError(f"没有可用的上游连接: {format_endpoint(self.host, self.port)}: {e}") from e
+
+    def _take_fresh(self) -> Optional[UpstreamConnection]:
+        """在持有锁时调用: 取一条预热的新连接, 并在后台补足预热连接"""
+        connection = None
+        while self._fresh:
+            candidate = self._fresh.pop()
+            if candidate.alive:
+                connection = candidate
+                break
+        if not self._refilling and self.running:
+            self._refilling = True
+            threading.Thread(target=self._refill, daemon=True).start()
+        return connection
+
+    def _take_idle(self, key: str) -> Optional[UpstreamConnection]:
+        """在持有锁时调用: 取一条以相同 initialize 参数完成握手的空闲连接"""
+        idle = self._idle.get(key)
+        while idle:
+            connection = idle.pop()
+            if connection.alive:
+                return connection
+        return None
+
+    def _take_idle_any(self) -> Optional[UpstreamConnection]:
+        """在持有锁时调用: 取出任意一条空闲连接, 用于腾出名额"""
+        for idle in self._idle.values():
+            while idle:
+                connection = idle.pop()
+                if connection.alive:
+                    return connection
+        return None
+
+    def _bind(self, session, version: int, packet_type: int, message: Optional[Dict[str, Any]]) -> bool:
+        """为会话分配上游连接, 返回 True 表示已复用空闲连接并直接答复了 initialize"""
+        connection, reused = self._acquire(initialize_key(message))
+        connection.owner = session
+        connection.skip_initialized = reused
+        session.upstream = connection
+        if reused:
+            self.logger.debug(f"上游连接#{connection.index} 复用于相同 initialize 参数的新会话")
+            session.deliver(version, packet_type, with_id(connection.init_result, message['id']))
+        return reused
+
+    def release(self, session, connection: UpstreamConnection) -> None:
+        """会话结束时归还连接: 握手成功且可用的连接留作空闲, 其余关闭"""
+        connection.forget(session)
+        with self.lock:
+            if connection.alive and self.running and connection.init_result is not None:
+                idle = self._idle.setdefault(connection.init_key, [])
+                if sum(len(connections) for connections in self._idle.values()) < self.size:
+                    idle.append(connection)
+                    self._slots.notify_all()
+                    return
+        connection.close()
+
+    def submit(self, session, version: int, packet_type: int, data) -> None:
+        """通过会话独占的连接 (session.upstream, 第一个消息到达时分配) 发送数据包, 请求的 id 改写为上游唯一 id"""
+        message = parse_message(data)
+        connection = session.upstream
+        if connection is None:
+            if self._bind(session, version, packet_type, message):
+                return
+            connection = session.upstream
+        elif connection.skip_initialized and message is not None and \
+                message.get('method') == 'notifications/initialized':
+            connection.skip_initialized = False
+            return
+
+        if message is not None and is_request(message):
+            upstream_id = next(self._upstream_ids)
+            if message.get('method') == 'initialize':
+                connection.init_key = initialize_key(message)
+                connection.init_upstream_id = upstream_id
+            connection.send(version, packet_type, with_id(message, upstream_id),
+                            upstream_id, (session, message['id'], packet_type))
+        else:
+            connection.send(version, packet_type, data)
+
+    def call(self, caller, version: int, packet_type: int, message: Dict[str, Any],
+             initialize: Optional[Dict[str, Any]] = None) -> Tuple[UpstreamConnection, int]:
+        """不绑定会话地发送一个请求, 响应 (恢复原始id后) 通过 caller.deliver 返回
+
+        initialize 为发起方会话的 initialize 请求: 请求经以相同参数完成握手的共享连接发送, 没有时先代为握手。
+        返回 (连接, 上游id), 调用方放弃该请求时用于 UpstreamConnection.cancel。
+        """
+        key = initialize_key(initialize)
+        with self.lock:
+            connection = self._shared.get(key)
+            if connection is not None and not connection.alive:
+                connection = None
+            elif connection is not None:
+                self._shared.move_to_end(key)
+        if connection is None:
+            connection, _ = self._acquire(None)
+            if initialize is not None:
+                try:
+                    connection.handshake(version, packet_type, initialize, self.connect_timeout)
+                except ConnectionError:
+                    connection.close()
+                    raise
+            with self.lock:
+                existing = self._shared.get(key)
+                if existing is not None and existing.alive:
+                    spare, connection = connection, existing  # 并发的另一次 call 已经完成握手
+                else:
+                    self._shared[key] = connection
+                    self._shared.move_to_end(key)
+                    spare = self._evict_shared(key)
+            if spare is not None:
+                spare.close()
+        upstream_id = next(self._upstream_ids)
+        connection.send(version, packet_type, with_id(message, upstream_id),
+                        upstream_id, (caller, message['id'], packet_type))
+        return connection, upstream_id
+
+    def _evict_shared(self, keep: Optional[str]) -> Optional[UpstreamConnection]:
+        """在持有锁时调用: 共享连接超过 MAX_SHARED 条时移除最久未用的空闲连接, 返回后由调用方在锁外关闭"""
+        for key in [key for key, connection in self._shared.items() if not connection.alive]:
+            del self._shared[key]
+        if len(self._shared) <= self.MAX_SHARED:
+            return None
+        for key, connection in self._shared.items():
+            if key != keep and not connection.pending:
+                del self._shared[key]
+                return connection
+        return None
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'open': self._open,
+                'max': self.max_connections,
+                'fresh': len(self._fresh),
+                'idle': sum(len(connections) for connections in self._idle.values()),
+                'shared': len(self._shared),
+                'rejected': self.rejected,
+            }
+
+    def close(self) -> None:
+        with self.lock:
+            self.running = False
+            connections = self._fresh + list(self._shared.values())
+            for idle in self._idle.values():
+                connections.extend(idle)
+            self._fresh, self._idle = [], {}
+            self._shared.clear()
+            self._slots.notify_all()
+        for connection in connections:
+            connection.close()
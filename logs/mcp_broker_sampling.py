@@ -0,0 +1,164 @@
+import base64
+import collections
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+from mcp_broker_jsonrpc import parse_message
+
+DIRECTION_NAMES = {0: 'c2s', 1: 's2c'}  # 与 CAPTURE_CLIENT_TO_SERVER / CAPTURE_SERVER_TO_CLIENT 一致
+_ERROR_MARKER = re.compile(rb'"(?:error|isError)"')  # re 直接在 memoryview 上查找, 不拷贝数据
+
+
+class ConnectionSampler:
+    """一个连接最近的数据包环形缓冲
+
+    转发线程只把数据包 (数据部分最多保留 max_payload 字节) 追加到环中; 一次请求/响应完成时,
+    如果延迟超过阈值、响应是错误、或命中 1/N 随机采样, 就把环中的全部数据包交给 TailSampler 写出并清空环。
+    """
+
+    __slots__ = ('sampler', 'client_id', 'ring')
+
+    def __init__(self, sampler: 'TailSampler', client_id: str):
+        self.sampler = sampler
+        self.client_id = client_id
+        self.ring = collections.deque(maxlen=sampler.ring_size)
+
+    def _record(self, direction: int, version: int, packet_type: int, data, length: int) -> None:
+        payload = bytes(data[:self.sampler.max_payload]) if data is not None else b''
+        self.ring.append((time.time(), direction, version, packet_type, length, payload))
+
+    def request(self, version: int, packet_type: int, data, length: int) -> None:
+        """客户端 -> 服务器 的数据包; 流式转发的大包 data 为 None, 只记录头部"""
+        self._record(0, version, packet_type, data, length)
+
+    def response(self, version: int, packet_type: int, data, length: int, latency_us: Optional[int]) -> None:
+        """服务器 -> 客户端 的数据包, latency_us 为与之配对的请求的延迟 (服务器主动推送时为 None)"""
+        self._record(1, version, packet_type, data, length)
+        if latency_us is None:
+            return
+        sampler = self.sampler
+        if latency_us >= sampler.slow_us:
+            self._persist('slow', latency_us)
+        elif data is not None and self._is_error(data):
+            self._persist('error', latency_us)
+        elif sampler.one_in and random.random() * sampler.one_in < 1:
+            self._persist('sampled', latency_us)
+
+    def failed(self, reason: str) -> None:
+        """转发出错 (连接异常): 写出出错前的数据包"""
+        if self.ring:
+            self._persist('connection_error', None, reason)
+
+    @staticmethod
+    def _is_error(data) -> bool:
+        """JSON-RPC 错误响应或 isError 的工具结果; 先做字节查找, 命中时才解析"""
+        if _ERROR_MARKER.search(data) is None:
+            return False
+        message = parse_message(data)
+        if message is None:
+            return False
+        result = message.get('result')
+        return 'error' in message or (isinstance(result, dict) and bool(result.get('isError')))
+
+    def _persist(self, reason: str, latency_us: Optional[int], detail: Optional[str] = None) -> None:
+        # 两个转发线程都会向环中追加: 逐个 popleft 取出, 取出期间追加的数据包要么被取走, 要么留在环中, 不会丢失
+        ring = self.ring
+        frames = []
+        while True:
+            try:
+                frames.append(ring.popleft())
+            except IndexError:
+                break
+        self.sampler.submit(self.client_id, reason, latency_us, detail, frames)
+
+
+class TailSampler:
+    """尾部采样的数据包日志
+
+    逐包日志开销太大, 而完全关闭又会丢失慢调用与失败调用的现场。每个连接在内存中保留最近 ring_size 个数据包,
+    只有请求慢 (>= slow_ms)、出错或命中 1/one_in 随机采样时才写出, 每次触发写一行 JSON,
+    包含触发原因、延迟和环中的全部数据包。写文件在后台线程中进行, 队列满时丢弃并计数, 不阻塞转发。
+    """
+
+    def __init__(self, path: str, slow_ms: float = 1000.0, one_in: int = 1000, ring_size: int = 32,
+                 max_payload: int = 4096, queue_size: int = 1024,
+                 max_bytes: int = 100 * 1024 * 1024, backup_count: int = 5):
+        self.slow_us = int(slow_ms * 1000)
+        self.one_in = one_in
+        self.ring_size = ring_size
+        self.max_payload = max_payload
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+        self._thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+        # 统计信息
+        self.persisted = collections.Counter()  # 触发原因 -> 次数
+        self.frames_written = 0
+        self.dropped = 0
+
+    def open(self, client_id: str) -> ConnectionSampler:
+        return ConnectionSampler(self, client_id)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._write_loop, name='tail-sampler', daemon=True)
+        self._thread.start()
+
+    def submit(self, client_id: str, reason: str, latency_us: Optional[int], detail: Optional[str],
+               frames: list) -> None:
+        try:
+            self._queue.put_nowait((time.time(), client_id, reason, latency_us, detail, frames))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return
+        with self.lock:
+            self.persisted[reason] += 1
+
+    def _format(self, ts, client_id, reason, latency_us, detail, frames) -> str:
+        records = []
+        for frame_ts, direction, version, packet_type, length, payload in frames:
+            record = {'ts': frame_ts, 'direction': DIRECTION_NAMES[direction], 'version': version,
+                      'packet_type': f"0x{packet_type:04X}", 'length': length}
+            try:
+                record['payload'] = payload.decode('utf-8')
+            except UnicodeDecodeError:
+                record['payload_base64'] = base64.b64encode(payload).decode('ascii')
+            if len(payload) < length:
+                record['truncated'] = True
+            records.append(record)
+        return json.dumps({'ts': ts, 'client_id': client_id, 'reason': reason, 'latency_us': latency_us,
+                           **({'detail': detail} if detail else {}), 'frames': records}, ensure_ascii=False)
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._handler.emit(logging.makeLogRecord({'msg': self._format(*item)}))
+            with self.lock:
+                self.frames_written += len(item[5])
+
+    def close(self) -> None:
+        """写完队列中剩余的记录"""
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._handler.close()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'persisted': dict(self.persisted),
+                'frames_written': self.frames_written,
+                'dropped': self.dropped,
+            }
@@ -0,0 +1,129 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from mcp_broker import setup_logging, shutdown_logging
+from mcp_broker_metrics import AggregatedMetrics, MetricsServer
+
+BROKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcp_broker.py')
+
+
+class BrokerSupervisor:
+    """多进程模式的监督进程
+
+    启动 N 个工作进程, 每个工作进程是一个完整的代理 (线程或asyncio引擎), 通过 SO_REUSEPORT 绑定同一个端口,
+    由内核把新连接分散到各进程, 从而绕开单进程的GIL上限。监督进程本身不处理连接, 只负责:
+    - 工作进程异常退出时按指数退避重启
+    - 收到 SIGTERM/SIGINT 时转发给所有工作进程并等待退出
+    - 汇总各工作进程定期写出的指标快照, 通过 metrics_port 提供统一的指标端点
+
+    工作进程以 `mcp_broker.py <原参数> --worker-index i` 的子进程方式启动 (而非 fork),
+    避免在已有线程的进程中 fork 带来的锁状态问题。
+    """
+
+    RESTART_BACKOFF_MIN = 0.5
+    RESTART_BACKOFF_MAX = 30.0
+    STABLE_SECONDS = 10.0  # 工作进程运行超过该时间后重置退避
+    STOP_TIMEOUT = 10.0
+
+    def __init__(self, workers: int, argv: List[str], metrics_dir: str = 'logs/metrics',
+                 metrics_port: int = 0):
+        self.loggers = setup_logging('INFO', log_file='logs/fastmcp_proxy.supervisor.log')
+        self.logger = self.loggers['main']
+        self.workers = workers
+        self.argv = list(argv)
+        self.metrics_dir = metrics_dir
+        self.processes: Dict[int, subprocess.Popen] = {}
+        self.started_at: Dict[int, float] = {}
+        self.backoff: Dict[int, float] = {}
+        self.restart_at: Dict[int, float] = {}
+        self.running = False
+        self.metrics_server = MetricsServer(AggregatedMetrics(metrics_dir), port=metrics_port) if metrics_port else None
+
+    def _spawn(self, index: int) -> None:
+        """启动第 index 个工作进程"""
+        command = [sys.executable, BROKER_SCRIPT, *self.argv, '--worker-index', str(index)]
+        process = subprocess.Popen(command)
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        self.logger.info(f"工作进程#{index} 已启动: pid={process.pid}")
+
+    def _reap(self) -> None:
+        """检查退出的工作进程并安排重启"""
+        now = time.monotonic()
+        for index, process in list(self.processes.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            del self.processes[index]
+            self._remove_snapshot(index)
+            uptime = now - self.started_at[index]
+            backoff = self.backoff.get(index, 0.0)
+            if uptime >= self.STABLE_SECONDS:
+                backoff = 0.0
+            backoff = min(max(backoff * 2, self.RESTART_BACKOFF_MIN), self.RESTART_BACKOFF_MAX)
+            self.backoff[index] = backoff
+            self.restart_at[index] = now + backoff
+            self.logger.error(f"工作进程#{index} 退出: pid={process.pid}, 返回码={code}, "
+                              f"运行={uptime:.1f}s, {backoff:.1f}s 后重启")
+
+        for index, restart_at in list(self.restart_at.items()):
+            if now >= restart_at:
+                del self.restart_at[index]
+                self._spawn(index)
+
+    def _remove_snapshot(self, index: int) -> None:
+        """删除工作进程写出的指标快照, 汇总时不再包含已退出的进程"""
+        path = os.path.join(self.metrics_dir, f"worker-{index}.json")
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _handle_signal(self, signum, frame) -> None:
+        self.logger.info(f"接收到信号 {signum}, 正在停止所有工作进程...")
+        self.running = False
+
+    def _stop_workers(self) -> None:
+        """向所有工作进程转发停止信号, 超时后强制结束"""
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)  # 工作进程按 KeyboardInterrupt 正常收尾
+        deadline = time.monotonic() + self.STOP_TIMEOUT
+        for index, process in self.processes.items():
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                self.logger.warning(f"工作进程#{index} 未在 {self.STOP_TIMEOUT}s 内退出, 强制结束")
+                process.kill()
+                process.wait()
+        self.processes.clear()
+
+    def run(self) -> None:
+        """启动工作进程并监督, 阻塞直到收到停止信号"""
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        for index in range(self.workers):
+            # 清理上次运行遗留的快照, 避免汇总到已不存在的进程
+            self._remove_snapshot(index)
+
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        self.running = True
+        self.logger.info(f"监督进程启动: pid={os.getpid()}, 工作进程数={self.workers}")
+        for index in range(self.workers):
+            self._spawn(index)
+        if self.metrics_server:
+            self.metrics_server.start()
+            self.logger.info(f"汇总指标端点: http://{self.metrics_server.host}:{self.metrics_server.port}/metrics")
+
+        try:
+            while self.running:
+                self._reap()
+                time.sleep(0.2)
+        finally:
+            self._stop_workers()
+            if self.metrics_server:
+                self.metrics_server.stop()
+            self.logger.info("监督进程已停止")
+            shutdown_logging()
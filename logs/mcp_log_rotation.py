@@ -0,0 +1,167 @@
+"""按大小/时间分段的日志文件, 关闭的分段在后台线程中压缩, 并按数量与总字节数保留
+
+- 活动分段始终是配置的路径 (例如 logs/mcp_io.log), tail -f 照常可用
+- 写满 max_bytes 或打开超过 max_age 秒后, 活动分段改名为 <path>.<开始时间> 并交给压缩线程,
+  压缩为 <path>.<开始时间>.gz 后删除原文件, 然后删除超出 retain 个或 retain_bytes 字节的最旧分段
+- 启动时如果活动分段非空 (上次运行的日志), 同样滚动并压缩而不是截断;
+  上次运行退出前未压缩完的分段也在启动时补做压缩
+- 压缩线程在 Linux 上降低自身调度优先级, 并按块压缩, 繁忙主机上不与转发线程争抢CPU
+
+同一路径只应由一个进程写入 (多个 stdio 包装器需要各自的 --log-file)。
+"""
+
+import glob
+import gzip
+import os
+import queue
+import re
+import shutil
+import sys
+import threading
+import time
+
+COMPRESS_CHUNK = 1024 * 1024
+_STAMP = re.compile(r'\.\d{8}-\d{6}(-\d+)?$')
+
+
+def _is_segment(path: str, name: str, suffix: str = '') -> bool:
+    """name 是否为 path 的分段 <path>.<YYYYmmdd-HHMMSS>[-n]<suffix>, 同目录下其他以 path. 开头的文件不算"""
+    return name.startswith(path) and name.endswith(suffix) and bool(
+        _STAMP.fullmatch(name[len(path):len(name) - len(suffix)]))
+
+
+def parse_size(value: str) -> int:
+    """解析字节数, 支持 K/M/G 后缀 (1024 进制)"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+class SegmentedLog:
+    """文本日志文件的替代品 (write/flush/close), 写入时按大小或时间滚动"""
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, max_age: float = 0.0, retain: int = 20,
+                 retain_bytes: int = 1024 * 1024 * 1024, compress_level: int = 6, encoding: str = 'utf-8'):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.retain = retain
+        self.retain_bytes = retain_bytes
+        self.compress_level = compress_level
+        self.encoding = encoding
+        self.lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._compressor = threading.Thread(target=self._compress_loop, name='log-compress', daemon=True)
+        self._compressor.start()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 上次运行遗留的未压缩分段与压缩了一半的临时文件, 以及上次运行的活动分段
+        for leftover in sorted(glob.glob(glob.escape(path) + '.*')):
+            if _is_segment(path, leftover, '.gz.tmp'):
+                os.unlink(leftover)
+            elif _is_segment(path, leftover):
+                self._queue.put(leftover)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._roll(os.path.getmtime(path))
+        self._open()
+
+    def _open(self) -> None:
+        self._file = open(self.path, 'ab')
+        self._size = self._file.tell()
+        self._opened_at = time.time()
+
+    def _segment_name(self, started: float) -> str:
+        name = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S', time.localtime(started))}"
+        candidate, index = name, 1
+        while os.path.exists(candidate) or os.path.exists(candidate + '.gz'):
+            candidate = f"{name}-{index}"
+            index += 1
+        return candidate
+
+    def _roll(self, started: float) -> None:
+        """把活动分段改名并交给压缩线程 (调用方已关闭它)"""
+        segment = self._segment_name(started)
+        try:
+            os.rename(self.path, segment)
+        except FileNotFoundError:
+            return  # 被外部删除或移走
+        self._queue.put(segment)
+
+    def write(self, text: str) -> None:
+        data = text.encode(self.encoding)
+        with self.lock:
+            self._file.write(data)
+            self._size += len(data)
+            if (self.max_bytes and self._size >= self.max_bytes) or \
+                    (self.max_age and time.time() - self._opened_at >= self.max_age):
+                self._rotate()
+
+    def _rotate(self) -> None:
+        started = self._opened_at
+        self._file.close()
+        self._roll(started)
+        self._open()
+
+    def flush(self) -> None:
+        with self.lock:
+            self._file.flush()
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def close(self, timeout: float = 10.0) -> None:
+        """关闭活动分段, 等待压缩线程处理完已滚动的分段 (超时则留给下次启动)"""
+        with self.lock:
+            if not self._file.closed:
+                self._file.close()
+        self._queue.put(None)
+        self._compressor.join(timeout)
+
+    # ---- 压缩线程 ----
+
+    def _compress_loop(self) -> None:
+        _lower_thread_priority()
+        while True:
+            segment = self._queue.get()
+            if segment is None:
+                return
+            try:
+                self._compress(segment)
+                self._apply_retention()
+            except OSError as e:
+                print(f"MCP Logger Error: compressing {segment} failed: {e}", file=sys.stderr, flush=True)
+
+    def _compress(self, segment: str) -> None:
+        temp_path = f"{segment}.gz.tmp"
+        with open(segment, 'rb') as source, gzip.open(temp_path, 'wb', compresslevel=self.compress_level) as target:
+            while True:
+                chunk = source.read(COMPRESS_CHUNK)
+                if not chunk:
+                    break
+                target.write(chunk)
+                time.sleep(0)  # 每块之间让出 GIL
+        shutil.copystat(segment, temp_path)  # 保留修改时间, 按时间排序保留分段
+        os.replace(temp_path, f"{segment}.gz")
+        os.unlink(segment)
+
+    def _apply_retention(self) -> None:
+        segments = sorted((segment for segment in glob.glob(glob.escape(self.path) + '.*.gz')
+                           if _is_segment(self.path, segment, '.gz')), key=os.path.getmtime, reverse=True)
+        total = 0
+        for index, segment in enumerate(segments):
+            total += os.path.getsize(segment)
+            if (self.retain and index >= self.retain) or (self.retain_bytes and total > self.retain_bytes):
+                os.unlink(segment)
+
+
+def _lower_thread_priority(increment: int = 10) -> None:
+    """Linux 下 setpriority 对线程 id 生效, 只降低当前 (压缩) 线程"""
+    try:
+        thread_id = threading.get_native_id()
+        os.setpriority(os.PRIO_PROCESS, thread_id, min(os.getpriority(os.PRIO_PROCESS, thread_id) + increment, 19))
+    except (AttributeError, OSError):
+        pass
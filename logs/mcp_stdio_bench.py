@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""stdio 包装器 (mcp_stdio_log_listen.py) 的逐消息延迟基准
+
+启动一个本地 stdio 回显服务 (逐行读取 JSON-RPC 请求, 返回带相同 id 的响应), 先直接通过管道测得基线,
+再经由包装器的各个模式以相同负载测量, 两者之差即包装器为每条消息增加的延迟。
+负载为闭环: 收到上一条响应后才发送下一条, 每条消息的往返时间都包含两次经过包装器的转发。
+
+模式:
+    direct   不经过包装器
+    sync     --sync-log, 逐行转发, 每行先写日志并 flush 再转发 (原始行为)
+    batched  默认模式, 立即转发, 日志由后台线程批量写出
+    selector --engine selector, 单线程事件循环复用三个非阻塞管道
+其他模式可用 --mode NAME="包装器参数" 追加, 例如 --mode big-flush="--flush-bytes 1048576"
+
+--stream N 改为吞吐测试: 一次写入 N 条请求组成的大流 (不等响应), 读回全部响应直到 EOF,
+输出 msgs/s、MB/s 与丢失的响应数 (包装器退出时没有转发完的输出)。
+
+--session-starts N 改为测量会话启动延迟: 从启动包装器到收到第一条响应 (initialize) 的时间,
+分别为每次新启动服务 (spawn) 与从预热进程池 (mcp_stdio_pool.py) 借用 (pool);
+--echo-startup-ms 模拟服务的导入开销 (真实的 fastmcp 服务在解释器启动之外还要导入数百毫秒)。
+
+用法:
+    python logs/mcp_stdio_bench.py --sizes 128 4096 --messages 5000
+    python logs/mcp_stdio_bench.py --modes direct batched --output stdio_bench.json
+    python logs/mcp_stdio_bench.py --stream 200000 --sizes 256 --modes direct batched selector
+    python logs/mcp_stdio_bench.py --session-starts 20 --echo-startup-ms 300
+"""
+
+import argparse
+import json
+import os
+import platform
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+WRAPPER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcp_stdio_log_listen.py')
+POOL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcp_stdio_pool.py')
+DEFAULT_MODES = {'direct': None, 'sync': ['--sync-log'], 'batched': [], 'selector': ['--engine', 'selector']}
+
+
+def serve_echo(startup_ms: float = 0.0) -> None:
+    """stdio 回显服务: 每个带 id 的请求返回一行响应, 内容为请求参数"""
+    time.sleep(startup_ms / 1000)  # 模拟导入开销
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    for line in stdin:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        if message.get('id') is None:
+            continue  # 通知不需要响应
+        stdout.write(json.dumps({'jsonrpc': '2.0', 'id': message['id'],
+                                 'result': {'content': (message.get('params') or {}).get('arguments')}},
+                                separators=(',', ':')).encode('utf-8') + b'\n')
+        stdout.flush()
+
+
+def _command(wrapper_args: Optional[List[str]], log_file: str) -> List[str]:
+    server = [sys.executable, os.path.abspath(__file__), '--serve-echo']
+    if wrapper_args is None:
+        return server
+    return [sys.executable, WRAPPER_SCRIPT, '--log-file', log_file, *wrapper_args, *server]
+
+
+def _percentile(ordered: List[float], q: float) -> int:
+    """返回微秒"""
+    if not ordered:
+        return 0
+    return int(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e6)
+
+
+def run_mode(wrapper_args: Optional[List[str]], size: int, messages: int, warmup: int, workdir: str) -> dict:
+    """启动一个 (可能经过包装器的) 回显服务, 逐条发送 messages 条请求, 返回往返时间统计"""
+    log_file = os.path.join(workdir, 'mcp_io.log')
+    process = subprocess.Popen(_command(wrapper_args, log_file), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               bufsize=0)
+    reader = os.fdopen(process.stdout.fileno(), 'rb', closefd=False)
+    padding = 'x' * max(0, size - 80)
+    latencies = []
+    try:
+        for i in range(warmup + messages):
+            request = json.dumps({'jsonrpc': '2.0', 'id': i, 'method': 'tools/call',
+                                  'params': {'name': 'echo', 'arguments': {'text': padding}}},
+                                 separators=(',', ':')).encode('utf-8') + b'\n'
+            started = time.perf_counter()
+            process.stdin.write(request)
+            response = reader.readline()
+            if not response:
+                raise RuntimeError("回显服务提前退出")
+            if i >= warmup:
+                latencies.append(time.perf_counter() - started)
+    finally:
+        process.stdin.close()
+        process.wait(timeout=10)
+        reader.close()
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    return {
+        'messages': len(ordered),
+        'msgs_per_s': round(len(ordered) / total, 1) if total else 0.0,
+        'mean_us': int(total / len(ordered) * 1e6) if ordered else 0,
+        'p50_us': _percentile(ordered, 0.50),
+        'p99_us': _percentile(ordered, 0.99),
+        'p999_us': _percentile(ordered, 0.999),
+        'max_us': _percentile(ordered, 1.0),
+        'log_bytes': os.path.getsize(log_file) if wrapper_args is not None and os.path.exists(log_file) else 0,
+    }
+
+
+def _echo_command(startup_ms: float) -> List[str]:
+    return [sys.executable, os.path.abspath(__file__), '--serve-echo', '--echo-startup-ms', str(startup_ms)]
+
+
+def run_session_starts(wrapper_args: List[str], sessions: int, interval: float, workdir: str) -> dict:
+    """逐个启动 sessions 个包装器会话, 测量启动到收到 initialize 响应的时间"""
+    initialize = json.dumps({'jsonrpc': '2.0', 'id': 0, 'method': 'initialize',
+                             'params': {'protocolVersion': '2025-03-26', 'capabilities': {},
+                                        'clientInfo': {'name': 'bench', 'version': '0'}}}).encode('utf-8') + b'\n'
+    latencies = []
+    for _ in range(sessions):
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, WRAPPER_SCRIPT, '--log-file', os.path.join(workdir, 'start.log'),
+                                    *wrapper_args], stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        process.stdin.write(initialize)
+        response = process.stdout.readline()
+        if not response:
+            raise RuntimeError("会话未返回 initialize 响应")
+        latencies.append(time.perf_counter() - started)
+        process.stdin.close()
+        process.wait(timeout=10)
+        process.stdout.close()
+        time.sleep(interval)  # 会话之间的间隔, 进程池在此期间补充子进程
+    ordered = sorted(latencies)
+    return {'sessions': len(ordered), 'mean_ms': round(sum(ordered) / len(ordered) * 1000, 1),
+            'p50_ms': round(_percentile(ordered, 0.50) / 1000, 1), 'max_ms': round(_percentile(ordered, 1.0) / 1000, 1)}
+
+
+def bench_session_starts(args) -> List[dict]:
+    echo = _echo_command(args.echo_startup_ms)
+    interval = args.echo_startup_ms / 1000 + 0.5
+    results = []
+    print(f"{'mode':>8} {'sessions':>9} {'mean_ms':>8} {'p50_ms':>8} {'max_ms':>8}")
+    with tempfile.TemporaryDirectory(prefix='mcp-stdio-bench-') as workdir:
+        socket_path = os.path.join(workdir, 'pool.sock')
+        pool = subprocess.Popen([sys.executable, POOL_SCRIPT, '--socket', socket_path, '--size', '2',
+                                 '--log-level', 'WARNING', '--', *echo])
+        try:
+            deadline = time.monotonic() + 30
+            while not os.path.exists(socket_path):
+                if time.monotonic() > deadline or pool.poll() is not None:
+                    raise RuntimeError("进程池未能启动")
+                time.sleep(0.05)
+            time.sleep(interval)  # 等待首批子进程就绪
+            for name, wrapper_args in (('spawn', echo), ('pool', ['--pool', socket_path])):
+                row = {'mode': name, **run_session_starts(wrapper_args, args.session_starts, interval, workdir)}
+                results.append(row)
+                print(f"{name:>8} {row['sessions']:>9} {row['mean_ms']:>8} {row['p50_ms']:>8} {row['max_ms']:>8}",
+                      flush=True)
+        finally:
+            pool.send_signal(signal.SIGINT)
+            pool.wait(timeout=10)
+    return results
+
+
+def run_stream(wrapper_args: Optional[List[str]], size: int, messages: int, workdir: str) -> dict:
+    """写入 messages 条请求后关闭 stdin, 读回全部响应直到 EOF"""
+    log_file = os.path.join(workdir, 'mcp_io.log')
+    padding = 'x' * max(0, size - 80)
+    payload = b''.join(json.dumps({'jsonrpc': '2.0', 'id': i, 'method': 'tools/call',
+                                   'params': {'name': 'echo', 'arguments': {'text': padding}}},
+                                  separators=(',', ':')).encode('utf-8') + b'\n' for i in range(messages))
+    process = subprocess.Popen(_command(wrapper_args, log_file), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               bufsize=0)
+
+    def feed() -> None:
+        view = memoryview(payload)
+        for offset in range(0, len(view), 1024 * 1024):
+            process.stdin.write(view[offset:offset + 1024 * 1024])
+        process.stdin.close()
+
+    started = time.perf_counter()
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    received = responses = 0
+    while True:
+        chunk = os.read(process.stdout.fileno(), 1024 * 1024)
+        if not chunk:
+            break
+        received += len(chunk)
+        responses += chunk.count(b'\n')
+    elapsed = time.perf_counter() - started
+    process.wait(timeout=10)
+    writer.join()
+    process.stdout.close()
+    return {
+        'messages': messages,
+        'msgs_per_s': round(responses / elapsed, 1),
+        'mb_per_s': round((len(payload) + received) / elapsed / 1e6, 1),
+        'seconds': round(elapsed, 3),
+        'lost': messages - responses,
+    }
+
+
+def _print_row(row: dict) -> None:
+    print(f"{row['mode']:>12} {row['size']:>8} {row['msgs_per_s']:>11,.0f} {row['mean_us']:>8} "
+          f"{row['p50_us']:>8} {row['p99_us']:>8} {row['p999_us']:>8} {row.get('overhead_p50_us', ''):>9} "
+          f"{row.get('overhead_p99_us', ''):>9}", flush=True)
+
+
+def _parse_mode(value: str):
+    name, sep, wrapper_args = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError("格式为 NAME=\"包装器参数\"")
+    return name, shlex.split(wrapper_args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="stdio 包装器逐消息延迟基准")
+    parser.add_argument('--serve-echo', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--stream', type=int, default=0, metavar='N',
+                        help='吞吐测试: 每个场景一次写入 N 条请求, 而不是逐条往返')
+    parser.add_argument('--echo-startup-ms', type=float, default=0.0, help='回显服务启动时模拟的导入耗时 (毫秒)')
+    parser.add_argument('--session-starts', type=int, default=0, metavar='N',
+                        help='测量 N 次会话启动延迟 (新启动服务与从进程池借用), 而不是逐消息延迟')
+    parser.add_argument('--modes', nargs='+', default=list(DEFAULT_MODES), choices=list(DEFAULT_MODES),
+                        help='内置模式, 默认全部')
+    parser.add_argument('--mode', dest='extra_modes', action='append', type=_parse_mode, default=[],
+                        metavar='NAME="ARGS"', help='追加一个包装器模式及其参数')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 4096], help='每条请求的大致字节数')
+    parser.add_argument('--messages', type=int, default=2000, help='每个场景测量的消息数')
+    parser.add_argument('--warmup', type=int, default=200, help='每个场景预热 (不计入统计) 的消息数')
+    parser.add_argument('--output', metavar='PATH', help='把结果写出为JSON')
+    args = parser.parse_args()
+
+    if args.serve_echo:
+        serve_echo(args.echo_startup_ms)
+        return
+    if args.session_starts:
+        results = bench_session_starts(args)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({'host': platform.node(), 'cpus': os.cpu_count(), 'python': platform.python_version(),
+                           'echo_startup_ms': args.echo_startup_ms, 'results': results}, f, ensure_ascii=False,
+                          indent=2)
+        return
+
+    modes: Dict[str, Optional[List[str]]] = {name: DEFAULT_MODES[name] for name in args.modes}
+    modes.update(args.extra_modes)
+    results = []
+    with tempfile.TemporaryDirectory(prefix='mcp-stdio-bench-') as workdir:
+        if args.stream:
+            print(f"{'mode':>12} {'size':>8} {'msgs/s':>11} {'MB/s':>8} {'seconds':>8} {'lost':>6}")
+            for size in args.sizes:
+                for name, wrapper_args in modes.items():
+                    row = {'mode': name, 'size': size, **run_stream(wrapper_args, size, args.stream, workdir)}
+                    results.append(row)
+                    print(f"{name:>12} {size:>8} {row['msgs_per_s']:>11,.0f} {row['mb_per_s']:>8} "
+                          f"{row['seconds']:>8} {row['lost']:>6}", flush=True)
+        else:
+            print(f"{'mode':>12} {'size':>8} {'msgs/s':>11} {'mean_us':>8} {'p50_us':>8} {'p99_us':>8} "
+                  f"{'p999_us':>8} {'+p50_us':>9} {'+p99_us':>9}")
+            for size in args.sizes:
+                baseline = None
+                for name, wrapper_args in modes.items():
+                    row = {'mode': name, 'size': size, **run_mode(wrapper_args, size, args.messages, args.warmup,
+                                                                   workdir)}
+                    if wrapper_args is None:
+                        baseline = row
+                    elif baseline:
+                        row['overhead_p50_us'] = row['p50_us'] - baseline['p50_us']
+                        row['overhead_p99_us'] = row['p99_us'] - baseline['p99_us']
+                    results.append(row)
+                    _print_row(row)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'host': platform.node(), 'cpus': os.cpu_count(), 'python': platform.python_version(),
+                       'messages': args.stream or args.messages, 'results': results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,235 +5,415 @@ import subprocess
 import threading
 import argparse
 import os
+import time
+import collections
+
+from mcp_log_rotation import SegmentedLog, parse_size
 
 # --- Configuration ---
 LOG_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "mcp_io.log")
+READ_CHUNK = 64 * 1024
 # --- End Configuration ---
 
-# --- Argument Parsing ---
-parser = argparse.ArgumentParser(
-    description="Wrap a command, passing STDIN/STDOUT verbatim while logging them.",
-    usage="%(prog)s <command> [args...]"
-)
-# Capture the command and all subsequent arguments
-parser.add_argument('command', nargs=argparse.REMAINDER,
-                    help='The command and its arguments to execute.')
-
-open(LOG_FILE, 'w', encoding='utf-8')
-
-if len(sys.argv) == 1:
-    parser.print_help(sys.stderr)
-    sys.exit(1)
-
-args = parser.parse_args()
 
-if not args.command:
-    print("Error: No command provided.", file=sys.stderr)
-    parser.print_help(sys.stderr)
-    sys.exit(1)
+def format_log_line(prefix, line_bytes):
+    """One log line for one line of traffic, e.g. '输入: {...}'."""
+    try:
+        line_str = line_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        line_str = f"[Non-UTF8 data, {len(line_bytes)} bytes]\n"  # Log representation
+    if not line_str.endswith('\n'):
+        line_str += '\n'
+    return f"{prefix}: {line_str}"
+
+
+def write_all(fd, data):
+    """os.write until every byte is written (pipes may accept partial writes)."""
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+# --- Log Writers ---
+# Forwarding threads call write(prefix, chunk) with raw chunks as they are forwarded;
+# chunks are split into lines here so every line keeps its '输入:' / '输出:' prefix.
+
+class SyncLogWriter:
+    """The original behaviour: every line is written and flushed before the data is forwarded."""
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.lock = threading.Lock()
+        self._partial = {}  # prefix -> bytes of an unterminated line
+
+    def write(self, prefix, chunk):
+        with self.lock:
+            for line in _split_lines(self._partial, prefix, chunk):
+                self.log_file.write(format_log_line(prefix, line))
+            self.log_file.flush()
+
+    def message(self, text):
+        with self.lock:
+            self.log_file.write(text)
+            self.log_file.flush()
+
+    def close(self):
+        with self.lock:
+            for prefix, rest in self._partial.items():
+                if rest:
+                    self.log_file.write(format_log_line(prefix, rest))
+            self._partial.clear()
+            self.log_file.flush()
+
+
+class BatchedLogWriter:
+    """Moves mcp_io.log off the forwarding path.
+
+    Forwarding threads only append (prefix, chunk) to an in-memory queue. A background thread
+    formats the queued chunks and writes them in one batch, flushing the file when flush_bytes
+    have accumulated or flush_interval seconds have passed, whichever comes first. If the disk
+    falls behind by more than max_pending bytes, further chunks are dropped (and the count is
+    written to the log) instead of stalling the stdio server.
+    """
+
+    def __init__(self, log_file, flush_interval=0.2, flush_bytes=64 * 1024, max_pending=64 * 1024 * 1024):
+        self.log_file = log_file
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._queue = collections.deque()  # (prefix, bytes) or (None, text)
+        self._pending = 0  # bytes queued but not yet written
+        self._dropped = 0
+        self._closed = False
+        self._partial = {}
+        self._thread = threading.Thread(target=self._write_loop, name='mcp-io-log', daemon=True)
+        self._thread.start()
+
+    def write(self, prefix, chunk):
+        with self._cond:
+            if self._pending + len(chunk) > self.max_pending:
+                self._dropped += len(chunk)
+                return
+            self._queue.append((prefix, bytes(chunk)))
+            self._pending += len(chunk)
+            if self._pending >= self.flush_bytes:
+                self._cond.notify()
+
+    def message(self, text):
+        with self._cond:
+            self._queue.append((None, text))
+
+    def _write_loop(self):
+        last_flush = time.monotonic()
+        unflushed = 0  # bytes of traffic written since the last flush
+        dirty = False
+        while True:
+            with self._cond:
+                if not self._closed and self._pending < self.flush_bytes:
+                    self._cond.wait(self.flush_interval)
+                batch = list(self._queue)
+                self._queue.clear()
+                written = self._pending
+                self._pending = 0
+                dropped, self._dropped = self._dropped, 0
+                closed = self._closed
+            try:
+                if batch or dropped or closed:
+                    self._write_batch(batch, dropped, closed)
+                    unflushed += written
+                    dirty = True
+                now = time.monotonic()
+                if dirty and (closed or unflushed >= self.flush_bytes or now - last_flush >= self.flush_interval):
+                    self.log_file.flush()
+                    last_flush, unflushed, dirty = now, 0, False
+            except Exception as e:
+                print(f"MCP Logger Error: log write failed: {e}", file=sys.stderr)
+            if closed:
+                return
+
+    def _write_batch(self, batch, dropped, final=False):
+        lines = []
+        for prefix, chunk in batch:
+            if prefix is None:
+                lines.append(chunk)
+                continue
+            for line in _split_lines(self._partial, prefix, chunk):
+                lines.append(format_log_line(prefix, line))
+        if dropped:
+            lines.append(f"!!! Log writer fell behind, dropped {dropped} bytes of traffic\n")
+        if final:
+            # Unterminated last lines (the stream ended without a newline)
+            lines.extend(format_log_line(prefix, rest) for prefix, rest in self._partial.items() if rest)
+            self._partial.clear()
+        self.log_file.write(''.join(lines))
+
+    def close(self):
+        """Write out everything still queued (including unterminated lines) and stop the thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=5.0)
+
+
+def _split_lines(partial, prefix, chunk):
+    """Complete lines in chunk, carrying an unterminated tail over to the next chunk of the same stream."""
+    data = partial.pop(prefix, b'') + chunk
+    lines = data.split(b'\n')
+    if lines[-1]:
+        partial[prefix] = lines[-1]
+    return [line + b'\n' for line in lines[:-1]]
 
-target_command = args.command
-# --- End Argument Parsing ---
 
 # --- I/O Forwarding Functions ---
-# These will run in separate threads
+# These run in separate threads. Bytes are forwarded as soon as they are read (no waiting
+# for a full line); formatting and writing the log happen on the log writer's thread.
 
-def forward_and_log_stdin(proxy_stdin, target_stdin, log_file):
-    """Reads from proxy's stdin, logs it, writes to target's stdin."""
+def forward_stream(source, target, log_writer, prefix, close_target=False, tracer=None, direction=None):
+    """Reads whatever is available from source, queues it for logging and writes it to target.
+
+    Queueing is a deque append; it happens before the write so that a request is always queued
+    (and timestamped) before the response it triggers can be read on the other thread.
+    """
+    source_fd, target_fd = source.fileno(), target.fileno()
     try:
         while True:
-            # Read line by line from the script's actual stdin
-            line_bytes = proxy_stdin.readline()
-            if not line_bytes:  # EOF reached
+            chunk = os.read(source_fd, READ_CHUNK)
+            if not chunk:  # EOF reached
                 break
-
-            # Decode for logging (assuming UTF-8, adjust if needed)
-            try:
-                 line_str = line_bytes.decode('utf-8')
-            except UnicodeDecodeError:
-                 line_str = f"[Non-UTF8 data, {len(line_bytes)} bytes]\n" # Log representation
-
-            # Log with prefix
-            log_file.write(f"输入: {line_str}")
-            log_file.flush() # Ensure log is written promptly
-
-            # Write the original bytes to the target process's stdin
-            target_stdin.write(line_bytes)
-            target_stdin.flush() # Ensure target receives it promptly
-
+            log_writer.write(prefix, chunk)
+            if tracer:
+                tracer.feed(direction, chunk)
+            write_all(target_fd, chunk)
     except Exception as e:
         # Log errors happening during forwarding
         try:
-            log_file.write(f"!!! STDIN Forwarding Error: {e}\n")
-            log_file.flush()
-        except: pass # Avoid errors trying to log errors if log file is broken
-
+            log_writer.message(f"!!! {prefix} Forwarding Error: {e}\n")
+        except Exception:
+            pass  # Avoid errors trying to log errors if log file is broken
     finally:
-        # Important: Close the target's stdin when proxy's stdin closes
-        # This signals EOF to the target process (like test.sh's read loop)
-        try:
-            target_stdin.close()
-            log_file.write("--- STDIN stream closed to target ---\n")
-            log_file.flush()
-        except Exception as e:
-             try:
-                log_file.write(f"!!! Error closing target STDIN: {e}\n")
-                log_file.flush()
-             except: pass
-
-
-def forward_and_log_stdout(target_stdout, proxy_stdout, log_file):
-    """Reads from target's stdout, logs it, writes to proxy's stdout."""
-    try:
-        while True:
-            # Read line by line from the target process's stdout
-            line_bytes = target_stdout.readline()
-            if not line_bytes: # EOF reached (process exited or closed stdout)
-                break
-
-            # Decode for logging
+        if close_target:
+            # Important: Close the target's stdin when proxy's stdin closes
+            # This signals EOF to the target process
             try:
-                 line_str = line_bytes.decode('utf-8')
-            except UnicodeDecodeError:
-                 line_str = f"[Non-UTF8 data, {len(line_bytes)} bytes]\n"
+                target.close()
+                log_writer.message("--- STDIN stream closed to target ---\n")
+            except Exception as e:
+                try:
+                    log_writer.message(f"!!! Error closing target STDIN: {e}\n")
+                except Exception:
+                    pass
 
-            # Log with prefix
-            log_file.write(f"输出: {line_str}")
-            log_file.flush()
-
-            # Write the original bytes to the script's actual stdout
-            proxy_stdout.write(line_bytes)
-            proxy_stdout.flush() # Ensure output is seen promptly
 
+def forward_lines_sync(source, target, log_writer, prefix, close_target=False, tracer=None, direction=None):
+    """The original line-at-a-time loop: log and flush, then write and flush, for every line."""
+    try:
+        while True:
+            line_bytes = source.readline()
+            if not line_bytes:
+                break
+            log_writer.write(prefix, line_bytes)
+            if tracer:
+                tracer.feed(direction, line_bytes)
+            target.write(line_bytes)
+            target.flush()
     except Exception as e:
         try:
-            log_file.write(f"!!! STDOUT Forwarding Error: {e}\n")
-            log_file.flush()
-        except: pass
+            log_writer.message(f"!!! {prefix} Forwarding Error: {e}\n")
+        except Exception:
+            pass
     finally:
-        try:
-            log_file.flush()
-        except: pass
-        # Don't close proxy_stdout (sys.stdout) here
-
-# --- Main Execution ---
-process = None
-log_f = None
-exit_code = 1 # Default exit code in case of early failure
-
-try:
-    # Open log file in append mode ('a') for the threads
-    log_f = open(LOG_FILE, 'a', encoding='utf-8')
-
-    # Start the target process
-    # We use pipes for stdin/stdout
-    # We work with bytes (bufsize=0 for unbuffered binary, readline() still works)
-    # stderr=subprocess.PIPE could be added to capture stderr too if needed.
-    process = subprocess.Popen(
-        target_command,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE, # Capture stderr too, good practice
-        bufsize=0 # Use 0 for unbuffered binary I/O
-    )
-
-    # Pass binary streams to threads
-    stdin_thread = threading.Thread(
-        target=forward_and_log_stdin,
-        args=(sys.stdin.buffer, process.stdin, log_f),
-        daemon=True # Allows main thread to exit even if this is stuck (e.g., waiting on stdin) - reconsider if explicit join is needed
+        if close_target:
+            try:
+                target.close()
+                log_writer.message("--- STDIN stream closed to target ---\n")
+            except Exception as e:
+                try:
+                    log_writer.message(f"!!! Error closing target STDIN: {e}\n")
+                except Exception:
+                    pass
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Wrap a command, passing STDIN/STDOUT verbatim while logging them.",
+        usage="%(prog)s [options] <command> [args...]"
     )
+    parser.add_argument('--log-file', default=LOG_FILE, metavar='PATH',
+                        help=f'Traffic log (default {LOG_FILE}).')
+    parser.add_argument('--rotate-bytes', type=parse_size, default=64 * 1024 * 1024, metavar='SIZE',
+                        help='Start a new log segment once the current one reaches SIZE (K/M/G suffixes, default 64M, '
+                             '0 = no size limit).')
+    parser.add_argument('--rotate-interval', type=float, default=0.0, metavar='SECONDS',
+                        help='Also start a new segment after this many seconds (default 0 = never).')
+    parser.add_argument('--retain', type=int, default=20, metavar='N',
+                        help='Keep at most N compressed segments per log (default 20, 0 = unlimited).')
+    parser.add_argument('--retain-bytes', type=parse_size, default=1024 * 1024 * 1024, metavar='SIZE',
+                        help='Keep at most SIZE of compressed segments per log (default 1G, 0 = unlimited).')
+    parser.add_argument('--engine', choices=('threaded', 'selector'), default='threaded',
+                        help='threaded: one blocking thread per stream (default); selector: all three streams '
+                             'multiplexed over non-blocking pipes in one thread, draining the output completely '
+                             'once the target exits.')
+    parser.add_argument('--sync-log', action='store_true',
+                        help='Original behaviour: forward line by line and flush the log before every line is forwarded.')
+    parser.add_argument('--flush-interval', type=float, default=0.2, metavar='SECONDS',
+                        help='Background log writer: flush at least this often (default 0.2s).')
+    parser.add_argument('--flush-bytes', type=int, default=64 * 1024, metavar='BYTES',
+                        help='Background log writer: flush once this many bytes are pending (default 64K).')
+    parser.add_argument('--rpc-log', metavar='PATH',
+                        help='Match JSON-RPC responses to requests by id (off the forwarding threads), append one '
+                             'compact JSON line per completed call to PATH and write a per-method summary table '
+                             '(calls, errors, latency, sizes) to the traffic log and stderr on exit.')
+    parser.add_argument('--pool', metavar='SOCKET',
+                        help='Borrow an already started server that has answered ping from a prewarmed pool '
+                             '(mcp_stdio_pool.py --socket SOCKET) instead of starting <command>; '
+                             'the session still performs initialize.')
+    parser.add_argument('--pool-children', type=int, default=1, metavar='K',
+                        help='With --pool: borrow K servers and spread independent requests across them by '
+                             'JSON-RPC id (only for servers whose tools keep no per-session state, default 1).')
+    parser.add_argument('--pool-timeout', type=float, default=60.0, metavar='SECONDS',
+                        help='With --pool: how long to wait for a ready server (default 60s).')
+    # Capture the command and all subsequent arguments
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='The command and its arguments to execute.')
+
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    args = parser.parse_args(argv)
+    if args.engine == 'selector' and args.pool_children > 1:
+        parser.error("--engine selector does not support --pool-children > 1")
+    if not args.command and not args.pool:
+        print("Error: No command provided.", file=sys.stderr)
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+    return args
 
-    stdout_thread = threading.Thread(
-        target=forward_and_log_stdout,
-        args=(process.stdout, sys.stdout.buffer, log_f),
-        daemon=True
-    )
 
-    # Optional: Handle stderr similarly (log and pass through)
-    stderr_thread = threading.Thread(
-        target=forward_and_log_stdout, # Can reuse the function
-        args=(process.stderr, sys.stderr.buffer, log_f), # Pass stderr streams
-        # Add a different prefix in the function if needed, or modify function
-        # For now, it will log with "STDOUT:" prefix - might want to change function
-        # Let's modify the function slightly for this
-        daemon=True
-    )
-    # A slightly modified version for stderr logging
-    def forward_and_log_stderr(target_stderr, proxy_stderr, log_file):
-        """Reads from target's stderr, logs it, writes to proxy's stderr."""
-        try:
-            while True:
-                line_bytes = target_stderr.readline()
-                if not line_bytes: break
-                try: line_str = line_bytes.decode('utf-8')
-                except UnicodeDecodeError: line_str = f"[Non-UTF8 data, {len(line_bytes)} bytes]\n"
-                log_file.write(f"STDERR: {line_str}") # Use STDERR prefix
-                log_file.flush()
-                proxy_stderr.write(line_bytes)
-                proxy_stderr.flush()
-        except Exception as e:
-            try:
-                log_file.write(f"!!! STDERR Forwarding Error: {e}\n")
-                log_file.flush()
-            except: pass
-        finally:
-            try:
-                log_file.flush()
-            except: pass
+# --- Main Execution ---
+def main(argv=None):
+    args = parse_args(argv)
+    target_command = args.command
 
-    stderr_thread = threading.Thread(
-        target=forward_and_log_stderr,
-        args=(process.stderr, sys.stderr.buffer, log_f),
-        daemon=True
-    )
+    def open_log(path):
+        # Previous runs are rolled into compressed segments, never truncated
+        return SegmentedLog(path, max_bytes=args.rotate_bytes, max_age=args.rotate_interval,
+                            retain=args.retain, retain_bytes=args.retain_bytes)
 
+    process = None
+    log_f = None
+    log_writer = None
+    tracer = None
+    exit_code = 1  # Default exit code in case of early failure
 
-    # Start the forwarding threads
-    stdin_thread.start()
-    stdout_thread.start()
-    stderr_thread.start() # Start stderr thread too
+    try:
+        log_f = open_log(args.log_file)
+        if args.sync_log:
+            log_writer = SyncLogWriter(log_f)
+        else:
+            log_writer = BatchedLogWriter(log_f, flush_interval=args.flush_interval, flush_bytes=args.flush_bytes)
+        directions = (None, None)  # stdin / stdout direction passed to the tracer
+        if args.rpc_log:
+            from mcp_stdio_rpc import RpcTracer, CLIENT_TO_SERVER, SERVER_TO_CLIENT
+            tracer = RpcTracer(open_log(args.rpc_log))
+            directions = (CLIENT_TO_SERVER, SERVER_TO_CLIENT)
+
+        if args.pool:
+            # Pipes of a prewarmed server, passed over the pool's Unix socket; same interface as Popen
+            from mcp_stdio_pool import PooledProcess, FanoutSession
+            process = PooledProcess(args.pool, count=args.pool_children, timeout=args.pool_timeout)
+            log_writer.message(f"--- Borrowed pooled server(s) {[child.pid for child in process.children]} ---\n")
+        else:
+            # Start the target process
+            # We use pipes for stdin/stdout/stderr (bufsize=0 for unbuffered binary I/O)
+            process = subprocess.Popen(
+                target_command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=0
+            )
+
+        if args.engine == 'selector':
+            # One thread, no join timeouts: returns once the target's output has been forwarded
+            from mcp_stdio_loop import SelectorForwarder
+            SelectorForwarder(process, log_writer, tracer, directions).run()
+            threads = []
+        elif args.pool and len(process.children) > 1:
+            threads = FanoutSession(process, log_writer, tracer, directions).threads()
+        else:
+            streams = (
+                (sys.stdin.buffer, process.stdin, "输入", True, directions[0]),
+                (process.stdout, sys.stdout.buffer, "输出", False, directions[1]),
+                (process.stderr, sys.stderr.buffer, "STDERR", False, None),
+            )
+            forward = forward_lines_sync if args.sync_log else forward_stream
+
+            # daemon=True: the stdin thread may stay blocked on our own stdin after the target exits
+            threads = [threading.Thread(target=forward, args=(source, target, log_writer, prefix, close_target,
+                                                              tracer if direction is not None else None, direction),
+                                        daemon=True)
+                       for source, target, prefix, close_target, direction in streams]
+        for thread in threads:
+            thread.start()
+
+        # Wait for the target process to complete
+        process.wait()
+        exit_code = process.returncode
+
+        # Wait briefly for I/O threads to forward and log the last messages
+        for thread in threads:
+            thread.join(timeout=1.0)
 
-    # Wait for the target process to complete
-    process.wait()
-    exit_code = process.returncode
+    except Exception as e:
+        print(f"MCP Logger Error: {e}", file=sys.stderr)
+        # Try to log the error too
+        if log_writer:
+            try:
+                log_writer.message(f"!!! MCP Logger Main Error: {e}\n")
+            except Exception:
+                pass  # Ignore errors during final logging attempt
+        exit_code = 1  # Indicate logger failure
 
-    # Wait briefly for I/O threads to finish flushing last messages
-    # Since they are daemons, they might exit abruptly with the main thread.
-    # Joining them ensures cleaner shutdown and logging.
-    # We need to make sure the pipes are closed so the reads terminate.
-    # process.wait() ensures target process is dead, pipes should close naturally.
-    stdin_thread.join(timeout=1.0) # Add timeout in case thread hangs
-    stdout_thread.join(timeout=1.0)
-    stderr_thread.join(timeout=1.0)
+    finally:
+        # Ensure the process is terminated if it's still running (e.g., if logger crashed)
+        if process and process.poll() is None:
+            try:
+                process.terminate()
+                process.wait(timeout=1.0)  # Give it a moment to terminate
+            except Exception:
+                pass
+            if process.poll() is None:  # Still running?
+                try:
+                    process.kill()  # Force kill
+                except Exception:
+                    pass
+
+        if tracer:
+            try:
+                table = tracer.close()
+                print(table, file=sys.stderr, end='')
+                if log_writer:
+                    log_writer.message("--- JSON-RPC summary ---\n" + table)
+            except Exception as e:
+                print(f"MCP Logger Error: JSON-RPC summary failed: {e}", file=sys.stderr)
+        if log_writer:
+            try:
+                log_writer.close()
+            except Exception:
+                pass
+        if log_f and not log_f.closed:
+            try:
+                log_f.close()
+            except Exception:
+                pass
 
+    # Exit with the target process's exit code
+    sys.exit(exit_code)
 
-except Exception as e:
-    print(f"MCP Logger Error: {e}", file=sys.stderr)
-    # Try to log the error too
-    if log_f and not log_f.closed:
-        try:
-            log_f.write(f"!!! MCP Logger Main Error: {e}\n")
-            log_f.flush()
-        except: pass # Ignore errors during final logging attempt
-    exit_code = 1 # Indicate logger failure
-
-finally:
-    # Ensure the process is terminated if it's still running (e.g., if logger crashed)
-    if process and process.poll() is None:
-        try:
-            process.terminate()
-            process.wait(timeout=1.0) # Give it a moment to terminate
-        except: pass # Ignore errors during cleanup
-        if process.poll() is None: # Still running?
-             try: process.kill() # Force kill
-             except: pass # Ignore kill errors
-
-    # Final log message
-    if log_f and not log_f.closed:
-        try:
-            log_f.close()
-        except: pass # Ignore errors during final logging attempt
 
-    # Exit with the target process's exit code
-    sys.exit(exit_code)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
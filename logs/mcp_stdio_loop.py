@@ -0,0 +1,225 @@
+"""stdio 包装器的单线程事件循环实现 (--engine selector)
+
+三个方向 (stdin -> 子进程, 子进程 stdout -> stdout, 子进程 stderr -> stderr) 的管道都设为非阻塞,
+由一个 selectors 循环复用: 读到多少转发多少, 目标管道写不进去的部分缓存起来等待可写,
+缓存超过 max_pending 时暂停读取该方向的源 (背压传回给写入方), 不需要每个方向一个线程, 也没有线程切换。
+
+退出过程是确定的:
+- 子进程 stdout 与 stderr 都读到 EOF 且缓存全部写出后循环结束, 再 wait 子进程, 不依赖 join 超时
+- 子进程退出 (Linux pidfd 可读) 而孙进程仍持有管道时, 读完管道中已有的数据后同样结束
+- 我们的 stdin 读到 EOF 并写完缓存后关闭子进程的 stdin
+日志与 JSON-RPC 配对仍由原来的写入器处理 (BatchedLogWriter 在自己的线程中写盘)。
+"""
+
+import collections
+import os
+import selectors
+import subprocess
+import sys
+from typing import Optional
+
+READ_CHUNK = 64 * 1024
+
+
+class Channel:
+    """一个转发方向: source_fd 读到的数据写入 target_fd"""
+
+    __slots__ = ('source_fd', 'target_fd', 'target', 'prefix', 'direction', 'close_target', 'pending',
+                 'pending_bytes', 'eof', 'done', 'paused', 'broken')
+
+    def __init__(self, source_fd: int, target, prefix: str, direction=None, close_target: bool = False):
+        self.source_fd = source_fd
+        self.target = target  # 文件对象, close_target 时通过它关闭
+        self.target_fd = target.fileno()
+        self.prefix = prefix
+        self.direction = direction
+        self.close_target = close_target
+        self.pending = collections.deque()  # 尚未写出的数据 (memoryview)
+        self.pending_bytes = 0
+        self.eof = False
+        self.done = False
+        self.paused = False
+        self.broken = False  # 目标已关闭 (EPIPE), 之后读到的数据只记录不转发
+
+
+class SelectorForwarder:
+    """在调用线程中转发子进程 (Popen 或 PooledProcess) 的三个管道, 直到子进程的输出全部转发完"""
+
+    def __init__(self, process, log_writer, tracer=None, directions=(None, None), max_pending: int = 1024 * 1024):
+        self.process = process
+        self.log_writer = log_writer
+        self.tracer = tracer
+        self.max_pending = max_pending
+        self.selector = _selector_for(sys.stdin.fileno())
+        self.stdin = Channel(sys.stdin.fileno(), process.stdin, "输入", directions[0], close_target=True)
+        self.outputs = [Channel(process.stdout.fileno(), sys.stdout, "输出", directions[1]),
+                        Channel(process.stderr.fileno(), sys.stderr, "STDERR")]
+        self._blocking = {}  # fd -> 原来的阻塞模式, 退出时恢复 (我们的 stdio 可能与父进程共享)
+        self._pidfd: Optional[int] = None
+        self.exited = False
+
+    def run(self) -> int:
+        channels = [self.stdin, *self.outputs]
+        for channel in channels:
+            for fd in (channel.source_fd, channel.target_fd):
+                if fd not in self._blocking:
+                    self._blocking[fd] = os.get_blocking(fd)
+                    os.set_blocking(fd, False)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            for channel in channels:
+                self.selector.register(channel.source_fd, selectors.EVENT_READ, (channel, False))
+            self._pidfd = self._open_pidfd()
+            while not all(channel.done for channel in self.outputs):
+                for key, events in self.selector.select():
+                    if key.data is None:
+                        self._child_exited(key.fd)
+                        continue
+                    channel, is_target = key.data
+                    if is_target:
+                        self._flush(channel)
+                    else:
+                        self._read(channel)
+            return self.process.wait()
+        finally:
+            self.selector.close()
+            if self._pidfd is not None:
+                os.close(self._pidfd)
+            for fd, blocking in self._blocking.items():
+                try:
+                    os.set_blocking(fd, blocking)
+                except OSError:
+                    pass  # 已关闭
+
+    def _open_pidfd(self) -> Optional[int]:
+        """子进程退出通知; 只有自己启动的子进程才使用 (进程池借来的子进程以管道 EOF 为准)"""
+        if not isinstance(self.process, subprocess.Popen) or not hasattr(os, 'pidfd_open'):
+            return None
+        try:
+            pidfd = os.pidfd_open(self.process.pid)
+        except OSError:
+            return None
+        self.selector.register(pidfd, selectors.EVENT_READ, None)
+        return pidfd
+
+    def _child_exited(self, pidfd: int) -> None:
+        """子进程已退出: 它写出的数据都已在管道中, 读完为止 (孙进程可能仍持有管道, 不再等 EOF)"""
+        self.selector.unregister(pidfd)
+        os.close(pidfd)
+        self._pidfd = None
+        self.exited = True
+        for channel in self.outputs:
+            self._drain(channel)
+
+    def _drain(self, channel: Channel) -> None:
+        while not channel.eof and not channel.paused:
+            self._read(channel)
+
+    def _read(self, channel: Channel) -> None:
+        try:
+            chunk = os.read(channel.source_fd, READ_CHUNK)
+        except BlockingIOError:
+            if self.exited and channel is not self.stdin:
+                self._finish_source(channel)  # 子进程退出后管道已读空
+            return
+        except OSError as e:
+            self.log_writer.message(f"!!! {channel.prefix} Forwarding Error: {e}\n")
+            chunk = b''
+        if not chunk:
+            self._finish_source(channel)
+            return
+        self.log_writer.write(channel.prefix, chunk)
+        if self.tracer and channel.direction is not None:
+            self.tracer.feed(channel.direction, chunk)
+        if channel.broken:
+            return
+        if channel.pending:
+            channel.pending.append(memoryview(chunk))
+            channel.pending_bytes += len(chunk)
+        else:
+            self._write(channel, memoryview(chunk))
+        if channel.pending_bytes > self.max_pending and not channel.paused:
+            channel.paused = True
+            self.selector.unregister(channel.source_fd)
+
+    def _write(self, channel: Channel, data: memoryview) -> None:
+        """目标为空闲时直接写; 写不完的部分缓存并等待可写"""
+        try:
+            written = os.write(channel.target_fd, data)
+        except BlockingIOError:
+            written = 0
+        except OSError as e:
+            self._target_broken(channel, e)
+            return
+        if written < len(data):
+            channel.pending.append(data[written:])
+            channel.pending_bytes += len(data) - written
+            self.selector.register(channel.target_fd, selectors.EVENT_WRITE, (channel, True))
+
+    def _flush(self, channel: Channel) -> None:
+        while channel.pending:
+            data = channel.pending[0]
+            try:
+                written = os.write(channel.target_fd, data)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                self._target_broken(channel, e)
+                return
+            channel.pending_bytes -= written
+            if written < len(data):
+                channel.pending[0] = data[written:]
+                return
+            channel.pending.popleft()
+        self.selector.unregister(channel.target_fd)
+        self._resume(channel)
+        if channel.eof:
+            self._done(channel)
+
+    def _resume(self, channel: Channel) -> None:
+        if channel.paused and not channel.eof:
+            channel.paused = False
+            self.selector.register(channel.source_fd, selectors.EVENT_READ, (channel, False))
+            if self.exited and channel is not self.stdin:
+                self._drain(channel)
+
+    def _target_broken(self, channel: Channel, error: OSError) -> None:
+        self.log_writer.message(f"!!! {channel.prefix} Forwarding Error: {error}\n")
+        if channel.pending:
+            self.selector.unregister(channel.target_fd)
+        channel.pending.clear()
+        channel.pending_bytes = 0
+        channel.broken = True
+        self._resume(channel)
+        if channel.eof:
+            self._done(channel)
+
+    def _finish_source(self, channel: Channel) -> None:
+        channel.eof = True
+        if not channel.paused:
+            self.selector.unregister(channel.source_fd)
+        if not channel.pending:
+            self._done(channel)
+
+    def _done(self, channel: Channel) -> None:
+        channel.done = True
+        if channel.close_target:
+            # Closing the target's stdin signals EOF to the target process
+            try:
+                channel.target.close()
+                self.log_writer.message("--- STDIN stream closed to target ---\n")
+            except OSError as e:
+                self.log_writer.message(f"!!! Error closing target STDIN: {e}\n")
+
+
+def _selector_for(fd: int) -> selectors.BaseSelector:
+    """epoll 不接受普通文件与 /dev/null (stdin 被重定向时), 这时改用 select, 它把它们视为始终可读"""
+    selector = selectors.DefaultSelector()
+    try:
+        selector.register(fd, selectors.EVENT_READ)
+        selector.unregister(fd)
+    except PermissionError:
+        selector.close()
+        return selectors.SelectSelector()
+    return selector
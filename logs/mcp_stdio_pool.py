@@ -0,0 +1,615 @@
+#!/usr/bin/env python3
+"""stdio MCP服务的预热进程池
+
+每个 stdio 会话都经由 mcp_stdio_log_listen.py 启动一个新的服务进程, 要付出解释器启动和 fastmcp/mcp 导入的开销。
+进程池守护进程预先启动 size 个服务进程, 用 MCP ping 请求确认导入完成并能响应 (之前的启动输出被丢弃;
+子进程不经过 initialize, 握手由借用它的会话完成), 空闲期间的 stdout/stderr 输出由后台线程读出并丢弃,
+包装器以 --pool SOCKET 启动时向守护进程借用就绪的子进程: 子进程的 stdin/stdout/stderr 管道
+通过Unix域套接字 (SCM_RIGHTS) 传给包装器, 之后的转发、日志与 JSON-RPC 配对都和直接启动时相同;
+守护进程随即在后台启动替补, 子进程退出时把退出码发回包装器。
+
+--pool-children K (K > 1) 时一个会话借用 K 个子进程, 包装器按请求 id 把互相独立的请求分散到各个子进程:
+- initialize 等会话级请求发给所有子进程, 只转发第一个响应; notifications/initialized 等通知同样广播
+- notifications/cancelled 发给持有该请求的子进程
+- 子进程发给客户端的请求 (sampling 等) 的 id 改写为会话内唯一的 id, 客户端的响应按映射发回原子进程
+- 广播请求未完成期间各子进程发出的内容相同的通知, 以及 */list_changed 通知, 只转发第一份; 其他通知都转发
+只适合工具无会话状态的服务 (子进程之间不共享内存中的状态)。
+
+用法:
+    python logs/mcp_stdio_pool.py --socket /tmp/mcp-stdio-pool.sock --size 4 -- python mcp_stdio_server.py
+    python logs/mcp_stdio_log_listen.py --pool /tmp/mcp-stdio-pool.sock
+    python logs/mcp_stdio_log_listen.py --pool /tmp/mcp-stdio-pool.sock --pool-children 4
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import logging
+import os
+import select
+import socket
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+READY_PING_ID = 'mcp-stdio-pool-ready'
+# 发给所有子进程的会话级请求与通知
+BROADCAST_METHODS = frozenset(('initialize', 'logging/setLevel', 'resources/subscribe', 'resources/unsubscribe',
+                               'notifications/initialized', 'notifications/roots/list_changed'))
+IDLE_DRAIN_INTERVAL = 0.5  # 空闲子进程的输出检查间隔, 也是新加入的就绪子进程最晚开始被读取的延迟
+NOTIFICATION_HISTORY = 1024  # 等待其他子进程重复副本的通知数上限
+LIST_CHANGED_SUFFIX = '/list_changed'
+
+logger = logging.getLogger('stdio-pool')
+
+
+class WarmChild:
+    __slots__ = ('process', 'warm_ms', 'stderr_eof')
+
+    def __init__(self, process: subprocess.Popen, warm_ms: float):
+        self.process = process
+        self.warm_ms = warm_ms  # 启动到响应 ping 的耗时
+        self.stderr_eof = False
+
+
+class StdioServerPool:
+    """进程池守护进程: 保持 size 个就绪的子进程, 按会话请求借出"""
+
+    def __init__(self, command: List[str], socket_path: str, size: int = 2, ready_timeout: float = 60.0,
+                 max_children_per_session: int = 16, orphan_grace: float = 5.0):
+        self.command = command
+        self.socket_path = socket_path
+        self.size = size
+        self.ready_timeout = ready_timeout
+        self.max_children_per_session = max_children_per_session
+        self.orphan_grace = orphan_grace
+        self._cond = threading.Condition()
+        self._ready: collections.deque = collections.deque()
+        self._warming = 0
+        self._demand = 0  # 正在等待子进程的会话所需的数量
+        self._sessions = itertools.count(1)
+        self.running = False
+
+        # 统计信息
+        self.spawned = 0
+        self.handed_out = 0
+        self.warm_failures = 0
+
+    def serve(self) -> None:
+        from mcp_broker import remove_stale_unix_socket  # 包装器导入本模块时不需要代理的依赖
+        remove_stale_unix_socket(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(64)
+        self.running = True
+        with self._cond:
+            self._refill()
+        threading.Thread(target=self._drain_idle, name='pool-drain', daemon=True).start()
+        logger.info(f"stdio进程池已启动: {self.socket_path}, 预热 {self.size} 个: {' '.join(self.command)}")
+        try:
+            while self.running:
+                conn, _ = listener.accept()
+                threading.Thread(target=self._session, args=(conn, next(self._sessions)), daemon=True).start()
+        finally:
+            self.running = False
+            listener.close()
+            remove_stale_unix_socket(self.socket_path)
+            with self._cond:
+                idle = list(self._ready)
+                self._ready.clear()
+            for child in idle:
+                child.process.kill()
+
+    # ---- 预热 ----
+
+    def _refill(self) -> None:
+        """在持有锁时调用: 就绪 + 预热中的子进程不足 size + 等待量时启动新的子进程"""
+        missing = self.size + self._demand - len(self._ready) - self._warming
+        for _ in range(max(0, missing)):
+            self._warming += 1
+            threading.Thread(target=self._warm_one, daemon=True).start()
+
+    def _warm_one(self) -> None:
+        while self.running:
+            child = self._spawn()
+            if child is not None:
+                with self._cond:
+                    self._warming -= 1
+                    self._ready.append(child)
+                    self._cond.notify_all()
+                return
+            self.warm_failures += 1
+            time.sleep(1.0)  # 启动失败时不要忙等重试
+        with self._cond:
+            self._warming -= 1
+
+    def _spawn(self) -> Optional[WarmChild]:
+        started = time.perf_counter()
+        try:
+            process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, bufsize=0)
+        except OSError as e:
+            logger.error(f"启动子进程失败: {e}")
+            return None
+        self.spawned += 1
+        try:
+            ping = json.dumps({'jsonrpc': '2.0', 'id': READY_PING_ID, 'method': 'ping'}) + '\n'
+            process.stdin.write(ping.encode('utf-8'))
+            self._await_ready(process, started + self.ready_timeout)
+        except (OSError, TimeoutError, EOFError) as e:
+            logger.error(f"子进程 {process.pid} 未能就绪: {e!r}")
+            process.kill()
+            process.wait()
+            return None
+        warm_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"子进程 {process.pid} 已就绪, 耗时 {warm_ms:.1f}ms")
+        return WarmChild(process, warm_ms)
+
+    @staticmethod
+    def _await_ready(process: subprocess.Popen, deadline: float) -> None:
+        """读取 stdout 直到 ping 的响应; 之前的输出 (例如打印到 stdout 的启动信息) 与 stderr 丢弃"""
+        fd = process.stdout.fileno()
+        stderr_fd = process.stderr.fileno()
+        fds = [fd, stderr_fd]
+        buffer = b''
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise TimeoutError("等待 ping 响应超时")
+            readable, _, _ = select.select(fds, [], [], remaining)
+            if not readable:
+                continue
+            if stderr_fd in readable:
+                chunk = os.read(stderr_fd, 65536)
+                if chunk:
+                    logger.debug(f"子进程 {process.pid} 启动时的 stderr: {chunk[:200].decode('utf-8', 'replace')}")
+                else:
+                    fds.remove(stderr_fd)  # 子进程关闭了 stderr
+                if fd not in readable:
+                    continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise EOFError(f"子进程退出, 退出码 {process.wait()}")
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    message = None
+                if isinstance(message, dict) and message.get('id') == READY_PING_ID:
+                    if buffer:
+                        logger.warning(f"子进程 {process.pid} 在 ping 响应之后输出了 {len(buffer)} 字节, 已丢弃")
+                    return
+                if line.strip():
+                    logger.info(f"丢弃子进程 {process.pid} 的启动输出: {line[:200].decode('utf-8', 'replace')}")
+
+    def _drain_idle(self) -> None:
+        """读出并丢弃空闲的就绪子进程的 stdout/stderr, 否则管道写满后子进程阻塞在写入上
+
+        只在持有锁且子进程仍在 _ready 中时读取, 借出之后的输出不会被这里读走。
+        """
+        while self.running:
+            with self._cond:
+                streams = {}
+                for child in self._ready:
+                    streams[child.process.stdout.fileno()] = (child, 'stdout')
+                    if not child.stderr_eof:
+                        streams[child.process.stderr.fileno()] = (child, 'stderr')
+            if not streams:
+                time.sleep(IDLE_DRAIN_INTERVAL)
+                continue
+            try:
+                readable, _, _ = select.select(list(streams), [], [], IDLE_DRAIN_INTERVAL)
+            except (OSError, ValueError):
+                continue  # 选择期间子进程被借出, 管道已关闭
+            dead = []
+            with self._cond:
+                for fd in readable:
+                    child, name = streams[fd]
+                    if child not in self._ready:
+                        continue
+                    chunk = os.read(fd, 65536)
+                    if chunk:
+                        logger.info(f"丢弃空闲子进程 {child.process.pid} 的 {name} 输出 {len(chunk)} 字节: "
+                                    f"{chunk[:200].decode('utf-8', 'replace')}")
+                    elif name == 'stderr':
+                        child.stderr_eof = True
+                    else:
+                        self._ready.remove(child)
+                        dead.append(child)
+                if dead:
+                    self._refill()
+            for child in dead:
+                logger.warning(f"空闲子进程 {child.process.pid} 已退出, 退出码 {child.process.wait()}")
+                for stream in (child.process.stdin, child.process.stdout, child.process.stderr):
+                    stream.close()
+
+    def _take(self, count: int) -> List[WarmChild]:
+        children = []
+        deadline = time.monotonic() + self.ready_timeout
+        with self._cond:
+            self._demand += count
+            try:
+                self._refill()
+                while len(children) < count:
+                    while not self._ready:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError("没有就绪的子进程")
+                        self._cond.wait(remaining)
+                    child = self._ready.popleft()
+                    if child.process.poll() is None:
+                        children.append(child)
+                    else:
+                        logger.warning(f"就绪的子进程 {child.process.pid} 已退出, 跳过")
+                        self._refill()
+            except TimeoutError:
+                self._ready.extendleft(children)
+                raise
+            finally:
+                self._demand -= count
+                self._refill()
+        return children
+
+    # ---- 会话 ----
+
+    def _session(self, conn: socket.socket, session_id: int) -> None:
+        send_lock = threading.Lock()
+
+        def send(message: Dict[str, Any]) -> None:
+            with send_lock:
+                try:
+                    conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+                except OSError:
+                    pass  # 包装器已退出
+
+        reader = conn.makefile('rb')
+        try:
+            request = json.loads(reader.readline() or b'{}')
+            count = max(1, min(int(request.get('children', 1)), self.max_children_per_session))
+            children = self._take(count)
+        except (ValueError, TimeoutError, OSError) as e:
+            logger.error(f"会话#{session_id} 借用子进程失败: {e}")
+            send({'error': str(e)})
+            conn.close()
+            return
+        processes = [child.process for child in children]
+        fds = [stream.fileno() for process in processes for stream in (process.stdin, process.stdout, process.stderr)]
+        header = json.dumps({'pids': [process.pid for process in processes],
+                             'warm_ms': [round(child.warm_ms, 1) for child in children]}).encode('utf-8') + b'\n'
+        with send_lock:
+            socket.send_fds(conn, [header], fds)
+        for process in processes:
+            # 只有包装器持有管道, 它关闭 stdin 时子进程才能读到 EOF
+            process.stdin.close()
+            process.stdout.close()
+            process.stderr.close()
+        self.handed_out += count
+        logger.info(f"会话#{session_id} 借出子进程 {[process.pid for process in processes]}")
+
+        def report_exit(index: int, process: subprocess.Popen) -> None:
+            send({'index': index, 'exit': process.wait()})
+
+        for index, process in enumerate(processes):
+            threading.Thread(target=report_exit, args=(index, process), daemon=True).start()
+
+        # 控制消息: 包装器要求终止子进程; 连接关闭 (包装器退出) 后宽限期内未退出的子进程被终止
+        for line in reader:
+            try:
+                signal_name = json.loads(line).get('signal')
+            except ValueError:
+                continue
+            for process in processes:
+                if process.poll() is None:
+                    process.kill() if signal_name == 'KILL' else process.terminate()
+        deadline = time.monotonic() + self.orphan_grace
+        for process in processes:
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"会话#{session_id} 已结束, 终止仍在运行的子进程 {process.pid}")
+                process.terminate()
+        conn.close()
+
+
+class ChildPipes:
+    __slots__ = ('pid', 'stdin', 'stdout', 'stderr')
+
+    def __init__(self, pid: int, stdin_fd: int, stdout_fd: int, stderr_fd: int):
+        self.pid = pid
+        self.stdin = os.fdopen(stdin_fd, 'wb', buffering=0)
+        self.stdout = os.fdopen(stdout_fd, 'rb', buffering=0)
+        self.stderr = os.fdopen(stderr_fd, 'rb', buffering=0)
+
+
+class PooledProcess:
+    """从进程池借来的子进程, 提供包装器用到的 Popen 接口 (stdin/stdout/stderr, wait, poll, terminate, kill)"""
+
+    def __init__(self, socket_path: str, count: int = 1, timeout: float = 60.0):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(socket_path)
+        self._sock.sendall(json.dumps({'children': count}).encode('utf-8') + b'\n')
+        data, fds, _, _ = socket.recv_fds(self._sock, 65536, 3 * count)
+        while b'\n' not in data:
+            more = self._sock.recv(65536)
+            if not more:
+                break
+            data += more
+        header, _, rest = data.partition(b'\n')
+        message = json.loads(header or b'{}')
+        if 'error' in message or len(fds) != 3 * len(message.get('pids', ())):
+            for fd in fds:
+                os.close(fd)
+            raise RuntimeError(f"进程池未能提供子进程: {message.get('error', message)}")
+        self._sock.settimeout(None)
+        self.children = [ChildPipes(pid, *fds[3 * index:3 * index + 3])
+                         for index, pid in enumerate(message['pids'])]
+        self.pid = self.children[0].pid
+        self.stdin, self.stdout, self.stderr = self.children[0].stdin, self.children[0].stdout, self.children[0].stderr
+        self.warm_ms = message.get('warm_ms')
+        self.returncodes: List[Optional[int]] = [None] * len(self.children)
+        self.returncode: Optional[int] = None
+        self._cond = threading.Condition()
+        threading.Thread(target=self._read_exits, args=(rest,), daemon=True).start()
+
+    def _read_exits(self, pending: bytes) -> None:
+        buffer = pending
+        while True:
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                message = json.loads(line)
+                with self._cond:
+                    self.returncodes[message['index']] = message['exit']
+                    self._update()
+            try:
+                chunk = self._sock.recv(65536)
+            except OSError:
+                chunk = b''
+            if not chunk:
+                break
+            buffer += chunk
+        # 与进程池的连接断开: 无法再得知退出码
+        with self._cond:
+            self.returncodes = [1 if code is None else code for code in self.returncodes]
+            self._update()
+
+    def _update(self) -> None:
+        if all(code is not None for code in self.returncodes):
+            self.returncode = next((code for code in self.returncodes if code), 0)
+            self._cond.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.returncode is not None, timeout):
+                raise subprocess.TimeoutExpired('pool', timeout)
+            return self.returncode
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def _signal(self, name: str) -> None:
+        try:
+            self._sock.sendall(json.dumps({'signal': name}).encode('utf-8') + b'\n')
+        except OSError:
+            pass
+
+    def terminate(self) -> None:
+        self._signal('TERM')
+
+    def kill(self) -> None:
+        self._signal('KILL')
+
+
+class FanoutSession:
+    """一个会话的请求按 id 分散到多个子进程, 响应合并回客户端 (--pool-children K)"""
+
+    def __init__(self, process: PooledProcess, log_writer, tracer=None, directions=(None, None)):
+        self.process = process
+        self.children = process.children
+        self.log_writer = log_writer
+        self.tracer = tracer
+        self.directions = directions
+        self.stdout_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self._owners: Dict[str, int] = {}  # 客户端请求 id -> 子进程序号
+        self._broadcast: Dict[str, int] = {}  # 广播请求 id -> 尚未收到的响应数
+        self._server_requests: Dict[str, tuple] = {}  # 改写后的 id -> (子进程序号, 原 id)
+        self._server_ids = itertools.count(1)
+        # 子进程通知 -> [已发出该通知的子进程集合], 每个集合对应转发过的一份
+        self._notifications: collections.OrderedDict = collections.OrderedDict()
+
+    def threads(self) -> List[threading.Thread]:
+        threads = [threading.Thread(target=self._client_loop, daemon=True)]
+        for index, child in enumerate(self.children):
+            threads.append(threading.Thread(target=self._child_loop, args=(index, child), daemon=True))
+            threads.append(threading.Thread(target=self._stderr_loop, args=(index, child), daemon=True))
+        return threads
+
+    @staticmethod
+    def _key(request_id: Any) -> str:
+        return json.dumps(request_id)
+
+    def _pick(self, request_id: Any) -> int:
+        if isinstance(request_id, int):
+            return request_id % len(self.children)
+        return zlib.crc32(self._key(request_id).encode('utf-8')) % len(self.children)
+
+    def _observe(self, prefix: str, direction, line: bytes) -> None:
+        self.log_writer.write(prefix, line)
+        if self.tracer:
+            self.tracer.feed(direction, line)
+
+    def _send(self, index: int, line: bytes) -> None:
+        try:
+            self.children[index].stdin.write(line)
+        except OSError as e:
+            self.log_writer.message(f"!!! 写入子进程#{index} 失败: {e}\n")
+
+    def _client_loop(self) -> None:
+        source = sys.stdin.buffer
+        try:
+            for line in source:
+                self._observe("输入", self.directions[0], line)
+                for index, data in self._route_client(line):
+                    self._send(index, data)
+        except Exception as e:
+            self.log_writer.message(f"!!! 输入 Forwarding Error: {e}\n")
+        finally:
+            for child in self.children:
+                try:
+                    child.stdin.close()
+                except OSError:
+                    pass
+            self.log_writer.message("--- STDIN stream closed to target ---\n")
+
+    def _route_client(self, line: bytes):
+        """返回 [(子进程序号, 数据)]"""
+        everyone = range(len(self.children))
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return [(index, line) for index in everyone]
+        if not isinstance(message, dict):
+            # 批量消息整体发给第一个请求 id 对应的子进程
+            first = next((m.get('id') for m in message if isinstance(m, dict) and m.get('id') is not None), 0)
+            return [(self._pick(first), line)]
+        method = message.get('method')
+        request_id = message.get('id')
+        with self.lock:
+            if method is None:
+                # 客户端对子进程请求的响应
+                target = self._server_requests.pop(self._key(request_id), None)
+                if target is None:
+                    return [(0, line)]
+                message['id'] = target[1]
+                return [(target[0], json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')]
+            if method in BROADCAST_METHODS:
+                if request_id is not None:
+                    self._broadcast[self._key(request_id)] = len(self.children)
+                return [(index, line) for index in everyone]
+            if request_id is None:
+                if method == 'notifications/cancelled':
+                    params = message.get('params') or {}
+                    owner = self._owners.get(self._key(params.get('requestId')))
+                    if owner is not None:
+                        return [(owner, line)]
+                return [(index, line) for index in everyone]
+            index = self._owners[self._key(request_id)] = self._pick(request_id)
+            return [(index, line)]
+
+    def _child_loop(self, index: int, child: ChildPipes) -> None:
+        source = os.fdopen(child.stdout.fileno(), 'rb', closefd=False)
+        try:
+            for line in source:
+                data = self._route_child(index, line)
+                if data is None:
+                    continue
+                with self.stdout_lock:
+                    self._observe("输出", self.directions[1], data)
+                    sys.stdout.buffer.write(data)
+                    sys.stdout.buffer.flush()
+        except Exception as e:
+            self.log_writer.message(f"!!! 输出[{index}] Forwarding Error: {e}\n")
+
+    def _route_child(self, index: int, line: bytes) -> Optional[bytes]:
+        """返回转发给客户端的数据, None 表示丢弃 (广播请求的重复响应)"""
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return line
+        if not isinstance(message, dict):
+            return line
+        if message.get('id') is None:
+            return line if self._first_copy(index, line, message.get('method')) else None
+        key = self._key(message['id'])
+        with self.lock:
+            if 'method' in message:
+                # 子进程发给客户端的请求: 各子进程的 id 可能重复, 改写为会话内唯一的 id
+                new_id = f"pool-{next(self._server_ids)}"
+                self._server_requests[self._key(new_id)] = (index, message['id'])
+                message['id'] = new_id
+                return json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n'
+            remaining = self._broadcast.get(key)
+            if remaining is not None:
+                if remaining <= 1:
+                    del self._broadcast[key]
+                    if not self._broadcast:
+                        self._notifications.clear()  # 之后的相同通知来自不同请求, 不是副本
+                else:
+                    self._broadcast[key] = remaining - 1
+                if remaining != len(self.children):
+                    return None  # 已转发过第一个响应
+            self._owners.pop(key, None)
+        return line
+
+    def _first_copy(self, index: int, line: bytes, method: Any) -> bool:
+        """通知是否应转发: 其他子进程已发出且本子进程尚未发出的相同通知是重复副本
+
+        只在广播请求未完成期间 (各子进程处理同一个请求) 以及 */list_changed 通知上去重,
+        其他时候内容相同的通知来自不同的请求, 都要转发。
+        """
+        key = line.rstrip()
+        with self.lock:
+            if not self._broadcast and not (isinstance(method, str) and method.endswith(LIST_CHANGED_SUFFIX)):
+                return True
+            copies = self._notifications.get(key)
+            if copies is None:
+                copies = self._notifications[key] = []
+            for seen in copies:
+                if index not in seen:
+                    seen.add(index)
+                    if len(seen) == len(self.children):
+                        copies.remove(seen)
+                        if not copies:
+                            del self._notifications[key]
+                    return False
+            copies.append({index})
+            self._notifications.move_to_end(key)
+            while len(self._notifications) > NOTIFICATION_HISTORY:
+                self._notifications.popitem(last=False)
+        return True
+
+    def _stderr_loop(self, index: int, child: ChildPipes) -> None:
+        fd = child.stderr.fileno()
+        try:
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                self.log_writer.write(f"STDERR[{index}]", chunk)
+                sys.stderr.buffer.write(chunk)
+                sys.stderr.buffer.flush()
+        except Exception as e:
+            self.log_writer.message(f"!!! STDERR[{index}] Forwarding Error: {e}\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="stdio MCP服务的预热进程池",
+                                     usage="%(prog)s --socket PATH [--size N] -- <command> [args...]")
+    parser.add_argument('--socket', required=True, help='包装器 (--pool) 连接的Unix域套接字路径')
+    parser.add_argument('--size', type=int, default=2, help='保持就绪的子进程数, 默认2')
+    parser.add_argument('--ready-timeout', type=float, default=60.0, metavar='SECONDS',
+                        help='子进程启动后响应 ping 的时限, 也是会话等待就绪子进程的时限')
+    parser.add_argument('--log-level', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='服务命令')
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        parser.error("缺少服务命令")
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        stream=sys.stderr)
+    pool = StdioServerPool(command, args.socket, size=args.size, ready_timeout=args.ready_timeout)
+    try:
+        pool.serve()
+    except KeyboardInterrupt:
+        logger.info("接收到中断信号, 进程池已停止")
+
+
+if __name__ == '__main__':
+    main()
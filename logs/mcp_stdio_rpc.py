@@ -0,0 +1,218 @@
+"""stdio 包装器的 JSON-RPC 请求/响应配对
+
+转发线程只把读到的数据块连同读取时间 (perf_counter_ns) 放入队列, 解析在后台线程中批量进行:
+后台线程每 parse_interval 秒或队列积累 wake_chunks 个数据块时才唤醒一次, 延迟按入队时间计算,
+不会因批量解析而偏大, 同时避免每条消息一次线程切换 (单核或 GIL 竞争时这会直接拖慢转发)。
+
+- 按方向把数据块切分为行 (stdio 传输每行一条 JSON-RPC 消息或一个批量数组)
+- 带 id 的请求登记为在途调用, 反方向带相同 id 的响应到达时配对; 服务器发给客户端的请求 (sampling 等) 同样配对
+- 按方法 (tools/call 按工具名) 统计调用数、延迟直方图、请求/响应字节数与错误数
+  (JSON-RPC error 或工具结果 isError)
+- 每个完成的调用写一行紧凑的 JSON 到结构化日志; 退出时写出汇总表
+"""
+
+import collections
+import json
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from mcp_broker_metrics import LatencyHistogram
+
+CLIENT_TO_SERVER = 0
+SERVER_TO_CLIENT = 1
+DIRECTION_NAMES = {CLIENT_TO_SERVER: 'c2s', SERVER_TO_CLIENT: 's2c'}
+
+
+def call_label(message: Dict[str, Any]) -> str:
+    """统计使用的方法名: tools/call 附带工具名"""
+    method = message.get('method')
+    params = message.get('params')
+    if method == 'tools/call' and isinstance(params, dict) and isinstance(params.get('name'), str):
+        return f"tools/call:{params['name']}"
+    return str(method)
+
+
+def error_of(message: Dict[str, Any]) -> Optional[str]:
+    """响应的错误描述: JSON-RPC 错误码, 工具结果 isError 时为 'isError', 成功时为 None"""
+    error = message.get('error')
+    if error is not None:
+        return str(error.get('code')) if isinstance(error, dict) else 'error'
+    result = message.get('result')
+    if isinstance(result, dict) and result.get('isError'):
+        return 'isError'
+    return None
+
+
+class MethodStats:
+    __slots__ = ('calls', 'errors', 'latency', 'request_bytes', 'response_bytes')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+
+class RpcTracer:
+    """newline 分隔的 JSON-RPC 流的请求/响应配对与按方法统计"""
+
+    YIELD_EVERY = 8  # 每解析这么多个数据块让出一次 GIL
+
+    def __init__(self, log_file=None, max_pending: int = 10_000, parse_interval: float = 0.1,
+                 wake_chunks: int = 1024, max_line: int = 16 * 1024 * 1024):
+        self.log_file = log_file  # 结构化日志 (文本文件对象或 SegmentedLog), None 时只统计
+        self.max_pending = max_pending
+        self.parse_interval = parse_interval
+        self.wake_chunks = wake_chunks
+        self.max_line = max_line
+        self._cond = threading.Condition()
+        self._queue = collections.deque()  # (方向, 读取时间ns, 数据块)
+        self._closed = False
+        self._partial: Dict[int, bytes] = {}
+        # (发起方向, id) -> (方法名, 开始时间ns, 请求字节数)
+        self._pending: 'collections.OrderedDict[Tuple[int, Any], Tuple[str, int, int]]' = collections.OrderedDict()
+        self.methods: Dict[str, MethodStats] = {}
+        self.notifications = collections.Counter()  # 方法名 -> 通知数
+        self.unparsed_lines = 0
+        self.unmatched_responses = 0
+        self.evicted = 0  # 在途调用超过 max_pending 而丢弃的最早请求
+        self._thread = threading.Thread(target=self._parse_loop, name='mcp-rpc-trace', daemon=True)
+        self._thread.start()
+
+    def feed(self, direction: int, chunk: bytes) -> None:
+        """由转发线程调用: 只入队"""
+        with self._cond:
+            self._queue.append((direction, time.perf_counter_ns(), chunk))
+            if len(self._queue) >= self.wake_chunks:
+                self._cond.notify()
+
+    def close(self) -> str:
+        """处理完队列后停止, 返回 (并写入结构化日志) 汇总表"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=10.0)
+        table = self.summary_table()
+        if self.log_file:
+            self.log_file.write(json.dumps({'summary': self.summary()}, ensure_ascii=False,
+                                           separators=(',', ':')) + '\n')
+            self.log_file.close()
+        return table
+
+    # ---- 后台线程 ----
+
+    def _parse_loop(self) -> None:
+        while True:
+            with self._cond:
+                if len(self._queue) < self.wake_chunks and not self._closed:
+                    self._cond.wait(self.parse_interval)
+                batch = list(self._queue)
+                self._queue.clear()
+                closed = self._closed
+            for index, (direction, received, chunk) in enumerate(batch, 1):
+                self._feed_chunk(direction, received, chunk)
+                if index % self.YIELD_EVERY == 0:
+                    time.sleep(0)  # 让出 GIL, 转发线程不必等满切换间隔 (默认5ms)
+            if self.log_file and batch:
+                self.log_file.flush()
+            if closed:
+                return
+
+    def _feed_chunk(self, direction: int, received: int, chunk: bytes) -> None:
+        data = self._partial.pop(direction, b'') + chunk
+        lines = data.split(b'\n')
+        if lines[-1]:
+            if len(lines[-1]) <= self.max_line:
+                self._partial[direction] = lines[-1]
+            else:
+                self.unparsed_lines += 1  # 超长的行不再缓存, 该消息不参与配对
+        for line in lines[:-1]:
+            if line.strip():
+                self._line(direction, received, line)
+
+    def _line(self, direction: int, received: int, line: bytes) -> None:
+        try:
+            payload = json.loads(line)
+        except (ValueError, UnicodeDecodeError):
+            self.unparsed_lines += 1
+            return
+        messages = payload if isinstance(payload, list) else [payload]
+        size = len(line) // max(1, len(messages))  # 批量消息按条数均分字节数
+        for message in messages:
+            if isinstance(message, dict):
+                self._message(direction, received, message, size)
+
+    def _message(self, direction: int, received: int, message: Dict[str, Any], size: int) -> None:
+        request_id = message.get('id')
+        if 'method' in message:
+            if request_id is None:
+                self.notifications[str(message['method'])] += 1
+                return
+            try:
+                self._pending[(direction, request_id)] = (call_label(message), received, size)
+            except TypeError:
+                return  # 不可哈希的 id
+            if len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+                self.evicted += 1
+            return
+        try:
+            entry = self._pending.pop((1 - direction, request_id), None)
+        except TypeError:
+            entry = None
+        if entry is None:
+            self.unmatched_responses += 1
+            return
+        label, started, request_size = entry
+        latency_us = (received - started) // 1000
+        error = error_of(message)
+        stats = self.methods.get(label)
+        if stats is None:
+            stats = self.methods[label] = MethodStats()
+        stats.calls += 1
+        stats.errors += error is not None
+        stats.latency.record(latency_us)
+        stats.request_bytes += request_size
+        stats.response_bytes += size
+        if self.log_file:
+            record = {'ts': round(time.time(), 3), 'dir': DIRECTION_NAMES[1 - direction], 'id': request_id,
+                      'method': label, 'us': latency_us, 'req': request_size, 'resp': size}
+            if error is not None:
+                record['error'] = error
+            self.log_file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    # ---- 汇总 ----
+
+    def summary(self) -> dict:
+        return {
+            'methods': {label: {'calls': stats.calls, 'errors': stats.errors,
+                                'request_bytes': stats.request_bytes, 'response_bytes': stats.response_bytes,
+                                **{key: value for key, value in stats.latency.snapshot().items()
+                                   if key != 'buckets'}}
+                        for label, stats in sorted(self.methods.items())},
+            'notifications': dict(self.notifications),
+            'pending': len(self._pending),
+            'unmatched_responses': self.unmatched_responses,
+            'unparsed_lines': self.unparsed_lines,
+            'evicted': self.evicted,
+        }
+
+    def summary_table(self) -> str:
+        lines = [f"{'method':<32} {'calls':>7} {'errors':>7} {'err%':>6} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} "
+                 f"{'max_ms':>8} {'avg_req':>8} {'avg_resp':>9}"]
+        for label, stats in sorted(self.methods.items(), key=lambda item: -item[1].calls):
+            latency = stats.latency
+            lines.append(f"{label[:32]:<32} {stats.calls:>7} {stats.errors:>7} "
+                         f"{stats.errors / stats.calls * 100:>5.1f}% "
+                         f"{latency.percentile(0.50) / 1000:>8.2f} {latency.percentile(0.95) / 1000:>8.2f} "
+                         f"{latency.percentile(0.99) / 1000:>8.2f} {latency.max / 1000:>8.2f} "
+                         f"{stats.request_bytes // stats.calls:>8} {stats.response_bytes // stats.calls:>9}")
+        extra = [f"{name}={value}" for name, value in (
+            ('notifications', sum(self.notifications.values())), ('unanswered', len(self._pending)),
+            ('unmatched_responses', self.unmatched_responses), ('unparsed_lines', self.unparsed_lines),
+            ('evicted', self.evicted)) if value]
+        if extra:
+            lines.append(', '.join(extra))
+        return '\n'.join(lines) + '\n'
@@ -1,9 +1,17 @@
+import asyncio
+import collections
+import inspect
 import json
 import logging
+import random
+import threading
 import time
-from typing import Dict, Any, Optional
-import requests
-from sseclient import SSEClient
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List
+
+import httpx
+
+from mcp_broker_metrics import LatencyHistogram
 
 # 配置日志
 logging.basicConfig(
@@ -16,12 +24,198 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 这些状态码表示暂时不可用, 按退避策略重连; 其余非 200 的响应不再重连
+RETRYABLE_STATUS = frozenset((408, 425, 429, 500, 502, 503, 504))
+
+
+class SSEPermanentError(Exception):
+    """服务端拒绝连接 (例如 401/403/404), 重连也不会成功"""
+
+
+class SSEEvent:
+    """一个 SSE 事件, 属性与 sseclient 的 Event 相同 (event/data/id/retry)"""
+
+    __slots__ = ('event', 'data', 'id', 'retry')
+
+    def __init__(self, event: str = 'message', data: str = '', id: Optional[str] = None,
+                 retry: Optional[int] = None):
+        self.event = event
+        self.data = data
+        self.id = id
+        self.retry = retry
+
+
+class SSEParser:
+    """text/event-stream 的逐行解析 (WHATWG HTML 规范 9.2.6)
+
+    - data 字段多行以换行拼接, 空行时分派事件; 没有 data 的事件不分派
+    - id 字段设置"最后事件 ID", 之后不带 id 的事件沿用它 (重连时作为 Last-Event-ID 发送)
+    - retry 字段只接受十进制数字, 为服务端建议的重连等待毫秒数
+    - 以冒号开头的行是注释 (心跳), 忽略
+    """
+
+    def __init__(self, last_event_id: Optional[str] = None):
+        self.last_event_id = last_event_id
+        self.retry: Optional[int] = None
+        self._event = ''
+        self._id: Optional[str] = None  # 当前事件自己的 id 字段
+        self._data: List[str] = []
+
+    def feed_line(self, line: str) -> Optional[SSEEvent]:
+        if not line:
+            return self._dispatch()
+        if line.startswith(':'):
+            return None
+        field, _, value = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+        if field == 'data':
+            self._data.append(value)
+        elif field == 'event':
+            self._event = value
+        elif field == 'id':
+            if '\0' not in value:
+                self.last_event_id = self._id = value
+        elif field == 'retry':
+            if value.isdigit():
+                self.retry = int(value)
+        return None
+
+    def _dispatch(self) -> Optional[SSEEvent]:
+        event_type, self._event = self._event, ''
+        event_id, self._id = self._id, None
+        if not self._data:
+            return None
+        data = '\n'.join(self._data)
+        self._data = []
+        return SSEEvent(event_type or 'message', data, event_id or None, self.retry)
+
+
+def _iso_timestamp(ts: float) -> str:
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ts)) + f'.{int(ts % 1 * 1_000_000):06d}Z'
+
+
+def _histogram_summary(histogram: LatencyHistogram) -> Dict[str, int]:
+    return {key: value for key, value in histogram.snapshot().items() if key != 'buckets'}
+
+
+class SSELogSink:
+    """结构化日志的批量写出
+
+    事件循环只把日志条目 (dict, 事件的 data 保持为原始字符串) 追加到内存队列;
+    后台线程每 flush_interval 秒或积累 batch_size 条时唤醒, 在线程中解析 data、序列化为 JSON 并写出:
+    有 log_file 时每批一次 write + flush, 否则逐条交给 logger (文件与控制台 handler)。
+    积压超过 max_pending 条时丢弃新条目并计数, 不让日志拖住读取。
+    """
+
+    def __init__(self, log_file: Optional[str] = None, flush_interval: float = 0.2, batch_size: int = 256,
+                 max_pending: int = 100_000):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._file = open(log_file, 'a', encoding='utf-8') if log_file else None
+        self._cond = threading.Condition()
+        self._queue = collections.deque()  # (写入时间ns, 条目)
+        self._closed = False
+        self.dropped = 0
+        self.written = 0
+        self.lag = LatencyHistogram()  # 条目产生到写出的延迟
+        self._thread = threading.Thread(target=self._write_loop, name='sse-log-sink', daemon=True)
+        self._thread.start()
+
+    def write(self, entry: Dict[str, Any]) -> None:
+        with self._cond:
+            if len(self._queue) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._queue.append((time.perf_counter_ns(), entry))
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def close(self) -> None:
+        """写出队列中剩余的条目并停止线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=10.0)
+        if self._file:
+            self._file.close()
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._cond:
+                if not self._closed and len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                batch = list(self._queue)
+                self._queue.clear()
+                closed = self._closed
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    logger.error(f"SSE日志写出失败: {e}")
+            if closed:
+                return
+
+    def _write_batch(self, batch) -> None:
+        lines = [json.dumps(self._format(entry)) for _, entry in batch]
+        if self._file:
+            self._file.write('\n'.join(lines) + '\n')
+            self._file.flush()
+        else:
+            for line in lines:
+                logger.info(line)
+        written = time.perf_counter_ns()
+        for queued, _ in batch:
+            self.lag.record((written - queued) // 1000)
+        self.written += len(batch)
+
+    @staticmethod
+    def _format(entry: Dict[str, Any]) -> Dict[str, Any]:
+        entry["timestamp"] = _iso_timestamp(entry["timestamp"])
+        raw = entry.pop("raw_data", None)
+        if raw is not None:
+            try:
+                entry["data"] = json.loads(raw) if raw else {}
+            except json.JSONDecodeError:
+                entry["data"] = {"raw_data": raw}
+        return entry
+
+
+class PipelineStats:
+    """读取 -> 队列 -> 处理器 各阶段的计数与延迟"""
+
+    def __init__(self):
+        self.received = 0  # 读取循环解析出的事件 (去重之后)
+        self.dropped = 0  # 队列满且策略为 drop 时丢弃的事件
+        self.blocked = 0  # 队列满且策略为 block 时读取循环等待的次数
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.blocked_time = LatencyHistogram()  # 读取循环因队列满而等待的时间
+        self.queue_lag = LatencyHistogram()  # 入队到被 worker 取出
+        self.process_time = LatencyHistogram()  # 日志条目生成 + 处理器耗时
+
 
 class SSEMCPLogger:
-    """客户端SSE请求MCP服务的记录器"""
+    """客户端SSE请求MCP服务的记录器
+
+    基于 asyncio 与 httpx: 连接断开后按带抖动的指数退避重连, 重连时以 Last-Event-ID 从最后收到的事件继续,
+    服务端 retry 字段作为退避的基准等待时间; 服务端重放已收到的事件 (相同 id) 时跳过。
+    多个端点或主题用多个实例, 通过 listen_all 在同一个事件循环中监听并共享连接池。
+
+    读取循环只解析事件并放入有界队列, 处理器在 workers 个 worker 中运行 (普通函数在线程池中执行,
+    不占用事件循环), 结构化日志由 SSELogSink 在后台线程中批量写出; 队列满时按 queue_policy
+    阻塞读取 (背压传回服务端) 或丢弃新事件。workers > 1 时事件的处理顺序不再保证。
+    """
 
     def __init__(self, mcp_endpoint: str, auth_token: str,
-                 client_id: str, subscription_topics: list):
+                 client_id: str, subscription_topics: list,
+                 initial_delay: float = 1.0, max_delay: float = 60.0, max_attempts: int = 0,
+                 read_timeout: float = 90.0, dedupe_window: int = 1024,
+                 session: Optional[httpx.AsyncClient] = None,
+                 queue_size: int = 1000, queue_policy: str = 'block', workers: int = 1,
+                 log_sink: Optional[SSELogSink] = None, metrics_interval: float = 60.0):
         """
         初始化SSE-MCP记录器
 
@@ -30,23 +224,67 @@ class SSEMCPLogger:
             auth_token: 认证令牌
             client_id: 客户端唯一标识
             subscription_topics: 订阅的主题列表
+            initial_delay: 服务端未发送 retry 时的基准重连等待秒数
+            max_delay: 退避等待的上限秒数
+            max_attempts: 连续重连失败多少次后放弃, 0 表示不限
+            read_timeout: 这么多秒没有收到任何数据 (包括心跳注释) 视为连接已断开
+            dedupe_window: 记住最近多少个事件 id, 用于跳过重连后重放的事件
+            session: 共享的 httpx.AsyncClient, 不提供时自行创建
+            queue_size: 读取循环与处理器之间的队列长度
+            queue_policy: 队列满时 'block' 暂停读取, 'drop' 丢弃新事件 (计入指标, 事件 id 仍视为已收到)
+            workers: 并发运行处理器的 worker 数
+            log_sink: 共享的日志写出器, 不提供时自行创建 (写入 logger)
+            metrics_interval: 每隔多少秒把各阶段指标记录一次, 0 表示只在停止监听时记录
         """
+        if queue_policy not in ('block', 'drop'):
+            raise ValueError(f"queue_policy must be 'block' or 'drop', not {queue_policy!r}")
         self.mcp_endpoint = mcp_endpoint
         self.auth_token = auth_token
         self.client_id = client_id
         self.subscription_topics = subscription_topics
-        self.session = None
-        self.client = None
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.read_timeout = read_timeout
+        self.session = session
+        self._owns_session = session is None
+        self.response: Optional[httpx.Response] = None
         self.session_id = None
 
+        # 断点续传状态, 跨重连保留
+        self.last_event_id: Optional[str] = None
+        self.retry_ms: Optional[int] = None
+        self.attempt = 0  # 连续失败的重连次数
+        self._retry_after: Optional[float] = None  # 上次 429/503 响应的 Retry-After 秒数, 只用于下一次等待
+        self._seen_ids = collections.deque(maxlen=dedupe_window)
+        self._seen_set = set()
+        self._parser: Optional[SSEParser] = None
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+        # 读取与处理解耦
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.workers = workers
+        self.metrics_interval = metrics_interval
+        self.log_sink = log_sink
+        self._owns_sink = log_sink is None
+        self.stats = PipelineStats()
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
     def _create_headers(self) -> Dict[str, str]:
         """创建请求头"""
-        return {
+        headers = {
             'Accept': 'text/event-stream',
+            'Cache-Control': 'no-cache',
             'Authorization': f'Bearer {self.auth_token}',
             'Client-Type': f'python-sse-client-v1.0',
             'Subscription': json.dumps({"topics": self.subscription_topics})
         }
+        if self.last_event_id:
+            headers['Last-Event-ID'] = self.last_event_id
+        return headers
 
     def _log_event(self, event_type: str, details: Dict[str, Any]):
         """
@@ -57,7 +295,7 @@ class SSEMCPLogger:
             details: 事件详情
         """
         log_entry = {
-            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "timestamp": time.time(),
             "level": "INFO",
             "event": event_type,
             "client_id": self.client_id,
@@ -65,90 +303,96 @@ class SSEMCPLogger:
             "session_id": self.session_id,
             **details
         }
-        logger.info(json.dumps(log_entry))
+        if self.log_sink is None:
+            if self._closing and self._task is None:
+                # 已停止 (disconnect 之后): 不再创建没有人关闭的写出线程, 直接交给 logger
+                logger.info(json.dumps(SSELogSink._format(log_entry)))
+                return
+            self.log_sink = SSELogSink()
+        # 序列化在写出线程中进行
+        self.log_sink.write(log_entry)
 
-    def connect(self):
-        """建立与MCP服务的SSE连接"""
+    async def connect(self):
+        """建立与MCP服务的SSE连接 (只尝试一次, 失败时抛出异常)"""
+        if self.session is None:
+            self.session = httpx.AsyncClient()
+        self._log_event("sse_connection_init", {
+            "subscription_topics": self.subscription_topics,
+            "last_event_id": self.last_event_id,
+            "attempt": self.attempt
+        })
         try:
-            self._log_event("sse_connection_init", {
-                "subscription_topics": self.subscription_topics
-            })
-
-            self.session = requests.Session()
-            self.client = SSEClient(self.mcp_endpoint, headers=self._create_headers(),
-                                    session=self.session)
-
-            # 记录连接成功
-            self._log_event("sse_connection_established", {})
-
-            # 处理初始消息获取session_id
-            for event in self.client:
-                if event.event == 'session-init':
-                    try:
-                        data = json.loads(event.data)
-                        self.session_id = data.get('session_id')
-                        self._log_event("session_initialized", {
-                            "session_id": self.session_id
-                        })
-                        break
-                    except json.JSONDecodeError:
-                        self._log_event("session_init_error", {
-                            "error": "Invalid JSON format",
-                            "data": event.data
-                        })
-        except Exception as e:
+            request = self.session.build_request('GET', self.mcp_endpoint, headers=self._create_headers(),
+                                                 timeout=httpx.Timeout(10.0, read=self.read_timeout))
+            response = await self.session.send(request, stream=True)
+        except httpx.HTTPError as e:
             self._log_event("connection_failed", {
                 "error": str(e),
                 "error_type": type(e).__name__
             })
             raise
+        if response.status_code != 200:
+            await response.aclose()
+            self._log_event("connection_failed", {
+                "error": f"HTTP {response.status_code}",
+                "error_type": "HTTPStatus"
+            })
+            if response.status_code == 204:
+                # 规范: 204 表示服务端要求客户端停止重连
+                raise SSEPermanentError("server answered 204 No Content")
+            if response.status_code not in RETRYABLE_STATUS:
+                raise SSEPermanentError(f"HTTP {response.status_code}")
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                self._retry_after = int(retry_after)
+            raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=request, response=response)
+        self.response = response
+        self._parser = SSEParser(self.last_event_id)
+        # 记录连接成功
+        self._log_event("sse_connection_established", {"resumed_from": self.last_event_id})
 
-    def start_listening(self, message_processor=None):
+    async def start_listening(self, message_processor=None):
         """
-        开始监听MCP服务的消息
+        开始监听MCP服务的消息, 连接断开时自动重连, 直到 disconnect 或重连失败次数超过 max_attempts
 
         Args:
-            message_processor: 可选的消息处理函数
+            message_processor: 可选的消息处理函数 (普通函数或协程函数), 参数为 SSEEvent
         """
-        if not self.client:
-            self.connect()
-
+        self._task = asyncio.current_task()
+        self._closing = False
         self._log_event("sse_listening_started", {})
-
+        pipeline = self._start_pipeline(message_processor)
         try:
-            for event in self.client:
-                if event.event:
-                    # 记录消息接收
-                    try:
-                        data = json.loads(event.data) if event.data else {}
-                    except json.JSONDecodeError:
-                        data = {"raw_data": event.data}
-
-                    message_details = {
-                        "event_type": event.event,
-                        "message_id": event.id,
-                        "data": data,
-                        "retry": getattr(event, 'retry', None)
-                    }
-
-                    self._log_event("sse_message_received", message_details)
-
-                    # 调用外部处理器
-                    if message_processor:
-                        try:
-                            message_processor(event)
-                        except Exception as e:
-                            self._log_event("message_processing_error", {
-                                "error": str(e),
-                                "event_type": event.event
-                            })
-        except requests.exceptions.RequestException as e:
-            self._log_event("connection_error", {
-                "error": str(e),
-                "error_type": type(e).__name__
-            })
-            # 可以添加重连逻辑
-            raise
+            while not self._closing:
+                try:
+                    if self.response is None:
+                        await self.connect()
+                    await self._read_events()
+                    self._log_event("sse_stream_ended", {"last_event_id": self.last_event_id})
+                except SSEPermanentError:
+                    raise
+                except httpx.HTTPError as e:
+                    self._log_event("connection_error", {
+                        "error": str(e),
+                        "error_type": type(e).__name__
+                    })
+                finally:
+                    await self._close_response()
+                if self._closing:
+                    break
+                self.attempt += 1
+                if self.max_attempts and self.attempt > self.max_attempts:
+                    raise ConnectionError(f"{self.mcp_endpoint}: gave up after {self.max_attempts} reconnect attempts")
+                delay = self._backoff_delay()
+                self._log_event("sse_reconnect_scheduled", {
+                    "attempt": self.attempt,
+                    "delay_s": round(delay, 3),
+                    "last_event_id": self.last_event_id
+                })
+                await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if not self._closing:
+                raise
         except Exception as e:
             self._log_event("unexpected_error", {
                 "error": str(e),
@@ -156,21 +400,225 @@ class SSEMCPLogger:
             })
             raise
         finally:
-            self._log_event("sse_listening_stopped", {})
+            self._task = None
+            await self._stop_pipeline(pipeline)
+            if self._owns_session and self.session is not None:
+                await self.session.aclose()
+                self.session = None
+            self._log_event("sse_listening_stopped", {"metrics": self.metrics()})
+            if self._owns_sink and self.log_sink is not None:
+                log_sink, self.log_sink = self.log_sink, None
+                await asyncio.to_thread(log_sink.close)  # 等待写出线程时不阻塞其他端点
 
-    def disconnect(self):
-        """断开与MCP服务的连接"""
-        if self.client:
+    def _start_pipeline(self, message_processor) -> List[asyncio.Task]:
+        self._queue = asyncio.Queue(self.queue_size)
+        if message_processor and not inspect.iscoroutinefunction(message_processor):
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='sse-processor')
+        tasks = [asyncio.create_task(self._worker(message_processor)) for _ in range(self.workers)]
+        if self.metrics_interval:
+            tasks.append(asyncio.create_task(self._report_metrics()))
+        return tasks
+
+    async def _stop_pipeline(self, tasks: List[asyncio.Task], drain_timeout: float = 10.0):
+        """处理完已入队的事件 (最多等待 drain_timeout 秒) 后停止 worker"""
+        try:
+            await asyncio.wait_for(asyncio.shield(self._queue.join()), drain_timeout)
+        except asyncio.TimeoutError:
+            self._log_event("sse_drain_timeout", {"pending": self._queue.qsize()})
+        except asyncio.CancelledError:
+            pass
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def metrics(self) -> Dict[str, Any]:
+        """各阶段指标: 计数, 队列深度, 以及排队、处理、日志写出与读取等待的延迟 (微秒)"""
+        stats = self.stats
+        metrics = {
+            "received": stats.received,
+            "processed": stats.processed,
+            "errors": stats.errors,
+            "dropped": stats.dropped,
+            "blocked": stats.blocked,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_max_depth": stats.max_depth,
+            "read_blocked": _histogram_summary(stats.blocked_time),
+            "queue_lag": _histogram_summary(stats.queue_lag),
+            "process": _histogram_summary(stats.process_time),
+        }
+        if self.log_sink is not None:
+            metrics["sink_lag"] = _histogram_summary(self.log_sink.lag)
+            metrics["sink_dropped"] = self.log_sink.dropped
+        return metrics
+
+    async def _report_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            self._log_event("sse_pipeline_metrics", self.metrics())
+
+    def _backoff_delay(self) -> float:
+        """基准为服务端 retry (否则 initial_delay), 每次失败翻倍, 不超过 max_delay, 在 [一半, 全部] 之间随机;
+        服务端给出 Retry-After 时至少等待这么久"""
+        base = self.retry_ms / 1000 if self.retry_ms is not None else self.initial_delay
+        delay = min(self.max_delay, base * (2 ** min(self.attempt - 1, 16)))
+        delay = random.uniform(delay / 2, delay)
+        retry_after, self._retry_after = self._retry_after, None
+        return max(delay, retry_after) if retry_after else delay
+
+    async def _read_events(self):
+        """读取循环: 只解析事件并入队"""
+        parser = self._parser
+        queue = self._queue
+        stats = self.stats
+        async for line in self.response.aiter_lines():
+            event = parser.feed_line(line)
+            if parser.retry is not None:
+                self.retry_ms = parser.retry
+            if not line:
+                # 分派点: 只有 id 没有 data 的事件不产生 SSEEvent, 但同样更新重连时发送的 Last-Event-ID
+                self.last_event_id = parser.last_event_id
+            if event is None:
+                continue
+            self.attempt = 0  # 收到事件后重新开始退避
+            if event.id is not None:
+                if event.id in self._seen_set:
+                    continue  # 重连后服务端重放的事件
+                if len(self._seen_ids) == self._seen_ids.maxlen:
+                    self._seen_set.discard(self._seen_ids[0])
+                self._seen_ids.append(event.id)
+                self._seen_set.add(event.id)
+            stats.received += 1
+            if event.event == 'session-init':
+                self._init_session(event)
+            item = (event, time.perf_counter_ns())
+            if queue.full():
+                if self.queue_policy == 'drop':
+                    stats.dropped += 1
+                    continue
+                stats.blocked += 1
+                await queue.put(item)
+                stats.blocked_time.record((time.perf_counter_ns() - item[1]) // 1000)
+            else:
+                queue.put_nowait(item)
+            stats.max_depth = max(stats.max_depth, queue.qsize())
+
+    def _init_session(self, event: SSEEvent):
+        try:
+            data = json.loads(event.data)
+        except json.JSONDecodeError:
+            self._log_event("session_init_error", {
+                "error": "Invalid JSON format",
+                "raw_data": event.data
+            })
+            return
+        if isinstance(data, dict):
+            self.session_id = data.get('session_id')
+            self._log_event("session_initialized", {
+                "session_id": self.session_id
+            })
+
+    async def _worker(self, message_processor):
+        queue = self._queue
+        stats = self.stats
+        loop = asyncio.get_running_loop()
+        while True:
+            event, enqueued = await queue.get()
+            started = time.perf_counter_ns()
+            stats.queue_lag.record((started - enqueued) // 1000)
+            try:
+                await self._handle_event(event, message_processor, loop)
+            finally:
+                stats.processed += 1
+                stats.process_time.record((time.perf_counter_ns() - started) // 1000)
+                queue.task_done()
+
+    async def _handle_event(self, event: SSEEvent, message_processor, loop):
+        # 记录消息接收; data 在日志写出线程中解析
+        self._log_event("sse_message_received", {
+            "event_type": event.event,
+            "message_id": event.id,
+            "raw_data": event.data,
+            "retry": event.retry
+        })
+
+        # 调用外部处理器
+        if message_processor:
             try:
-                self.client.close()
-                self._log_event("sse_connection_closed", {})
+                if self._executor is not None:
+                    result = await loop.run_in_executor(self._executor, message_processor, event)
+                else:
+                    result = message_processor(event)
+                if inspect.isawaitable(result):
+                    await result  # 普通函数也可能返回协程 (例如 functools.partial 包装的协程函数)
             except Exception as e:
-                self._log_event("connection_close_error", {
-                    "error": str(e)
+                self.stats.errors += 1
+                self._log_event("message_processing_error", {
+                    "error": str(e),
+                    "event_type": event.event
                 })
-            finally:
-                self.client = None
+
+    async def _close_response(self):
+        if self.response is not None:
+            response, self.response = self.response, None
+            try:
+                await response.aclose()
+            except Exception:
+                pass
+
+    async def disconnect(self):
+        """断开与MCP服务的连接并停止监听"""
+        self._closing = True
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        try:
+            await self._close_response()
+            self._log_event("sse_connection_closed", {})
+        except Exception as e:
+            self._log_event("connection_close_error", {
+                "error": str(e)
+            })
+        finally:
+            if self._owns_session and self.session is not None:
+                await self.session.aclose()
                 self.session = None
+            if self._owns_sink and self._task is None and self.log_sink is not None:
+                # 仍在监听时由 start_listening 退出时关闭
+                log_sink, self.log_sink = self.log_sink, None
+                await asyncio.to_thread(log_sink.close)
+
+
+async def listen_all(loggers: List[SSEMCPLogger], message_processor=None):
+    """
+    在一个事件循环中监听多个端点或主题, 共享一个连接池
+
+    某个端点不可恢复地失败 (SSEPermanentError 或超过 max_attempts) 时只记录并结束该端点, 其余继续监听。
+    """
+    # 每个流长期占用一条连接, 不限制连接数; 日志共用一个写出线程
+    log_sink = SSELogSink()
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=None)) as session:
+        for sse_logger in loggers:
+            if sse_logger.session is None:
+                sse_logger.session = session
+                sse_logger._owns_session = False
+            if sse_logger.log_sink is None:
+                sse_logger.log_sink = log_sink
+                sse_logger._owns_sink = False
+        try:
+            results = await asyncio.gather(*(sse_logger.start_listening(message_processor) for sse_logger in loggers),
+                                           return_exceptions=True)
+        finally:
+            await asyncio.to_thread(log_sink.close)
+            for sse_logger in loggers:
+                if sse_logger.log_sink is log_sink:
+                    # 之后的日志不能再写入已关闭的共享写出器
+                    sse_logger.log_sink = None
+                    sse_logger._owns_sink = True
+    for sse_logger, result in zip(loggers, results):
+        if isinstance(result, BaseException):
+            logger.error(f"{sse_logger.mcp_endpoint} 停止监听: {result!r}")
 
 
 if __name__ == "__main__":
@@ -192,14 +640,12 @@ if __name__ == "__main__":
                 print(f"无效配置数据格式: {event.data}")
 
 
-    logger = SSEMCPLogger(MCP_ENDPOINT, AUTH_TOKEN, CLIENT_ID, SUBSCRIPTION_TOPICS)
+    # 每个主题一个流, 在同一个事件循环中监听
+    loggers = [SSEMCPLogger(MCP_ENDPOINT, AUTH_TOKEN, CLIENT_ID, [topic]) for topic in SUBSCRIPTION_TOPICS]
 
     try:
-        logger.connect()
-        logger.start_listening(custom_processor)
+        asyncio.run(listen_all(loggers, custom_processor))
     except KeyboardInterrupt:
-        logger.disconnect()
         print("程序已停止")
     except Exception as e:
         print(f"发生错误: {e}")
-        logger.disconnect()
\ No newline at end of file
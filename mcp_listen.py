@@ -0,0 +1,17 @@
+import os
+
+UNIX_SCHEME = "unix://"
+
+
+def run_server(mcp, transport: str, **kwargs):
+    """启动 HTTP 传输的 MCP 服务
+
+    环境变量 MCP_LISTEN=unix:///run/mcp.sock 时 (与代理同机部署) 经 uvicorn 监听Unix域套接字,
+    否则按 kwargs (host/port/path) 调用 mcp.run 监听TCP端口。
+    """
+    listen = os.environ.get("MCP_LISTEN", "")
+    if listen.startswith(UNIX_SCHEME):
+        import uvicorn
+        uvicorn.run(mcp.http_app(path=kwargs.get("path"), transport=transport), uds=listen[len(UNIX_SCHEME):])
+    else:
+        mcp.run(transport=transport, **kwargs)
@@ -5,6 +5,8 @@ import  httpx
 
 from fastmcp import FastMCP
 
+from mcp_listen import run_server
+
 mcp_sse = FastMCP(
     name="mcp-sse-server",
     host="0.0.0.0",
@@ -42,4 +44,4 @@ if __name__ == '__main__': # 指令启动 uv run mcp_sse_server.py
     print("sse已注册的工具:")
     for tool_info in mcp_sse._tool_manager.list_tools():  # 这个方法是同步的
         print(f"- {tool_info.name}: {tool_info.description}")
-    mcp_sse.run(transport="sse")
\ No newline at end of file
+    run_server(mcp_sse, "sse")
@@ -5,6 +5,8 @@ import  httpx
 
 from fastmcp import FastMCP
 
+from mcp_listen import run_server
+
 mcp_streamable = FastMCP(
     name="mcp-streamable-server"
 )
@@ -68,4 +70,4 @@ if __name__ == '__main__': # 指令启动 uv run mcp_streamable_server.py
     print("streamable已注册的工具:")
     for tool_info in mcp_streamable._tool_manager.list_tools():  # 这个方法是同步的
         print(f"- {tool_info.name}: {tool_info.description}")
-    mcp_streamable.run(transport="streamable-http",host="0.0.0.0",port="5055",path="/streamable")
\ No newline at end of file
+    run_server(mcp_streamable, "streamable-http", host="0.0.0.0", port="5055", path="/streamable")
@@ -0,0 +1,92 @@
+import logging
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'logs'))
+
+import mcp_broker_backends  # noqa: E402
+from mcp_broker_backends import BackendSet, BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN  # noqa: E402
+
+
+class BreakerTest(unittest.TestCase):
+    """熔断状态机: 关闭 -> 打开 -> 冷却 -> 半开 -> 关闭"""
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(mcp_broker_backends.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        loggers = {'main': logging.getLogger('test_mcp_broker_backends')}
+        self.backends = BackendSet(['127.0.0.1:5051', '127.0.0.1:5052'], loggers, slow_start=0,
+                                   breaker_failures=3, breaker_timeout_us=1_000_000, breaker_cooldown=10.0)
+        self.primary = self.backends.backends['127.0.0.1:5051']
+        self.backend = self.backends.backends['127.0.0.1:5052']
+
+    def _open(self):
+        for _ in range(3):
+            self.backends.request_sent(self.backend)
+            self.backends.request_failed(self.backend)
+        self.assertEqual(self.backend.breaker, BREAKER_OPEN)
+
+    def test_open_cooldown_half_open_closed(self):
+        self._open()
+        self.assertIsNone(self.backends.alternate(self.primary))
+
+        # 冷却期间, 熔断之前发出的请求成功返回, 不能解除熔断
+        self.assertEqual(self.backends.request_sent(self.backend), 0)
+        self.backends.response_received(self.backend, 1000)
+        self.assertEqual(self.backend.breaker, BREAKER_OPEN)
+        self.assertIsNone(self.backends.alternate(self.primary))
+
+        # 冷却结束: 半开, 只分配一次, 只放行一个试探请求
+        self.now += 10.0
+        self.assertIs(self.backends.alternate(self.primary), self.backend)
+        self.assertEqual(self.backend.breaker, BREAKER_HALF_OPEN)
+        self.assertIsNone(self.backends.alternate(self.primary))
+        trial = self.backends.request_sent(self.backend)
+        self.assertNotEqual(trial, 0)
+        self.assertEqual(self.backends.request_sent(self.backend), 0)
+
+        # 其他请求成功不关闭, 试探请求成功才关闭
+        self.backends.response_received(self.backend, 1000)
+        self.assertEqual(self.backend.breaker, BREAKER_HALF_OPEN)
+        self.backends.response_received(self.backend, 1000, trial)
+        self.assertEqual(self.backend.breaker, BREAKER_CLOSED)
+        self.assertIs(self.backends.alternate(self.primary), self.backend)
+
+    def test_trial_failure_reopens(self):
+        self._open()
+        self.now += 10.0
+        trial = self.backends.request_sent(self.backend)
+        self.assertNotEqual(trial, 0)
+        self.backends.response_received(self.backend, 2_000_000, trial)  # 超过 breaker_timeout_us
+        self.assertEqual(self.backend.breaker, BREAKER_OPEN)
+        self.assertIsNone(self.backends.alternate(self.primary))
+
+    def test_trial_without_result_reopens(self):
+        self._open()
+        self.now += 10.0
+        self.assertNotEqual(self.backends.request_sent(self.backend), 0)
+        self.now += 1.0  # 试探请求在 breaker_timeout_us 内没有结果
+        self.assertIsNone(self.backends.alternate(self.primary))
+        self.assertEqual(self.backend.breaker, BREAKER_OPEN)
+
+
+class ReloadTest(unittest.TestCase):
+    def test_reload_keeps_existing_backends(self):
+        loggers = {'main': logging.getLogger('test_mcp_broker_backends')}
+        backends = BackendSet(['127.0.0.1:5051', 'unix:///run/mcp/server.sock'], loggers)
+        before = dict(backends.backends)
+        before['unix:///run/mcp/server.sock'].outstanding = 3
+        backends._apply([{'address': '127.0.0.1:5051', 'weight': 2},
+                         {'address': 'unix:///run/mcp/server.sock'}])
+        for address, backend in before.items():
+            self.assertIs(backends.backends[address], backend)
+        self.assertEqual(backends.backends['127.0.0.1:5051'].weight, 2.0)
+        self.assertEqual(backends.backends['unix:///run/mcp/server.sock'].outstanding, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
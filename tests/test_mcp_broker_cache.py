@@ -0,0 +1,137 @@
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'logs'))
+
+import mcp_broker_cache  # noqa: E402
+from mcp_broker_cache import ResponseCache  # noqa: E402
+from mcp_broker_jsonrpc import MESSAGE_REQUEST, MESSAGE_RESPONSE, peek_message  # noqa: E402
+
+
+def encode(message) -> bytes:
+    return json.dumps(message).encode('utf-8')
+
+
+def tool_call(request_id, name='search', **arguments) -> bytes:
+    return encode({'jsonrpc': '2.0', 'id': request_id, 'method': 'tools/call',
+                   'params': {'name': name, 'arguments': arguments}})
+
+
+def result(request_id, value) -> dict:
+    return {'jsonrpc': '2.0', 'id': request_id, 'result': {'content': [{'type': 'text', 'text': value}]}}
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """响应缓存: 白名单匹配、id 改写、TTL 过期与 LRU 淘汰"""
+
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch.object(mcp_broker_cache.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _store(self, cache, payload, value):
+        pending = {}
+        self.assertIsNone(cache.lookup(1, payload, pending))
+        request_id = json.loads(payload)['id']
+        response = encode(result(request_id, value))
+        cache.response_received(1, 1, response, pending)
+        self.assertEqual(pending, {})
+
+    def _cached(self, cache, payload):
+        cached = cache.lookup(1, payload, {})
+        return json.loads(cached[2]) if cached is not None else None
+
+    def test_hit_rewrites_id(self):
+        cache = ResponseCache(tool_names=['search'])
+        self._store(cache, tool_call(1, q='mcp'), 'found')
+        # 参数相同、id 与 _meta 不同的请求命中
+        payload = encode({'jsonrpc': '2.0', 'id': 'abc', 'method': 'tools/call',
+                          'params': {'name': 'search', 'arguments': {'q': 'mcp'}, '_meta': {'progressToken': 7}}})
+        self.assertEqual(self._cached(cache, payload), result('abc', 'found'))
+        self.assertIsNone(self._cached(cache, tool_call(2, q='other')))
+        self.assertIsNone(cache.lookup(1, tool_call(3, name='write', q='mcp'), {}))
+        self.assertEqual((cache.hits, cache.stores), (1, 1))
+
+    def test_errors_not_cached(self):
+        cache = ResponseCache(tool_names=['search'])
+        pending = {}
+        cache.lookup(1, tool_call(1, q='mcp'), pending)
+        cache.response_received(1, 1, encode({'jsonrpc': '2.0', 'id': 1, 'result': {'isError': True}}), pending)
+        self.assertIsNone(self._cached(cache, tool_call(2, q='mcp')))
+        self.assertEqual(cache.stores, 0)
+
+    def test_ttl(self):
+        cache = ResponseCache(tool_names=['search'], ttl=10)
+        self._store(cache, tool_call(1, q='mcp'), 'found')
+        self.now += 9.9
+        self.assertIsNotNone(self._cached(cache, tool_call(2, q='mcp')))
+        self.now += 0.1
+        self.assertIsNone(self._cached(cache, tool_call(3, q='mcp')))
+        self.assertEqual(cache.expirations, 1)
+        self.assertEqual(cache.snapshot()['entries'], 0)
+
+    def test_lru_by_entries(self):
+        cache = ResponseCache(tool_names=['search'], max_entries=2)
+        self._store(cache, tool_call(1, q='a'), 'A')
+        self._store(cache, tool_call(2, q='b'), 'B')
+        self.assertIsNotNone(self._cached(cache, tool_call(3, q='a')))  # a 成为最近使用
+        self._store(cache, tool_call(4, q='c'), 'C')
+        self.assertIsNone(self._cached(cache, tool_call(5, q='b')))
+        self.assertIsNotNone(self._cached(cache, tool_call(6, q='a')))
+        self.assertIsNotNone(self._cached(cache, tool_call(7, q='c')))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_lru_by_bytes(self):
+        size = len(encode(result(1, 'x' * 100)))
+        cache = ResponseCache(tool_names=['search'], max_bytes=size * 2)
+        self._store(cache, tool_call(1, q='a'), 'x' * 100)
+        self._store(cache, tool_call(2, q='b'), 'x' * 100)
+        self._store(cache, tool_call(3, q='c'), 'x' * 100)
+        self.assertIsNone(self._cached(cache, tool_call(4, q='a')))
+        self.assertLessEqual(cache.bytes, size * 2)
+        # 单个响应超过 max_bytes 时不缓存, 也不淘汰其他条目
+        self._store(cache, tool_call(5, q='d'), 'x' * 1000)
+        self.assertIsNone(self._cached(cache, tool_call(6, q='d')))
+        self.assertIsNotNone(self._cached(cache, tool_call(7, q='c')))
+
+    def test_forget(self):
+        cache = ResponseCache(tool_names=['search'])
+        pending = {}
+        payload = tool_call(9, q='mcp')
+        cache.lookup(1, payload, pending)
+        self.assertIn(9, pending)
+        ResponseCache.forget(payload, pending)
+        self.assertEqual(pending, {})
+
+
+class PeekMessageTest(unittest.TestCase):
+    """peek_message: 只扫描顶层字段取得消息类型与 id"""
+
+    def test_request_and_response(self):
+        self.assertEqual(peek_message(b'{"jsonrpc":"2.0","id":5,"method":"tools/call","params":{}}'),
+                         (MESSAGE_REQUEST, 5))
+        self.assertEqual(peek_message(b'{"jsonrpc":"2.0","result":{"id":1},"id":"abc"}'), (MESSAGE_RESPONSE, 'abc'))
+        self.assertEqual(peek_message(b' { "error" : {"code": -1}, "id" : 3 } '), (MESSAGE_RESPONSE, 3))
+
+    def test_nested_id_ignored(self):
+        # params/result 中的 id 不是消息的 id
+        self.assertEqual(peek_message(b'{"method":"x","params":{"id":1},"id":2}'), (MESSAGE_REQUEST, 2))
+        self.assertEqual(peek_message(b'{"method":"notifications/progress","params":{"id":1}}'), (None, None))
+
+    def test_prefix_of_large_frame(self):
+        payload = encode({'jsonrpc': '2.0', 'id': 7, 'result': {'text': 'x' * 10000}})
+        self.assertEqual(peek_message(payload[:40]), (MESSAGE_RESPONSE, 7))
+        self.assertEqual(peek_message(memoryview(payload)[:40]), (MESSAGE_RESPONSE, 7))
+
+    def test_not_a_message(self):
+        for payload in (b'', b'[1,2]', b'not json', b'{"id":null,"result":1}', b'{"id":[1],"method":"x"}',
+                        b'{"jsonrpc":"2.0"}'):
+            self.assertEqual(peek_message(payload), (None, None), payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import glob
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'logs'))
+
+import mcp_broker_capture  # noqa: E402
+from mcp_broker_capture import CaptureReader, CaptureWriter, CLIENT_TO_SERVER, SERVER_TO_CLIENT  # noqa: E402
+
+
+class CaptureQueryTest(unittest.TestCase):
+    """抓包分段的写入与按客户端、数据包类型、方向、时间范围的查询"""
+
+    def setUp(self):
+        self.now = 1_800_000_000.0
+        patcher = mock.patch.object(mcp_broker_capture.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.directory = temp.name
+
+        # 每个分段最多 10 秒: 三个时间段各写入一个分段
+        writer = CaptureWriter(self.directory, segment_seconds=10)
+        for second, client_id, direction, packet_type, payload in (
+                (0, 'client-a', CLIENT_TO_SERVER, 1, b'a-request-1'),
+                (1, 'client-a', SERVER_TO_CLIENT, 1, b'a-response-1'),
+                (2, 'client-b', CLIENT_TO_SERVER, 2, b'b-request-1'),
+                (20, 'client-b', SERVER_TO_CLIENT, 2, b'b-response-1'),
+                (40, 'client-a', CLIENT_TO_SERVER, 3, b'a-request-2'),
+        ):
+            self.now = 1_800_000_000.0 + second
+            writer.record(client_id, direction, 1, packet_type, payload)
+        writer.close()
+        self.reader = CaptureReader(self.directory)
+
+    def _payloads(self, **filters):
+        return [bytes(record['payload']) for record in self.reader.query(**filters)]
+
+    def test_segments(self):
+        self.assertEqual(len(self.reader.segments()), 3)
+        self.assertEqual(len(glob.glob(os.path.join(self.directory, 'capture-*.json'))), 3)
+
+    def test_query_all(self):
+        records = list(self.reader.query())
+        self.assertEqual([bytes(record['payload']) for record in records],
+                         [b'a-request-1', b'a-response-1', b'b-request-1', b'b-response-1', b'a-request-2'])
+        self.assertEqual(records[1]['client_id'], 'client-a')
+        self.assertEqual(records[1]['direction'], 's2c')
+
+    def test_query_by_client(self):
+        self.assertEqual(self._payloads(client_id='client-a'), [b'a-request-1', b'a-response-1', b'a-request-2'])
+        self.assertEqual(self._payloads(client_id='client-c'), [])
+
+    def test_query_by_packet_type_and_direction(self):
+        self.assertEqual(self._payloads(packet_type=2), [b'b-request-1', b'b-response-1'])
+        self.assertEqual(self._payloads(direction=SERVER_TO_CLIENT), [b'a-response-1', b'b-response-1'])
+        self.assertEqual(self._payloads(client_id='client-a', direction=CLIENT_TO_SERVER, packet_type=3),
+                         [b'a-request-2'])
+
+    def test_query_by_time_range(self):
+        start = 1_800_000_000.0
+        self.assertEqual(self._payloads(since=start + 1, until=start + 20),
+                         [b'a-response-1', b'b-request-1', b'b-response-1'])
+        self.assertEqual(self._payloads(since=start + 30), [b'a-request-2'])
+        self.assertEqual(self._payloads(until=start - 1), [])
+
+    def test_segment_still_being_written(self):
+        # 没有摘要的分段 (仍在写入) 只扫描索引, 已刷盘的记录照常返回
+        writer = CaptureWriter(self.directory, flush_interval=0)
+        self.now += 100
+        writer.record('client-c', CLIENT_TO_SERVER, 1, 5, b'live')
+        self.now += 1
+        writer.record('client-c', CLIENT_TO_SERVER, 1, 5, b'live-2')
+        self.assertEqual(self._payloads(client_id='client-c'), [b'live', b'live-2'])
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
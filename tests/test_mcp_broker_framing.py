@@ -0,0 +1,122 @@
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'logs'))
+
+from mcp_broker import FastMCPFrameReader, FrameTooLargeError, MemoryBudget  # noqa: E402
+
+HEADER = struct.Struct('>HHI')
+
+
+def frame(packet_type: int, payload: bytes, version: int = 1) -> bytes:
+    return HEADER.pack(version, packet_type, len(payload)) + payload
+
+
+class FrameReaderTest(unittest.TestCase):
+    """FastMCPFrameReader: 一次接收解析多帧, 跨多次接收拼帧, 大帧扩容与上限"""
+
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+        self.sender.settimeout(5)
+        self.receiver.settimeout(5)
+        self.addCleanup(self.sender.close)
+        self.addCleanup(self.receiver.close)
+
+    def _read_all(self, reader):
+        return [(version, packet_type, bytes(data)) for version, packet_type, data in reader]
+
+    def test_many_frames_in_one_recv(self):
+        frames = [(1, n, b'{"id":%d}' % n) for n in range(50)]
+        self.sender.sendall(b''.join(frame(packet_type, data, version) for version, packet_type, data in frames))
+        self.sender.close()
+        reader = FastMCPFrameReader(self.receiver)
+        self.assertEqual(self._read_all(reader), frames)
+        self.assertEqual(reader.frame_count, 50)
+        self.assertLess(reader.recv_calls, 50)
+
+    def test_frame_split_across_reads(self):
+        data = frame(7, b'x' * 100) + frame(8, b'tail')
+        # 头部与数据都被拆开: 读取方先收到不完整的头部, 再收到剩余部分
+        self.sender.sendall(data[:5])
+
+        def send_rest():
+            self.sender.sendall(data[5:60])
+            time.sleep(0.05)
+            self.sender.sendall(data[60:])
+            self.sender.close()
+
+        timer = threading.Timer(0.05, send_rest)
+        timer.start()
+        self.addCleanup(timer.join)
+        reader = FastMCPFrameReader(self.receiver)
+        self.assertEqual(self._read_all(reader), [(1, 7, b'x' * 100), (1, 8, b'tail')])
+        self.assertGreaterEqual(reader.recv_calls, 3)
+
+    def test_frame_larger_than_buffer(self):
+        payload = bytes(range(256)) * 4
+        self.sender.sendall(frame(1, payload) + frame(2, b'small'))
+        self.sender.close()
+        reader = FastMCPFrameReader(self.receiver, buffer_size=64)
+        self.assertEqual(self._read_all(reader), [(1, 1, payload), (1, 2, b'small')])
+
+    def test_truncated_frame(self):
+        self.sender.sendall(frame(1, b'complete') + frame(2, b'truncated')[:-3])
+        self.sender.close()
+        reader = iter(FastMCPFrameReader(self.receiver))
+        self.assertEqual(bytes(next(reader)[2]), b'complete')
+        with self.assertRaises(EOFError):
+            next(reader)
+
+    def test_oversized_frame_rejected(self):
+        budget = MemoryBudget(max_frame_size=1024, connection_limit=4096)
+        # 只发送头部: 按头部中的长度就应拒绝, 不等待也不分配数据
+        self.sender.sendall(HEADER.pack(1, 1, 1024 * 1024))
+        reader = FastMCPFrameReader(self.receiver, buffer_size=64, budget=budget)
+        with self.assertRaises(FrameTooLargeError):
+            next(iter(reader))
+        self.assertEqual(budget.used, 0)
+
+    def test_frame_over_connection_limit(self):
+        budget = MemoryBudget(max_frame_size=1024 * 1024, connection_limit=256)
+        payload = b'y' * 1000
+        self.sender.sendall(frame(1, payload) + frame(2, b'next'))
+        self.sender.close()
+
+        reader = iter(FastMCPFrameReader(self.receiver, buffer_size=64, budget=budget))
+        with self.assertRaises(FrameTooLargeError):
+            next(reader)
+
+    def test_stream_large_frame(self):
+        budget = MemoryBudget(max_frame_size=1024 * 1024, connection_limit=256)
+        payload = bytes(range(256)) * 8
+        self.sender.sendall(frame(3, payload) + frame(4, b'next'))
+        self.sender.close()
+        destination, sink = socket.socketpair()
+        self.addCleanup(destination.close)
+        self.addCleanup(sink.close)
+
+        reader = FastMCPFrameReader(self.receiver, buffer_size=64, budget=budget, stream_large=True)
+        frames = iter(reader)
+        version, packet_type, data = next(frames)
+        self.assertEqual((version, packet_type, data), (1, 3, None))
+        self.assertEqual(reader.current_length, len(payload))
+        reader.relay_current(destination)
+        destination.close()
+        relayed = b''
+        while True:
+            chunk = sink.recv(65536)
+            if not chunk:
+                break
+            relayed += chunk
+        self.assertEqual(relayed, frame(3, payload))
+        self.assertEqual([(v, t, bytes(d)) for v, t, d in frames], [(1, 4, b'next')])
+        self.assertEqual(budget.used, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
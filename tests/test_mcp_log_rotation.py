@@ -0,0 +1,109 @@
+import glob
+import gzip
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'logs'))
+
+from mcp_log_rotation import SegmentedLog, parse_size  # noqa: E402
+
+
+class SegmentedLogTest(unittest.TestCase):
+    """分段滚动、压缩与保留规则"""
+
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.directory = temp.name
+        self.path = os.path.join(self.directory, 'mcp_io.log')
+
+    def _segments(self):
+        return sorted(glob.glob(glob.escape(self.path) + '.[0-9]*.gz'))
+
+    def _old_segment(self, stamp: str, age: float, size: int = 100) -> str:
+        segment = f"{self.path}.{stamp}.gz"
+        with open(segment, 'wb') as f:
+            f.write(b'x' * size)
+        mtime = time.time() - age
+        os.utime(segment, (mtime, mtime))
+        return segment
+
+    def test_rotate_by_size(self):
+        log = SegmentedLog(self.path, max_bytes=100)
+        lines = [f"line {n:03d} {'.' * 40}\n" for n in range(10)]
+        for line in lines:
+            log.write(line)
+        log.close()
+        segments = self._segments()
+        self.assertGreaterEqual(len(segments), 3)
+        self.assertEqual(glob.glob(self.path + '.*[0-9]'), [])  # 已滚动的分段都已压缩
+        data = b''
+        for segment in sorted(segments, key=os.path.getmtime):
+            with gzip.open(segment, 'rb') as f:
+                data += f.read()
+        with open(self.path, 'rb') as f:
+            data += f.read()
+        self.assertEqual(sorted(data.decode('utf-8').splitlines(keepends=True)), lines)
+
+    def test_startup_rolls_previous_log(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('previous run\n')
+        log = SegmentedLog(self.path)
+        log.write('this run\n')
+        log.close()
+        segments = self._segments()
+        self.assertEqual(len(segments), 1)
+        with gzip.open(segments[0], 'rb') as f:
+            self.assertEqual(f.read(), b'previous run\n')
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'this run\n')
+
+    def test_retain_count(self):
+        oldest = self._old_segment('20260101-000000', age=300)
+        older = self._old_segment('20260101-000100', age=200)
+        newer = self._old_segment('20260101-000200', age=100)
+        # 同目录下其他以 mcp_io.log. 开头的文件不是分段, 不参与保留也不会被删除
+        others = [os.path.join(self.directory, name) for name in ('mcp_io.log.bak', 'mcp_io.log.old.gz')]
+        for other in others:
+            with open(other, 'wb') as f:
+                f.write(b'keep')
+            os.utime(other, (0, 0))
+
+        log = SegmentedLog(self.path, max_bytes=10, retain=2)
+        log.write('rotate now\n')
+        log.close()
+        segments = self._segments()
+        self.assertEqual(len(segments), 2)
+        self.assertIn(newer, segments)
+        self.assertNotIn(oldest, segments)
+        self.assertNotIn(older, segments)
+        for other in others:
+            self.assertTrue(os.path.exists(other))
+
+    def test_retain_bytes(self):
+        oldest = self._old_segment('20260101-000000', age=300, size=400)
+        older = self._old_segment('20260101-000100', age=200, size=400)
+        newer = self._old_segment('20260101-000200', age=100, size=400)
+        log = SegmentedLog(self.path, max_bytes=10, retain=0, retain_bytes=1000)
+        log.write('rotate now\n')
+        log.close()
+        segments = self._segments()
+        self.assertIn(newer, segments)
+        self.assertIn(older, segments)
+        self.assertNotIn(oldest, segments)
+        self.assertLessEqual(sum(os.path.getsize(segment) for segment in segments), 1000)
+
+
+class ParseSizeTest(unittest.TestCase):
+    def test_units(self):
+        self.assertEqual(parse_size('512'), 512)
+        self.assertEqual(parse_size('64K'), 64 * 1024)
+        self.assertEqual(parse_size('1.5m'), int(1.5 * 1024 * 1024))
+        self.assertEqual(parse_size('1GB'), 1024 ** 3)
+
+
+if __name__ == '__main__':
+    unittest.main()